@@ -0,0 +1,84 @@
+import os
+import asyncio
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from . import models, database
+
+ACTIVIDADES_FLUSH_MS = float(os.getenv("ACTIVIDADES_FLUSH_MS", "200"))
+ACTIVIDADES_LOTE_MAX = int(os.getenv("ACTIVIDADES_LOTE_MAX", "500"))
+
+
+class ActivityWriter:
+    """Append-only writer for the activity log.
+
+    Agents from every job append here instead of committing their own rows; a background task
+    writes whatever accumulated every ACTIVIDADES_FLUSH_MS in one multi-row INSERT, so a burst of
+    N agent messages costs one transaction instead of N.
+    """
+
+    def __init__(self, intervalo_ms: float = ACTIVIDADES_FLUSH_MS, lote_max: int = ACTIVIDADES_LOTE_MAX):
+        self.intervalo = intervalo_ms / 1000
+        self.lote_max = lote_max
+        self.pendientes: List[Dict] = []
+        self.lock = threading.Lock()
+        self.task: Optional[asyncio.Task] = None
+        self.stats = {"escritas": 0, "lotes": 0}
+
+    def registrar(self, agente: str, tipo: str, descripcion: str):
+        self.registrar_muchas([{"agente": agente, "tipo": tipo, "descripcion": descripcion}])
+
+    def registrar_muchas(self, actividades: List[Dict]):
+        # Timestamped when reported, not when written
+        ahora = datetime.utcnow()
+        filas = [{
+            "agente": a.get("agente") or "System",
+            "tipo": a.get("tipo") or "info",
+            "descripcion": a.get("descripcion") or "",
+            "timestamp": ahora,
+        } for a in actividades]
+        with self.lock:
+            self.pendientes.extend(filas)
+        if self.task is None:
+            # Not running under the app (scripts, simulator): write through
+            self.flush()
+
+    def flush(self) -> int:
+        with self.lock:
+            filas, self.pendientes = self.pendientes[:self.lote_max], self.pendientes[self.lote_max:]
+        if not filas:
+            return 0
+        try:
+            with database.unidad_de_trabajo() as db:
+                db.add_all([models.Actividad(**f) for f in filas])
+        except Exception:
+            with self.lock:
+                self.pendientes[:0] = filas
+            raise
+        self.stats["escritas"] += len(filas)
+        self.stats["lotes"] += 1
+        return len(filas)
+
+    async def iniciar(self):
+        self.task = asyncio.create_task(self._loop())
+
+    async def detener(self):
+        if self.task:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        while await asyncio.to_thread(self.flush):
+            pass
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.intervalo)
+            try:
+                while self.pendientes and await asyncio.to_thread(self.flush):
+                    pass
+            except Exception as e:
+                print(f"[Actividades] Error escribiendo lote: {e}", flush=True)
+
+
+escritor = ActivityWriter()
@@ -1,122 +1,403 @@
 import os
 import json
 import time
-from typing import List, Dict, Any, Optional
-from openai import OpenAI
+import asyncio
+from typing import List, Dict, Any, Callable, Optional, Tuple
+import openai
+from openai import AsyncOpenAI
 from dotenv import load_dotenv
-from sqlalchemy.orm import Session
 from . import models
+from .llm_client import OPENROUTER_API_KEY
+from .ratelimit import llm_gate
+from .llm_cache import cache, clave, tag
+from . import metrics
+from . import respuestas
+from .enrutador import enrutador
 
 load_dotenv()
 
-OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
-BASE_URL = "https://openrouter.ai/api/v1"
-DEFAULT_MODEL = "nvidia/nemotron-nano-12b-v2-vl:free"
+# Completion size assumed when reserving tokens/minute before a call
+TOKENS_RESPUESTA_ESTIMADOS = int(os.getenv("LLM_TOKENS_RESPUESTA", "400"))
+# Structured output requested from the provider: json_schema, json_object or no
+SALIDA_ESTRUCTURADA = os.getenv("LLM_SALIDA_ESTRUCTURADA", "json_schema")
+# Stream completions: fields are available (al_campo) before the answer is complete
+STREAMING = os.getenv("LLM_STREAMING", "1").lower() in ("1", "true", "si")
+
+# Models whose provider rejected response_format (400): asked for plain text from then on
+_sin_salida_estructurada: set = set()
+
+
+# Token usage per agent since startup (GET /api/llm/stats)
+uso_tokens: Dict[str, Dict[str, int]] = {}
+
+
+def _compacto(data: Any) -> str:
+    # No whitespace and raw UTF-8: noticeably fewer prompt tokens than json.dumps defaults
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False)
+
+
+def _recursos(hosp: List[Dict] = (), veh: List[Dict] = (), decision: Optional[Dict] = None) -> List[str]:
+    """Cache tags for the hospitals/vehicles a prompt talks about (see llm_cache.ResponseCache)."""
+    hosp_ids = {h.get("hospital_id", h.get("id")) for h in hosp}
+    veh_ids = {v.get("vehiculo_id", v.get("id")) for v in veh}
+    if decision:
+        hosp_ids.add(decision.get("hospital_id"))
+        veh_ids.add(decision.get("vehiculo_id"))
+    return [tag("hospitales", i) for i in hosp_ids if i] + [tag("vehiculos", i) for i in veh_ids if i]
+
+
+def _retry_after(error: openai.APIStatusError) -> Optional[float]:
+    try:
+        return float(error.response.headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def llm_habilitado() -> bool:
+    return bool(OPENROUTER_API_KEY)
+
+def emergencia_contexto(emergencia: Dict) -> Dict:
+    # Only what the prompts need from the dispatch context (see scoring.emergencia_candidato)
+    return {
+        "tipo": emergencia["tipo"],
+        "descripcion": emergencia["descripcion"],
+        "zona_id": emergencia["zona_id"]
+    }
+
+def hospitales_contexto(hospitales: List[Dict]) -> List[Dict]:
+    # Capacity rows (capacidad.vista): doctors are already counted per specialty
+    hosp_data = []
+    for h in hospitales:
+        hosp_data.append({
+            "id": h["id"],
+            "nombre": h["nombre"],
+            "zona_id": h["zona_id"],
+            "ocupacion": f"{h['ocupacion_actual']}/{h['capacidad_total']}",
+            "recursos": {
+                "antiescorpionico": h["tiene_suero_antiescorpionico"],
+                "trauma": h["tiene_unidad_trauma"],
+                "cardiologia": h["tiene_cardiologia"],
+                "pediatria": h["tiene_pediatria"],
+                "quemados": h["tiene_unidad_quemados"]
+            },
+            "doctores_disponibles": h["especialidades"]
+        })
+    return hosp_data
+
+def vehiculos_contexto(vehiculos: List[models.VehiculoRescate], etas: Optional[Dict[int, float]] = None) -> List[Dict]:
+    veh_data = []
+    for v in vehiculos:
+        item = {
+            "id": v.id,
+            "nombre": v.nombre,
+            "tipo": v.tipo,
+            "estado": v.estado,
+            "zona_id": v.zona_id
+        }
+        # Computed ETA (geo.eta_min), so the agent does not have to guess it
+        if etas and v.id in etas:
+            item["eta_min"] = etas[v.id]
+        veh_data.append(item)
+    return veh_data
+
 
 class AgentSystem:
-    def __init__(self, db: Session):
-        self.db = db
-        self.client = OpenAI(
-            base_url=BASE_URL,
-            api_key=OPENROUTER_API_KEY
-        )
-        self.model = os.getenv("LLM_MODEL", DEFAULT_MODEL)
-
-    def _call_llm(self, system_prompt: str, user_prompt: str, agent_name: str = "Agent") -> str:
+    """LLM agents. Methods take plain dicts (see *_contexto) so they never touch the DB from the event loop.
+
+    The client is the application-scoped one from llm_client.crear_cliente(); AgentSystem never
+    creates or closes connections itself.
+    """
+
+    def __init__(self, client: AsyncOpenAI):
+        self.client = client
+        # Primary model; each call is routed across the LLM_MODELOS pool (see enrutador.py)
+        self.model = enrutador.modelos[0]
+
+    def _registrar_uso(self, agent_name: str, usage, content: str, system_prompt: str, user_prompt: str):
+        if usage:
+            prompt_tokens, completion_tokens = usage.prompt_tokens, usage.completion_tokens
+        else:
+            # Provider did not report usage (usual when streaming): ~4 chars per token
+            prompt_tokens, completion_tokens = (len(system_prompt) + len(user_prompt)) // 4, len(content) // 4
+        total = uso_tokens.setdefault(agent_name, {"llamadas": 0, "prompt_tokens": 0, "completion_tokens": 0})
+        total["llamadas"] += 1
+        total["prompt_tokens"] += prompt_tokens
+        total["completion_tokens"] += completion_tokens
+        metrics.registrar_tokens(agent_name, prompt_tokens, completion_tokens)
+        print(f"[{agent_name}] Tokens: prompt={prompt_tokens} completion={completion_tokens}", flush=True)
+        return prompt_tokens, completion_tokens
+
+    async def _call_llm(self, system_prompt: str, user_prompt: str, agent_name: str = "Agent",
+                        payload: Any = None, recursos: List[str] = (),
+                        esquema: Optional[type] = None, al_campo: Optional[Callable] = None) -> str:
+        """`al_campo(ruta, valor)` is called for each field of the answer as soon as it has been
+        streamed (respuestas.ParserIncremental); the complete text is returned as usual."""
         if not OPENROUTER_API_KEY:
             print(f"[{agent_name}] WARNING: OPENROUTER_API_KEY not set. Using dummy response.", flush=True)
+            metrics.contar(metrics.llm_fallbacks, agente=agent_name, motivo="sin_api_key")
             return "{}" 
-        
-        max_retries = 3
-        base_delay = 2
 
-        for attempt in range(max_retries):
-            print(f"[{agent_name}] Calling LLM ({self.model})... (Attempt {attempt+1}/{max_retries})", flush=True)
-            try:
-                completion = self.client.chat.completions.create(
-                    model=self.model,
-                    messages=[
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": user_prompt},
-                    ],
-                    temperature=0.2,
-                    # timeout=30.0, # 30 second timeout
-                )
-                response = completion.choices[0].message.content
+        # Any model of the pool may have produced a cached answer
+        cache_key = clave(",".join(enrutador.modelos), system_prompt, payload if payload is not None else user_prompt)
+        cached = cache.get(cache_key)
+        if cached is not None:
+            print(f"[{agent_name}] Cache hit.", flush=True)
+            metrics.contar(metrics.llm_cache_hits, agente=agent_name)
+            return cached
+        async with metrics.span("llm", agente=agent_name) as sp:
+            response = await self._call_llm_enrutado(system_prompt, user_prompt, agent_name, sp, esquema, al_campo)
+        if response and response.strip() not in ("", "{}"):
+            cache.set(cache_key, response, recursos)
+        return response
+
+    async def _call_llm_enrutado(self, system_prompt: str, user_prompt: str, agent_name: str, sp: metrics.span,
+                                 esquema: Optional[type], al_campo: Optional[Callable]) -> str:
+        """Sends the call to the best model of the routing order. If it has not answered after
+        LLM_HEDGE_MS, the next model races it (hedged request); when a model fails, the next one is
+        tried. The first valid answer wins and the others are cancelled. Nothing outlives LLM_DEADLINE_S."""
+        modelos = enrutador.orden()
+        limite = time.monotonic() + enrutador.deadline_s
+        hedge_en = time.monotonic() + enrutador.hedge_s if enrutador.hedge_s > 0 else None
+        tareas: Dict[asyncio.Task, str] = {}
+        # Streamed fields come from a single model: the first one to emit any
+        emisor: List[str] = []
+
+        def campo_de(modelo: str) -> Optional[Callable]:
+            if al_campo is None:
+                return None
+
+            def campo(ruta, valor):
+                if not emisor:
+                    emisor.append(modelo)
+                if emisor[0] == modelo:
+                    al_campo(ruta, valor)
+            return campo
+
+        def lanzar():
+            modelo = modelos.pop(0)
+            tareas[asyncio.create_task(self._call_llm_remoto(
+                system_prompt, user_prompt, agent_name, sp, esquema, campo_de(modelo), modelo))] = modelo
+            return modelo
+
+        coberturas = set()
+        lanzar()
+        try:
+            while tareas:
+                ahora = time.monotonic()
+                if ahora >= limite:
+                    print(f"[{agent_name}] Deadline de {enrutador.deadline_s:.0f}s agotado.", flush=True)
+                    sp.set(fallback="deadline")
+                    metrics.contar(metrics.llm_fallbacks, agente=agent_name, motivo="deadline")
+                    return "{}"
+                espera = limite - ahora
+                if hedge_en is not None and modelos:
+                    espera = min(espera, max(0.0, hedge_en - ahora))
+                hechas, _ = await asyncio.wait(tareas, timeout=espera, return_when=asyncio.FIRST_COMPLETED)
+                for tarea in hechas:
+                    modelo = tareas.pop(tarea)
+                    response = tarea.result() if not tarea.exception() else ""
+                    if self._valida(response):
+                        sp.set(modelo=modelo)
+                        if modelo in coberturas:
+                            enrutador.hedge(ganado=True)
+                            metrics.contar(metrics.llm_hedges, agente=agent_name, resultado="ganado")
+                        return response
+                    print(f"[{agent_name}] Sin respuesta válida de {modelo}.", flush=True)
+                if modelos and not tareas:
+                    # Failed: the next model takes over (and may be hedged in turn)
+                    print(f"[{agent_name}] Fallback hacia {lanzar()}.", flush=True)
+                    hedge_en = time.monotonic() + enrutador.hedge_s if enrutador.hedge_s > 0 else None
+                elif modelos and hedge_en is not None and time.monotonic() >= hedge_en:
+                    hedge_en = None  # one hedge at a time
+                    coberturas.add(modelos[0])
+                    enrutador.hedge(ganado=False)
+                    metrics.contar(metrics.llm_hedges, agente=agent_name, resultado="lanzado")
+                    print(f"[{agent_name}] Hedge hacia {lanzar()}.", flush=True)
+            return "{}"
+        finally:
+            for tarea in tareas:
+                tarea.cancel()
+            await asyncio.gather(*tareas, return_exceptions=True)
+
+    def _valida(self, response: str) -> bool:
+        if not response or response.strip() in ("", "{}"):
+            return False
+        try:
+            respuestas.extraer_json(response)
+            return True
+        except ValueError:
+            return False
+
+    async def _call_llm_remoto(self, system_prompt: str, user_prompt: str, agent_name: str, sp: metrics.span,
+                               esquema: Optional[type] = None, al_campo: Optional[Callable] = None,
+                               modelo: Optional[str] = None) -> str:
+        # "{}" is the local fallback: the agents return no proposals and the rule-based
+        # dispatch (scoring.py) stands.
+        def fallback(motivo: str) -> str:
+            sp.set(fallback=motivo)
+            metrics.contar(metrics.llm_fallbacks, agente=agent_name, motivo=motivo)
+            return "{}"
+
+        def reintento(motivo: str, attempt: int):
+            sp.set(reintentos=attempt + 1)
+            metrics.contar(metrics.llm_reintentos, agente=agent_name, motivo=motivo)
+
+        if not llm_gate.breaker.permitir():
+            print(f"[{agent_name}] Circuit breaker abierto: se omite la llamada al LLM.", flush=True)
+            return fallback("circuito_abierto")
+
+        # This call may be the breaker's probe: every way out of it (a 400, a lost hedge, a deadline)
+        # must settle the half-open state, not only exito()/fallo()
+        prueba = llm_gate.breaker.estado == "semi_abierto"
+        try:
+            modelo = modelo or self.model
+
+            max_retries = 3
+            base_delay = 2
+            tokens_estimados = (len(system_prompt) + len(user_prompt)) // 4 + TOKENS_RESPUESTA_ESTIMADOS
+            params = {"temperature": 0.2}
+            formato = None
+            if esquema is not None and modelo not in _sin_salida_estructurada:
+                formato = respuestas.response_format(esquema, SALIDA_ESTRUCTURADA)
+
+            for attempt in range(max_retries):
+                # Every retry asks the breaker again; the probe keeps its turn through its own retries
+                if attempt and not (prueba and llm_gate.breaker.estado == "semi_abierto"):
+                    if not llm_gate.breaker.permitir():
+                        return fallback("circuito_abierto")
+                    prueba = prueba or llm_gate.breaker.estado == "semi_abierto"
+                await llm_gate.acquire(tokens_estimados)
+                print(f"[{agent_name}] Calling LLM ({modelo})... (Attempt {attempt+1}/{max_retries})", flush=True)
+                try:
+                    response, usage = await self._pedir(
+                        [{"role": "system", "content": system_prompt}, {"role": "user", "content": user_prompt}],
+                        {**params, **({"response_format": formato} if formato else {})},
+                        agent_name, sp, al_campo, modelo
+                    )
+                except openai.RateLimitError as e:
+                    # Back off the whole process, honouring Retry-After when the provider sends it.
+                    # Throttling is not an outage: it does not count towards opening the breaker
+                    wait_time = _retry_after(e) or base_delay * (3 ** attempt)
+                    print(f"[{agent_name}] Rate limit hit (429). Retrying in {wait_time}s...", flush=True)
+                    reintento("429", attempt)
+                    llm_gate.pausar(wait_time)
+                    continue
+                except openai.BadRequestError as e:
+                    # Some free providers reject sampling parameters: retry once without them
+                    print(f"[{agent_name}] Bad Request (400): {e}", flush=True)
+                    if formato:
+                        # Provider/model without structured output: remember it, the tolerant parser copes
+                        print(f"[{agent_name}] Retrying without response_format...", flush=True)
+                        reintento("400", attempt)
+                        _sin_salida_estructurada.add(modelo)
+                        formato = None
+                        continue
+                    if not params:
+                        return fallback("400")
+                    print(f"[{agent_name}] Retrying without parameters...", flush=True)
+                    reintento("400", attempt)
+                    params = {}
+                    continue
+                except (openai.APITimeoutError, openai.APIConnectionError, openai.InternalServerError) as e:
+                    wait_time = base_delay * (2 ** attempt)
+                    print(f"[{agent_name}] LLM no disponible ({type(e).__name__}). Retrying in {wait_time}s...", flush=True)
+                    llm_gate.breaker.fallo()
+                    if llm_gate.breaker.estado == "abierto":
+                        # No point waiting for a retry the breaker will refuse
+                        return fallback("circuito_abierto")
+                    reintento("no_disponible", attempt)
+                    await asyncio.sleep(wait_time)
+                    continue
+                except openai.APIError as e:
+                    print(f"[{agent_name}] LLM Error: {e}", flush=True)
+                    llm_gate.breaker.fallo()
+                    return fallback("error_api")
+
+                llm_gate.breaker.exito()
                 print(f"[{agent_name}] Response received (len={len(response)}).", flush=True)
+                prompt_tokens, completion_tokens = self._registrar_uso(agent_name, usage, response, system_prompt, user_prompt)
+                sp.set(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+                llm_gate.registrar_tokens(tokens_estimados, prompt_tokens + completion_tokens)
                 return response
-            except Exception as e:
-                error_str = str(e)
-                print(f"[{agent_name}] LLM Error: {error_str}", flush=True)
-                
-                # Check for Rate Limit (429)
-                if "429" in error_str:
-                    # Increase wait time significantly for 429s
-                    wait_time = base_delay * (3 ** attempt) # More aggressive backoff
-                    print(f"[{agent_name}] Rate limit hit (429). Retrying in {wait_time}s...", flush=True)
-                    time.sleep(wait_time)
+
+            return fallback("reintentos_agotados")
+        finally:
+            if prueba:
+                llm_gate.breaker.cancelar_prueba()
+
+    async def _pedir(self, messages: List[Dict], params: Dict, agent_name: str, sp: metrics.span,
+                     al_campo: Optional[Callable], modelo: str) -> Tuple[str, Any]:
+        """One completion request; returns (content, usage). Its latency/outcome feed the router's stats."""
+        t0 = time.perf_counter()
+        try:
+            resultado = await self._pedir_modelo(messages, params, agent_name, sp, al_campo, modelo, t0)
+        except asyncio.CancelledError:
+            # Lost a hedge race: it took at least this long, which is what the ordering needs to know
+            duracion = time.perf_counter() - t0
+            enrutador.registrar(modelo, duracion, ok=True)
+            metrics.observar(metrics.llm_modelo_segundos, duracion, modelo=modelo, resultado="cancelado")
+            raise
+        except Exception:
+            duracion = time.perf_counter() - t0
+            enrutador.registrar(modelo, duracion, ok=False)
+            metrics.observar(metrics.llm_modelo_segundos, duracion, modelo=modelo, resultado="error")
+            raise
+        duracion = time.perf_counter() - t0
+        enrutador.registrar(modelo, duracion, ok=True)
+        metrics.observar(metrics.llm_modelo_segundos, duracion, modelo=modelo, resultado="ok")
+        return resultado
+
+    async def _pedir_modelo(self, messages: List[Dict], params: Dict, agent_name: str, sp: metrics.span,
+                            al_campo: Optional[Callable], modelo: str, t0: float) -> Tuple[str, Any]:
+        if not STREAMING:
+            completion = await self.client.chat.completions.create(model=modelo, messages=messages, **params)
+            return completion.choices[0].message.content or "", getattr(completion, "usage", None)
+
+        stream = await self.client.chat.completions.create(model=modelo, messages=messages, stream=True, **params)
+        # A fresh parser per attempt: a retried stream starts over
+        parser = respuestas.ParserIncremental() if al_campo else None
+        partes: List[str] = []
+        usage = None
+        try:
+            async for chunk in stream:
+                usage = getattr(chunk, "usage", None) or usage
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if not delta:
                     continue
-                
-                # Check for Bad Request (400) - Provider errors
-                if "400" in error_str:
-                     print(f"[{agent_name}] Bad Request (400). Retrying without parameters...", flush=True)
-                     try:
-                        # Retry naked call (risky but worth a shot for free providers)
-                        # Or switch to a simpler prompt structure if complex JSON is failing
-                        completion = self.client.chat.completions.create(
-                            model=self.model,
-                            messages=[
-                                {"role": "system", "content": system_prompt},
-                                {"role": "user", "content": user_prompt},
-                            ]
-                        )
-                        response = completion.choices[0].message.content
-                        print(f"[{agent_name}] Response received on retry (len={len(response)}).", flush=True)
-                        return response
-                     except Exception as e2:
-                        print(f"[{agent_name}] Retry failed: {e2}", flush=True)
-                        return "{}"
+                if not partes:
+                    sp.set(primer_token_ms=round((time.perf_counter() - t0) * 1000, 1))
+                partes.append(delta)
+                if parser:
+                    for ruta, valor in parser.alimentar(delta):
+                        try:
+                            al_campo(ruta, valor)
+                        except Exception as e:
+                            print(f"[{agent_name}] Error procesando campo {ruta}: {e}", flush=True)
+        finally:
+            # Also when a hedged request loses and is cancelled: give the connection back
+            await stream.close()
+        return "".join(partes), usage
 
-                # Other errors, break
-                return "{}"
-        
-        return "{}"
-
-    def _clean_json(self, text: str) -> str:
-        # Attempt to extract JSON from code blocks or raw text
-        text = text.strip()
-        if "```json" in text:
-            text = text.split("```json")[1].split("```")[0]
-        elif "```" in text:
-            text = text.split("```")[1].split("```")[0]
-        return text.strip()
-
-    def run_hospital_agent(self, emergencia: models.Emergencia, hospitales: List[models.Hospital]) -> List[Dict]:
-        print(f"[HospitalAgent] Iniciando análisis para emergencia: {emergencia.tipo}")
-        # Prepare data context
-        hosp_data = []
-        for h in hospitales:
-            docs = [d.especialidad for d in h.doctores if d.disponible]
-            hosp_data.append({
-                "id": h.id,
-                "nombre": h.nombre,
-                "zona_id": h.zona_id,
-                "ocupacion": f"{h.ocupacion_actual}/{h.capacidad_total}",
-                "recursos": {
-                    "antiescorpionico": h.tiene_suero_antiescorpionico,
-                    "trauma": h.tiene_unidad_trauma,
-                    "cardiologia": h.tiene_cardiologia,
-                    "pediatria": h.tiene_pediatria,
-                    "quemados": h.tiene_unidad_quemados
-                },
-                "doctores_disponibles": docs
-            })
-        
-        emergencia_data = {
-            "tipo": emergencia.tipo,
-            "descripcion": emergencia.descripcion,
-            "zona_id": emergencia.zona_id
-        }
+    def _parse(self, raw: str, agent_name: str, esquema: type) -> Dict:
+        """Tolerant parse + validation against the agent's response model (see respuestas.py)."""
+        with metrics.span("json_parse", agente=agent_name) as sp:
+            try:
+                data, reparado = respuestas.extraer_json(raw)
+            except ValueError:
+                metrics.contar(metrics.llm_fallbacks, agente=agent_name, motivo="json_invalido")
+                raise
+            validado, descartados = respuestas.validar(esquema, data)
+            if reparado:
+                sp.set(reparado=True)
+                metrics.contar(metrics.llm_json_reparado, agente=agent_name)
+            if descartados:
+                sp.set(descartados=descartados)
+                metrics.contar(metrics.llm_items_descartados, descartados, agente=agent_name)
+                print(f"[{agent_name}] {descartados} elementos inválidos descartados.", flush=True)
+            return validado
+
+    async def run_hospital_agent(self, emergencia_data: Dict, hosp_data: List[Dict]) -> List[Dict]:
+        print(f"[HospitalAgent] Iniciando análisis para emergencia: {emergencia_data['tipo']}")
 
         system_prompt = """Eres el HospitalAgent. Tu tarea es analizar una emergencia y una lista de hospitales candidatos.
         Debes proponer qué hospitales pueden atenderla basándote en sus recursos, especialidades médicas disponibles y ocupación.
@@ -138,11 +419,13 @@ class AgentSystem:
         }
         No incluyas markdown ni texto extra."""
 
-        user_prompt = f"Emergencia: {json.dumps(emergencia_data)}\nHospitales: {json.dumps(hosp_data)}"
+        user_prompt = f"Emergencia: {_compacto(emergencia_data)}\nHospitales: {_compacto(hosp_data)}"
         
-        raw = self._call_llm(system_prompt, user_prompt, "HospitalAgent")
+        raw = await self._call_llm(system_prompt, user_prompt, "HospitalAgent",
+                                   payload=[emergencia_data, hosp_data], recursos=_recursos(hosp=hosp_data),
+                                   esquema=respuestas.RespuestaHospital)
         try:
-            data = json.loads(self._clean_json(raw))
+            data = self._parse(raw, "HospitalAgent", respuestas.RespuestaHospital)
             proposals = data.get("hospital_proposals", [])
             print(f"[HospitalAgent] Generadas {len(proposals)} propuestas.")
             return proposals
@@ -150,23 +433,8 @@ class AgentSystem:
             print(f"[HospitalAgent] Error parsing response: {e}")
             return []
 
-    def run_vehicle_agent(self, emergencia: models.Emergencia, vehiculos: List[models.VehiculoRescate]) -> List[Dict]:
+    async def run_vehicle_agent(self, emergencia_data: Dict, veh_data: List[Dict]) -> List[Dict]:
         print(f"[VehicleAgent] Iniciando búsqueda de vehículos...")
-        veh_data = []
-        for v in vehiculos:
-            veh_data.append({
-                "id": v.id,
-                "nombre": v.nombre,
-                "tipo": v.tipo,
-                "estado": v.estado,
-                "zona_id": v.zona_id
-            })
-        
-        emergencia_data = {
-            "tipo": emergencia.tipo,
-            "descripcion": emergencia.descripcion,
-            "zona_id": emergencia.zona_id
-        }
 
         system_prompt = """Eres el VehicleAgent. Analiza la emergencia y los vehículos disponibles.
         
@@ -175,6 +443,7 @@ class AgentSystem:
         2. TIPOS: "ambulancia" sirve para TODO. "ambulancia_uti" es mejor para casos graves, pero la normal sirve. "helicoptero" es para lejanía o gravedad extrema.
         3. PROHIBIDO rechazar vehículos por falta de equipamiento que no esté explícito en los datos (ej: NO inventes que falta "ventilador pediátrico").
         4. Si el vehículo está "disponible", PROPONLO. Dale prioridad alta si está en la misma zona, media si está cerca.
+        5. Si el vehículo trae "eta_min", usa ese valor tal cual en tu propuesta (es calculado, no lo estimes).
         
         Salida requerida (JSON puro):
         {
@@ -190,11 +459,13 @@ class AgentSystem:
         }
         No incluyas markdown."""
 
-        user_prompt = f"Emergencia: {json.dumps(emergencia_data)}\nVehiculos: {json.dumps(veh_data)}"
+        user_prompt = f"Emergencia: {_compacto(emergencia_data)}\nVehiculos: {_compacto(veh_data)}"
 
-        raw = self._call_llm(system_prompt, user_prompt, "VehicleAgent")
+        raw = await self._call_llm(system_prompt, user_prompt, "VehicleAgent",
+                                   payload=[emergencia_data, veh_data], recursos=_recursos(veh=veh_data),
+                                   esquema=respuestas.RespuestaVehiculo)
         try:
-            data = json.loads(self._clean_json(raw))
+            data = self._parse(raw, "VehicleAgent", respuestas.RespuestaVehiculo)
             proposals = data.get("vehicle_proposals", [])
             print(f"[VehicleAgent] Generadas {len(proposals)} propuestas.")
             return proposals
@@ -202,11 +473,12 @@ class AgentSystem:
             print(f"[VehicleAgent] Error parsing response: {e}")
             return []
 
-    def run_coordinator_agent(self, emergencia: models.Emergencia, hosp_proposals: List[Dict], veh_proposals: List[Dict]) -> Dict:
+    async def run_coordinator_agent(self, emergencia: Dict, hosp_proposals: List[Dict], veh_proposals: List[Dict],
+                                    al_campo: Optional[Callable] = None) -> Dict:
         print(f"[CoordinatorAgent] Recibiendo propuestas: {len(hosp_proposals)} hospitales, {len(veh_proposals)} vehículos.")
         emergencia_data = {
-            "tipo": emergencia.tipo,
-            "descripcion": emergencia.descripcion
+            "tipo": emergencia["tipo"],
+            "descripcion": emergencia["descripcion"]
         }
         
         system_prompt = """Eres el CoordinatorAgent. Tu misión es tomar la decisión FINAL.
@@ -225,13 +497,16 @@ class AgentSystem:
         }
         """
         
-        user_prompt = f"""Emergencia: {json.dumps(emergencia_data)}
-        Propuestas Hospitales: {json.dumps(hosp_proposals)}
-        Propuestas Vehiculos: {json.dumps(veh_proposals)}"""
+        user_prompt = f"""Emergencia: {_compacto(emergencia_data)}
+        Propuestas Hospitales: {_compacto(hosp_proposals)}
+        Propuestas Vehiculos: {_compacto(veh_proposals)}"""
 
-        raw = self._call_llm(system_prompt, user_prompt, "CoordinatorAgent")
+        raw = await self._call_llm(system_prompt, user_prompt, "CoordinatorAgent",
+                                   payload=[emergencia_data, hosp_proposals, veh_proposals],
+                                   recursos=_recursos(hosp_proposals, veh_proposals),
+                                   esquema=respuestas.RespuestaCoordinador, al_campo=al_campo)
         try:
-            data = json.loads(self._clean_json(raw))
+            data = self._parse(raw, "CoordinatorAgent", respuestas.RespuestaCoordinador)
             decision = data.get("decision", {})
             print(f"[CoordinatorAgent] Decisión tomada: Hospital {decision.get('hospital_id')}, Vehiculo {decision.get('vehiculo_id')}")
             return decision
@@ -239,11 +514,64 @@ class AgentSystem:
             print(f"[CoordinatorAgent] Error parsing response: {e}")
             return {}
 
-    def run_analyst_agent(self, emergencia: models.Emergencia, decision: Dict, hosp_proposals: List[Dict], veh_proposals: List[Dict]) -> List[Dict]:
+    async def run_coordinator_narrado(self, emergencia: Dict, hosp_proposals: List[Dict], veh_proposals: List[Dict],
+                                      al_campo: Optional[Callable] = None) -> Tuple[Dict, List[Dict]]:
+        """CoordinatorAgent and AnalystAgent in one call (LLM_NARRATIVA=fusionada): the proposals are
+        sent once and the answer carries both the decision and the dashboard narrative."""
+        print(f"[CoordinatorAgent] Recibiendo propuestas (con narrativa): {len(hosp_proposals)} hospitales, {len(veh_proposals)} vehículos.")
+        emergencia_data = {
+            "tipo": emergencia["tipo"],
+            "descripcion": emergencia["descripcion"]
+        }
+
+        system_prompt = """Eres el CoordinatorAgent. Tu misión es tomar la decisión FINAL y dejar el reporte para el dashboard.
+        Recibes propuestas de hospitales y vehículos. Debes elegir la mejor combinación.
+
+        REGLA: Si recibes propuestas con acepta=true, DEBES elegir una. No dejes null a menos que las listas estén vacías.
+        Prioriza la vida del paciente: Cualquier asignación es mejor que ninguna.
+
+        Además genera EXACTAMENTE 3 entradas de actividad en orden cronológico, en lenguaje natural, técnico pero accesible:
+        1. HospitalAgent: qué hospitales se consideraron y cuál se propuso y por qué (menciona nombres).
+        2. VehicleAgent: qué vehículos se analizaron y cuál se sugirió por cercanía o tipo (menciona nombres).
+        3. CoordinatorAgent: por qué la combinación elegida es la mejor para esta emergencia.
+
+        Salida requerida (JSON puro):
+        {
+            "decision": {
+                "hospital_id": int | null,
+                "vehiculo_id": int | null,
+                "justificacion": "explicacion final de la decision"
+            },
+            "activity_descriptions": [
+                {"agente": "HospitalAgent", "tipo": "propuesta", "descripcion": "..."},
+                {"agente": "VehicleAgent", "tipo": "propuesta", "descripcion": "..."},
+                {"agente": "CoordinatorAgent", "tipo": "decision", "descripcion": "..."}
+            ]
+        }
+        """
+
+        user_prompt = f"""Emergencia: {_compacto(emergencia_data)}
+        Propuestas Hospitales: {_compacto(hosp_proposals)}
+        Propuestas Vehiculos: {_compacto(veh_proposals)}"""
+
+        raw = await self._call_llm(system_prompt, user_prompt, "CoordinatorAgent",
+                                   payload=[emergencia_data, hosp_proposals, veh_proposals],
+                                   recursos=_recursos(hosp_proposals, veh_proposals),
+                                   esquema=respuestas.RespuestaCoordinadorNarrada, al_campo=al_campo)
+        try:
+            data = self._parse(raw, "CoordinatorAgent", respuestas.RespuestaCoordinadorNarrada)
+            decision, activities = data["decision"], data["activity_descriptions"]
+            print(f"[CoordinatorAgent] Decisión tomada: Hospital {decision.get('hospital_id')}, Vehiculo {decision.get('vehiculo_id')} ({len(activities)} entradas de reporte)")
+            return decision, activities
+        except Exception as e:
+            print(f"[CoordinatorAgent] Error parsing response: {e}")
+            return {}, []
+
+    async def run_analyst_agent(self, emergencia: Dict, decision: Dict, hosp_proposals: List[Dict], veh_proposals: List[Dict]) -> List[Dict]:
         print("[AnalystAgent] Generando reporte de actividad...")
         emergencia_data = {
-            "tipo": emergencia.tipo,
-            "descripcion": emergencia.descripcion
+            "tipo": emergencia["tipo"],
+            "descripcion": emergencia["descripcion"]
         }
 
         system_prompt = """Eres el AnalystAgent. Genera un reporte de actividad DETALLADO para el dashboard.
@@ -279,14 +607,17 @@ class AgentSystem:
         }
         """
 
-        user_prompt = f"""Emergencia: {json.dumps(emergencia_data)}
-        Propuestas Hospitales: {json.dumps(hosp_proposals)}
-        Propuestas Vehiculos: {json.dumps(veh_proposals)}
-        Decision Final: {json.dumps(decision)}"""
+        user_prompt = f"""Emergencia: {_compacto(emergencia_data)}
+        Propuestas Hospitales: {_compacto(hosp_proposals)}
+        Propuestas Vehiculos: {_compacto(veh_proposals)}
+        Decision Final: {_compacto(decision)}"""
 
-        raw = self._call_llm(system_prompt, user_prompt, "AnalystAgent")
+        raw = await self._call_llm(system_prompt, user_prompt, "AnalystAgent",
+                                   payload=[emergencia_data, hosp_proposals, veh_proposals, decision],
+                                   recursos=_recursos(hosp_proposals, veh_proposals, decision),
+                                   esquema=respuestas.RespuestaAnalista)
         try:
-            data = json.loads(self._clean_json(raw))
+            data = self._parse(raw, "AnalystAgent", respuestas.RespuestaAnalista)
             activities = data.get("activity_descriptions", [])
             print(f"[AnalystAgent] Reporte generado con {len(activities)} entradas.")
             return activities
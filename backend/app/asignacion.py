@@ -0,0 +1,111 @@
+import heapq
+from typing import Dict, List, Optional, Tuple
+
+# Cost of leaving an emergency without a resource: higher than any real assignment, so the
+# solver always serves as many emergencies as capacity allows before optimizing cost.
+COSTO_SIN_ASIGNAR = 1000.0
+
+
+def min_cost_asignacion(candidatos: List[List[Tuple[int, float]]], capacidad: Dict[int, int]) -> List[Optional[int]]:
+    """Joint assignment of N demands to capacitated resources at minimum total cost.
+
+    candidatos[i] lists (resource_id, cost >= 0) pairs demand i may use; capacidad maps each resource
+    to how many demands it can take (1 for a vehicle, free beds for a hospital). Solved as a min-cost
+    flow with successive shortest paths (Dijkstra with potentials): one augmentation per demand,
+    each O(E log V) with E = total candidate pairs. Returns the resource chosen for each demand, or
+    None when it cannot be served.
+    """
+    n = len(candidatos)
+    recursos = sorted({j for cands in candidatos for j, _ in cands if capacidad.get(j, 0) > 0})
+    # Nodes: 0 source, 1..n demands, then resources, then the "unassigned" node, then the sink
+    nodo_recurso = {j: n + 1 + k for k, j in enumerate(recursos)}
+    sin_asignar = n + 1 + len(recursos)
+    sumidero = sin_asignar + 1
+    total = sumidero + 1
+
+    # Edge list: to, capacity, cost, index of the reverse edge
+    grafo: List[List[List]] = [[] for _ in range(total)]
+
+    def arista(u: int, v: int, cap: int, costo: float):
+        grafo[u].append([v, cap, costo, len(grafo[v])])
+        grafo[v].append([u, 0, -costo, len(grafo[u]) - 1])
+
+    for i, cands in enumerate(candidatos, start=1):
+        arista(0, i, 1, 0.0)
+        for j, costo in cands:
+            if j in nodo_recurso:
+                arista(i, nodo_recurso[j], 1, costo)
+        arista(i, sin_asignar, 1, COSTO_SIN_ASIGNAR)
+    for j, nodo in nodo_recurso.items():
+        arista(nodo, sumidero, min(capacidad[j], n), 0.0)
+    arista(sin_asignar, sumidero, n, 0.0)
+
+    potencial = [0.0] * total
+    for _ in range(n):
+        dist = [float("inf")] * total
+        previo: List[Optional[Tuple[int, int]]] = [None] * total
+        dist[0] = 0.0
+        cola = [(0.0, 0)]
+        while cola:
+            d, u = heapq.heappop(cola)
+            if d > dist[u]:
+                continue
+            for idx, (v, cap, costo, _) in enumerate(grafo[u]):
+                if cap <= 0:
+                    continue
+                nd = d + costo + potencial[u] - potencial[v]
+                if nd < dist[v] - 1e-12:
+                    dist[v] = nd
+                    previo[v] = (u, idx)
+                    heapq.heappush(cola, (nd, v))
+        if dist[sumidero] == float("inf"):
+            break
+        for v in range(total):
+            if dist[v] < float("inf"):
+                potencial[v] += dist[v]
+        v = sumidero
+        while v != 0:
+            u, idx = previo[v]
+            e = grafo[u][idx]
+            e[1] -= 1
+            grafo[v][e[3]][1] += 1
+            v = u
+
+    asignados: List[Optional[int]] = [None] * n
+    recurso_de_nodo = {nodo: j for j, nodo in nodo_recurso.items()}
+    for i in range(1, n + 1):
+        for v, cap, costo, _ in grafo[i]:
+            if cap == 0 and v in recurso_de_nodo:
+                asignados[i - 1] = recurso_de_nodo[v]
+    return asignados
+
+
+def decidir_lote(hosp_proposals: List[List[Dict]], veh_proposals: List[List[Dict]], libres: Dict[int, int]) -> List[Dict]:
+    """Batch counterpart of scoring.decidir.
+
+    Takes each emergency's ranked proposals and assigns hospitals (up to their free beds) and
+    vehicles (one emergency each) so that the summed cost (1 - score) over the whole batch is
+    minimal, instead of letting the first emergency grab the resource a later one needed more.
+    """
+    def costos(proposals: List[Dict], campo: str) -> List[Tuple[int, float]]:
+        return [(p[campo], max(0.0, 1.0 - p["prioridad"])) for p in proposals if p["acepta"]]
+
+    hospitales = min_cost_asignacion([costos(p, "hospital_id") for p in hosp_proposals], libres)
+    vehiculos_ids = {p["vehiculo_id"] for props in veh_proposals for p in props}
+    vehiculos = min_cost_asignacion([costos(p, "vehiculo_id") for p in veh_proposals], {v: 1 for v in vehiculos_ids})
+
+    decisiones = []
+    for h_id, v_id, h_props, v_props in zip(hospitales, vehiculos, hosp_proposals, veh_proposals):
+        hosp = next((p for p in h_props if p["hospital_id"] == h_id), None)
+        veh = next((p for p in v_props if p["vehiculo_id"] == v_id), None)
+        partes = []
+        if hosp:
+            partes.append(f"Hospital: {hosp['motivo']} (score {hosp['prioridad']})")
+        if veh:
+            partes.append(f"Vehículo: {veh['motivo']} (score {veh['prioridad']})")
+        decisiones.append({
+            "hospital_id": h_id,
+            "vehiculo_id": v_id,
+            "justificacion": (". ".join(partes) + " [asignación conjunta del lote]") if partes else "Sin recursos disponibles para asignar.",
+        })
+    return decisiones
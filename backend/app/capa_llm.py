@@ -0,0 +1,91 @@
+import os
+import asyncio
+import contextvars
+from typing import Awaitable, Callable, List, Optional, Tuple
+
+from . import metrics
+
+# LLM layer of dispatched emergencies (explanations / overrides), off the dispatch workers.
+#
+# A dispatch job ends as soon as the rule-based assignment is committed and hands the agents' work
+# to this queue, so a slow or rate-limited model never holds a worker while other emergencies wait.
+# Its own consumers drain it; when it is full the oldest entry is dropped and its `descartar`
+# fallback runs instead (e.g. keeping the rule-based assignment of an override). The same happens
+# on shutdown to every entry still queued or running, so no job is left in progress with its
+# holds taken.
+
+CAPA_LLM_COLA_MAX = int(os.getenv("CAPA_LLM_COLA_MAX", "200"))
+# Emergencies whose agents run at once (the LLM rate limit still applies to all of them)
+CAPA_LLM_CONCURRENCIA = int(os.getenv("CAPA_LLM_CONCURRENCIA", "4"))
+
+
+class ColaCapaLLM:
+    def __init__(self, maximo: int = CAPA_LLM_COLA_MAX, concurrencia: int = CAPA_LLM_CONCURRENCIA):
+        self.maximo = maximo
+        self.concurrencia = concurrencia
+        self.queue: Optional[asyncio.Queue] = None
+        self.tasks: List[asyncio.Task] = []
+        # Entries whose consumer was cancelled mid-run (shutdown)
+        self.interrumpidas: List[Tuple] = []
+
+    def iniciar(self):
+        self.queue = asyncio.Queue(maxsize=self.maximo)
+        self.tasks = [asyncio.create_task(self._loop()) for _ in range(self.concurrencia)]
+
+    async def detener(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        if self.queue is None:
+            return
+        entradas, self.interrumpidas = self.interrumpidas, []
+        while not self.queue.empty():
+            entradas.append(self.queue.get_nowait())
+        self.queue = None
+        if entradas:
+            metrics.contar(metrics.capa_llm_descartadas, len(entradas), motivo="apagado")
+        for emergencia_id, contexto, _, descartar in entradas:
+            if descartar is None:
+                continue
+            try:
+                await asyncio.get_running_loop().create_task(descartar(), context=contexto)
+            except Exception as e:
+                print(f"[CapaLLM] Error descartando capa LLM de emergencia #{emergencia_id}: {e}", flush=True)
+
+    def encolar(self, emergencia_id: int, crear: Callable[[], Awaitable],
+                descartar: Optional[Callable[[], Awaitable]] = None):
+        """Queues `crear()` (a coroutine factory) and returns immediately; `descartar()` runs instead
+        if the entry is dropped. Must be called on the event loop."""
+        if self.queue is None:
+            metrics.contar(metrics.capa_llm_descartadas, motivo="sin_cola")
+            if descartar:
+                asyncio.create_task(descartar())
+            return
+        if self.queue.full():
+            viejo_id, _, _, viejo_descartar = self.queue.get_nowait()
+            print(f"[CapaLLM] Cola llena: se descarta la capa LLM de emergencia #{viejo_id}.", flush=True)
+            metrics.contar(metrics.capa_llm_descartadas, motivo="cola_llena")
+            if viejo_descartar:
+                asyncio.create_task(viejo_descartar())
+        # Keeps the job's trace (metrics.iniciar_traza) for the spans recorded later
+        self.queue.put_nowait((emergencia_id, contextvars.copy_context(), crear, descartar))
+
+    def pendientes(self) -> int:
+        return self.queue.qsize() if self.queue else 0
+
+    async def _loop(self):
+        while True:
+            entrada = await self.queue.get()
+            emergencia_id, contexto, crear, _ = entrada
+            try:
+                await asyncio.get_running_loop().create_task(crear(), context=contexto)
+            except asyncio.CancelledError:
+                # detener settles it together with the entries still queued
+                self.interrumpidas.append(entrada)
+                raise
+            except Exception as e:
+                print(f"[CapaLLM] Error en capa LLM de emergencia #{emergencia_id}: {e}", flush=True)
+
+
+cola = ColaCapaLLM()
@@ -0,0 +1,134 @@
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from . import models, changes, scoring
+
+# Materialized capacity of every hospital: free beds, capability bitmask and how many available
+# doctors it has per especialidad.
+#
+# Loaded once at startup and then kept current from the commit-time change feed: a bed taken or
+# given back (reservas._cas) replaces the hospital's row, a doctor inserted, toggled or removed moves
+# one unit between specialty counters. Dispatch, the agents' prompts and /api/estado read rows from
+# here instead of loading every hospital with its doctors, so their cost grows with the number of
+# candidate hospitals, not with the doctors behind them.
+
+CAMPOS = ("id", "nombre", "zona_id", "latitud", "longitud", "capacidad_total", "ocupacion_actual",
+          "tiene_suero_antiescorpionico", "tiene_unidad_trauma", "tiene_cardiologia",
+          "tiene_pediatria", "tiene_unidad_quemados", "version")
+
+
+class VistaCapacidad:
+    def __init__(self):
+        self.hospitales: Dict[int, Dict] = {}
+        # hospital_id -> {especialidad: available doctors}
+        self.especialidades: Dict[int, Dict[str, int]] = {}
+        # doctor_id -> (hospital_id, especialidad, disponible), what the doctor currently contributes
+        self.doctores: Dict[int, Tuple[int, str, bool]] = {}
+        self.versiones = changes.Versiones()
+        self.lock = threading.Lock()
+
+    def cargar(self, db: Session):
+        hospitales = db.execute(select(models.Hospital.__table__)).mappings().all()
+        doctores = db.execute(select(models.Doctor.__table__)).mappings().all()
+        with self.lock:
+            self.hospitales, self.especialidades, self.doctores = {}, {}, {}
+            self.versiones = changes.Versiones()
+            for h in hospitales:
+                self._hospital(dict(h))
+            for d in doctores:
+                self._doctor(dict(d))
+        print(f"[Capacidad] Vista cargada: {len(self.hospitales)} hospitales, {len(self.doctores)} doctores.", flush=True)
+
+    def _hospital(self, datos: Dict):
+        if not self.versiones.vigente(models.Hospital.__tablename__, datos):
+            return
+        # Core updates may carry only the columns they touched
+        fila = {**self.hospitales.get(datos["id"], {}), **{c: datos[c] for c in CAMPOS if c in datos}}
+        fila["libres"] = (fila.get("capacidad_total") or 0) - (fila.get("ocupacion_actual") or 0)
+        fila["capacidades"] = scoring.capacidades_hospital(fila)
+        self.hospitales[fila["id"]] = fila
+
+    def _doctor(self, datos: Dict):
+        self._contar(self.doctores.get(datos["id"]), -1)
+        previo = self.doctores.get(datos["id"], (None, None, False))
+        actual = (datos.get("hospital_id", previo[0]), datos.get("especialidad", previo[1]),
+                  bool(datos.get("disponible", previo[2])))
+        self.doctores[datos["id"]] = actual
+        self._contar(actual, 1)
+
+    def _quitar_doctor(self, doctor_id: int):
+        self._contar(self.doctores.pop(doctor_id, None), -1)
+
+    def _contar(self, doctor: Optional[Tuple[int, str, bool]], delta: int):
+        if not doctor or not doctor[2]:
+            return
+        hospital_id, especialidad, _ = doctor
+        cuentas = self.especialidades.setdefault(hospital_id, {})
+        cuentas[especialidad] = cuentas.get(especialidad, 0) + delta
+        if cuentas[especialidad] <= 0:
+            del cuentas[especialidad]
+
+    def on_cambios(self, cambios: List[Dict]):
+        cambios = [c for c in cambios if c["tabla"] in (models.Hospital.__tablename__, models.Doctor.__tablename__)]
+        if not cambios:
+            return
+        with self.lock:
+            for c in cambios:
+                datos = c["datos"]
+                if c["tabla"] == models.Hospital.__tablename__:
+                    if c["accion"] == "delete":
+                        self.hospitales.pop(datos["id"], None)
+                        self.especialidades.pop(datos["id"], None)
+                    else:
+                        self._hospital(datos)
+                elif c["accion"] == "delete":
+                    self._quitar_doctor(datos["id"])
+                else:
+                    self._doctor(datos)
+
+    def _fila(self, hospital_id: int) -> Optional[Dict]:
+        fila = self.hospitales.get(hospital_id)
+        if fila is None:
+            return None
+        return {**fila, "especialidades": dict(self.especialidades.get(hospital_id, {}))}
+
+    def fila(self, hospital_id: int) -> Optional[Dict]:
+        """Capacity row of one hospital (a copy), or None if it is unknown."""
+        with self.lock:
+            return self._fila(hospital_id)
+
+    def filas(self, ids: Optional[Iterable[int]] = None) -> List[Dict]:
+        """Rows of the given hospitals (every hospital when None), ordered by id."""
+        with self.lock:
+            seleccion = sorted(self.hospitales) if ids is None else sorted(i for i in ids if i in self.hospitales)
+            return [self._fila(i) for i in seleccion]
+
+
+vista = VistaCapacidad()
+changes.suscribir(vista.on_cambios)
+
+
+def como_filas(cambios: List[Dict]) -> List[Dict]:
+    """Hospital and doctor changes replaced by an update of the hospital's capacity row, for
+    subscribers that publish hospitals as the view shows them (estado, pubsub). A doctor who moved
+    updates both the hospital it left and the one it joined. Subscribers must come after `vista`,
+    which importing this module guarantees."""
+    resultado, vistos = [], set()
+    for c in cambios:
+        if c["tabla"] not in (models.Hospital.__tablename__, models.Doctor.__tablename__) \
+                or (c["tabla"] == models.Hospital.__tablename__ and c["accion"] == "delete"):
+            resultado.append(c)
+            continue
+        if c["tabla"] == models.Hospital.__tablename__:
+            hospitales = [c["datos"]["id"]]
+        else:
+            hospitales = [c.get("anteriores", {}).get("hospital_id"), c["datos"].get("hospital_id")]
+        for hospital_id in hospitales:
+            fila = vista.fila(hospital_id) if hospital_id not in vistos else None
+            vistos.add(hospital_id)
+            if fila is not None:
+                resultado.append({"tabla": models.Hospital.__tablename__, "accion": "update", "datos": fila})
+    return resultado
@@ -0,0 +1,87 @@
+from typing import Callable, Dict, List, Tuple
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+# Commit-time change notifications for ORM rows.
+#
+# Every flush records a column snapshot of the inserted/updated/deleted rows in session.info
+# (updates also carry the previous value of the columns they changed, under "anteriores"); on
+# commit the batch is handed to the subscribers (in-memory indexes, caches, ...). Rolled back work
+# is discarded, so subscribers only ever see committed state.
+#
+# Each committing thread notifies the subscribers itself, so two commits of the same row can reach
+# them in the opposite order. Rows with a `version` column (hospitals, vehicles) carry it in their
+# snapshot; subscribers that keep row state drop older snapshots with `Versiones`.
+
+_suscriptores: List[Callable[[List[Dict]], None]] = []
+
+
+def suscribir(callback: Callable[[List[Dict]], None]):
+    _suscriptores.append(callback)
+
+
+class Versiones:
+    """Highest `version` applied per row. Not locked: call `vigente` under the subscriber's own
+    lock, together with applying the change, or a newer snapshot could still be overtaken."""
+
+    def __init__(self):
+        self.aplicadas: Dict[Tuple[str, int], int] = {}
+
+    def vigente(self, tabla: str, datos: Dict) -> bool:
+        """False if `datos` is older than the snapshot of the row already applied (rows without a
+        version always pass)."""
+        version = datos.get("version")
+        if version is None:
+            return True
+        clave = (tabla, datos["id"])
+        if version < self.aplicadas.get(clave, version):
+            return False
+        self.aplicadas[clave] = version
+        return True
+
+
+def snapshot(obj) -> Dict:
+    return {attr.key: getattr(obj, attr.key) for attr in inspect(obj).mapper.column_attrs}
+
+
+def anteriores(obj) -> Dict:
+    """Previous value of each loaded column this flush changes (history is still pre-flush here)."""
+    estado = inspect(obj)
+    return {attr.key: historia.deleted[0] for attr in estado.mapper.column_attrs
+            if (historia := estado.attrs[attr.key].history).deleted}
+
+
+def registrar(session: Session, tabla: str, accion: str, datos: Dict):
+    """For writes that bypass the ORM unit of work (Core UPDATE statements)."""
+    session.info.setdefault("cambios", []).append({"tabla": tabla, "accion": accion, "datos": datos})
+
+
+@event.listens_for(Session, "after_flush")
+def _after_flush(session, flush_context):
+    pendientes = session.info.setdefault("cambios", [])
+    for accion, objs in (("insert", session.new), ("update", session.dirty), ("delete", session.deleted)):
+        for obj in objs:
+            if accion == "update" and not session.is_modified(obj, include_collections=False):
+                continue
+            cambio = {"tabla": obj.__tablename__, "accion": accion, "datos": snapshot(obj)}
+            if accion == "update":
+                cambio["anteriores"] = anteriores(obj)
+            pendientes.append(cambio)
+
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(session):
+    cambios = session.info.pop("cambios", None)
+    if not cambios:
+        return
+    for callback in _suscriptores:
+        try:
+            callback(cambios)
+        except Exception as e:
+            print(f"[Changes] Error notificando cambios: {e}", flush=True)
+
+
+@event.listens_for(Session, "after_rollback")
+def _after_rollback(session):
+    session.info.pop("cambios", None)
@@ -0,0 +1,303 @@
+import os
+import asyncio
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Optional, Tuple
+
+from sqlalchemy import func, exists, and_
+from sqlalchemy.orm import Session, joinedload
+
+from . import models, database, reservas, geo, metrics
+
+# Emergency lifecycle after dispatch.
+#
+# asignada (unit en camino) -> en_escena -> trasladando (only with a hospital) -> resuelta. Each
+# phase ends at Emergencia.fase_hasta, computed from the vehicle's ETA (geo.eta_min) or a fixed
+# on-scene time; MotorCiclo advances whatever is due every CICLO_TICK_S, and the same step can be
+# driven with any clock (`avanzar(db, ahora)`). The vehicle mirrors the phase and moves with it, and
+# returns to 'disponible' where the mission ended. The patient's bed stays taken until discharge
+# (reservas.dar_altas). An emergency dispatched with a bed but no vehicle stays activa, and its bed is
+# given back after CICLO_ESPERA_MIN. Resolved emergencies move to emergencias_archivo once nothing
+# refers to them.
+
+CICLO_TICK_S = float(os.getenv("CICLO_TICK_S", "5"))
+# Simulated minutes per real minute (1 = real time)
+CICLO_ACELERACION = float(os.getenv("CICLO_ACELERACION", "1"))
+# Time the crew spends on scene before transferring or closing the case
+CICLO_ESCENA_MIN = float(os.getenv("CICLO_ESCENA_MIN", "15"))
+# How long a bed stays held for an emergency that got no vehicle
+CICLO_ESPERA_MIN = float(os.getenv("CICLO_ESPERA_MIN", "30"))
+# Hospital stay: the bed is freed this long after the patient arrives
+CICLO_INTERNACION_MIN = float(os.getenv("CICLO_INTERNACION_MIN", "240"))
+# Resolved emergencies stay on the dashboard this long before being archived
+CICLO_ARCHIVO_S = float(os.getenv("CICLO_ARCHIVO_S", "600"))
+# Emergencies advanced / archived per step (keeps each transaction short)
+CICLO_LOTE = int(os.getenv("CICLO_LOTE", "500"))
+# Occupancy time-series sampling interval, and how long samples are kept
+CICLO_MUESTREO_S = float(os.getenv("CICLO_MUESTREO_S", "60"))
+CICLO_SERIE_HORAS = float(os.getenv("CICLO_SERIE_HORAS", "48"))
+
+# Emergencies with a unit out, and the phases an operator may move them to
+EN_CURSO = ("asignada", "en_escena", "trasladando")
+ABIERTAS = ("en_cola", "analizando", "activa") + EN_CURSO
+# States whose fase_hasta is a pending timer
+TEMPORIZADAS = ("activa",) + EN_CURSO
+TRANSICIONES = {
+    # Closing one still waiting for dispatch cancels it (dispatch._tomar_job / _aplicar_decision)
+    "en_cola": ("resuelta",),
+    "analizando": ("resuelta",),
+    "activa": ("resuelta",),
+    "asignada": ("en_escena", "resuelta"),
+    "en_escena": ("trasladando", "resuelta"),
+    "trasladando": ("resuelta",),
+}
+
+
+class TransicionInvalida(ValueError):
+    pass
+
+
+def _minutos(minutos: float) -> timedelta:
+    return timedelta(minutes=minutos / CICLO_ACELERACION)
+
+
+def _posicion(e: models.Emergencia) -> Tuple[Optional[float], Optional[float]]:
+    # Same fallback as scoring: reports without coordinates sit at their zone centroid
+    if e.latitud is not None:
+        return e.latitud, e.longitud
+    return (e.zona.latitud, e.zona.longitud) if e.zona else (None, None)
+
+
+def _viaje_min(v: models.VehiculoRescate, desde: Tuple, hasta: Tuple) -> float:
+    if None in desde or None in hasta:
+        return geo.eta_min(v.tipo, 10.0)  # no coordinates: a typical urban trip
+    return geo.eta_min(v.tipo, geo.haversine_km(desde[0], desde[1], hasta[0], hasta[1]))
+
+
+def _registrar(db: Session, e: models.Emergencia, descripcion: str):
+    db.add(models.Actividad(agente="MotorCiclo", tipo="fase", descripcion=f"Emergencia #{e.id}: {descripcion}"))
+    metrics.contar(metrics.ciclo_transiciones, estado=e.estado)
+
+
+def _en_escena(db: Session, e: models.Emergencia, ahora: datetime):
+    v = e.vehiculo_asignado
+    if not reservas.mover_vehiculo(db, v.id, "en_camino", "en_escena", _posicion(e)):
+        raise TransicionInvalida(f"el vehículo {v.id} no está en camino")
+    e.estado = "en_escena"
+    e.fase_hasta = ahora + _minutos(CICLO_ESCENA_MIN)
+    _registrar(db, e, f"{v.nombre} en escena.")
+
+
+def _trasladar(db: Session, e: models.Emergencia, ahora: datetime):
+    v, h = e.vehiculo_asignado, e.hospital_asignado
+    if not h or not reservas.mover_vehiculo(db, v.id, "en_escena", "trasladando"):
+        raise TransicionInvalida("sin hospital asignado o vehículo fuera de escena")
+    e.estado = "trasladando"
+    e.fase_hasta = ahora + _minutos(_viaje_min(v, _posicion(e), (h.latitud, h.longitud)))
+    _registrar(db, e, f"{v.nombre} trasladando al {h.nombre}.")
+
+
+def _resolver(db: Session, e: models.Emergencia, ahora: datetime):
+    """Closes the emergency: the vehicle is freed where it stands, and the bed is kept until
+    discharge only if the patient reached the hospital."""
+    internado = e.estado == "trasladando"
+    h = e.hospital_asignado
+    posicion = (h.latitud, h.longitud) if internado else (_posicion(e) if e.estado == "en_escena" else None)
+    reservas.liberar(db, e.id, "vehiculo", posicion=posicion)
+    if internado:
+        db.query(models.Reserva).filter(
+            models.Reserva.emergencia_id == e.id,
+            models.Reserva.recurso == "hospital",
+            models.Reserva.estado == "confirmada",
+        ).update({"expira_en": ahora + _minutos(CICLO_INTERNACION_MIN)}, synchronize_session=False)
+    else:
+        reservas.liberar(db, e.id, "hospital")
+    e.estado = "resuelta"
+    e.resuelta_at = ahora
+    e.fase_hasta = None
+    _registrar(db, e, "resuelta" + (f", paciente internado en {h.nombre}." if internado else "."))
+
+
+def _sin_vehiculo(db: Session, e: models.Emergencia):
+    """No unit came up for the bed held for this emergency: the bed goes back, the emergency stays open."""
+    h = e.hospital_asignado
+    reservas.liberar(db, e.id, "hospital")
+    e.hospital_asignado = None
+    e.fase_hasta = None
+    _registrar(db, e, f"sin vehículo tras {CICLO_ESPERA_MIN:.0f} min, se libera la cama del {h.nombre}.")
+
+
+def transicionar(db: Session, e: models.Emergencia, destino: str, ahora: Optional[datetime] = None):
+    """Moves an emergency to `destino` (operator action or a due timer), releasing or moving its
+    resources in the caller's transaction. Raises TransicionInvalida if not allowed from its state."""
+    ahora = ahora or datetime.utcnow()
+    if destino not in TRANSICIONES.get(e.estado, ()):
+        raise TransicionInvalida(f"no se puede pasar de '{e.estado}' a '{destino}'")
+    if destino == "en_escena":
+        if not e.vehiculo_asignado:
+            raise TransicionInvalida("sin vehículo asignado")
+        _en_escena(db, e, ahora)
+    elif destino == "trasladando":
+        _trasladar(db, e, ahora)
+    else:
+        _resolver(db, e, ahora)
+
+
+def _arrancar(db: Session, ahora: datetime) -> int:
+    """Starts the travel timer of assignments whose vehicle has been confirmed (en_camino), and the
+    hold timer of beds taken for emergencies without a vehicle."""
+    nuevas = db.query(models.Emergencia).join(
+        models.VehiculoRescate, models.VehiculoRescate.id == models.Emergencia.vehiculo_asignado_id
+    ).options(joinedload(models.Emergencia.zona), joinedload(models.Emergencia.vehiculo_asignado)).filter(
+        models.Emergencia.estado == "asignada",
+        models.Emergencia.fase_hasta.is_(None),
+        models.VehiculoRescate.estado == "en_camino",
+    ).limit(CICLO_LOTE).all()
+    for e in nuevas:
+        v = e.vehiculo_asignado
+        e.fase_hasta = ahora + _minutos(_viaje_min(v, (v.latitud, v.longitud), _posicion(e)))
+    en_espera = db.query(models.Emergencia).filter(
+        models.Emergencia.estado == "activa",
+        models.Emergencia.hospital_asignado_id.isnot(None),
+        models.Emergencia.fase_hasta.is_(None),
+    ).limit(CICLO_LOTE).all()
+    for e in en_espera:
+        e.fase_hasta = ahora + _minutos(CICLO_ESPERA_MIN)
+    return len(nuevas) + len(en_espera)
+
+
+def _vencidas(db: Session, ahora: datetime) -> int:
+    vencidas = db.query(models.Emergencia).options(
+        joinedload(models.Emergencia.zona),
+        joinedload(models.Emergencia.vehiculo_asignado),
+        joinedload(models.Emergencia.hospital_asignado),
+    ).filter(
+        models.Emergencia.estado.in_(TEMPORIZADAS),
+        models.Emergencia.fase_hasta <= ahora,
+    ).order_by(models.Emergencia.fase_hasta).limit(CICLO_LOTE).all()
+    for e in vencidas:
+        try:
+            if e.estado == "activa":
+                _sin_vehiculo(db, e)
+            elif e.estado == "asignada":
+                _en_escena(db, e, ahora)
+            elif e.estado == "en_escena" and e.hospital_asignado:
+                _trasladar(db, e, ahora)
+            else:
+                _resolver(db, e, ahora)
+        except TransicionInvalida as ex:
+            # Vehicle swapped or moved by hand meanwhile: restart the timer from its current state
+            print(f"[Ciclo] Emergencia #{e.id}: {ex}; se reprograma.", flush=True)
+            e.fase_hasta = None if e.estado == "asignada" else ahora + _minutos(CICLO_ESCENA_MIN)
+    return len(vencidas)
+
+
+def archivar(db: Session, ahora: datetime) -> int:
+    """Moves resolved emergencies with no active reservation or pending job to emergencias_archivo."""
+    E, R, J = models.Emergencia, models.Reserva, models.DispatchJob
+    columnas = [c.name for c in models.EmergenciaArchivada.__table__.columns if c.name != "archivada_at"]
+    viejas = db.query(E).filter(
+        E.estado == "resuelta",
+        E.resuelta_at <= ahora - timedelta(seconds=CICLO_ARCHIVO_S),
+        ~exists().where(and_(R.emergencia_id == E.id, R.estado.in_(reservas.ACTIVAS))),
+        ~exists().where(and_(J.emergencia_id == E.id, J.estado.in_(["pendiente", "en_proceso"]))),
+    ).limit(CICLO_LOTE).all()
+    if not viejas:
+        return 0
+    ids = [e.id for e in viejas]
+    db.bulk_insert_mappings(models.EmergenciaArchivada, [
+        {**{c: getattr(e, c) for c in columnas}, "archivada_at": ahora} for e in viejas
+    ])
+    # Children first (foreign keys); released reservations and finished jobs are history only
+    db.query(R).filter(R.emergencia_id.in_(ids)).delete(synchronize_session=False)
+    db.query(J).filter(J.emergencia_id.in_(ids)).delete(synchronize_session=False)
+    for e in viejas:
+        db.delete(e)
+    return len(viejas)
+
+
+def muestrear(db: Session, ahora: datetime) -> models.OcupacionMuestra:
+    """Records one occupancy sample and drops the ones older than CICLO_SERIE_HORAS."""
+    por_estado = dict(db.query(models.VehiculoRescate.estado, func.count()).group_by(models.VehiculoRescate.estado).all())
+    camas_ocupadas, camas_totales = db.query(
+        func.coalesce(func.sum(models.Hospital.ocupacion_actual), 0),
+        func.coalesce(func.sum(models.Hospital.capacidad_total), 0),
+    ).one()
+    muestra = models.OcupacionMuestra(
+        timestamp=ahora,
+        vehiculos_disponibles=por_estado.get("disponible", 0),
+        vehiculos_en_servicio=sum(n for estado, n in por_estado.items() if estado in reservas.EN_MISION),
+        camas_ocupadas=camas_ocupadas,
+        camas_totales=camas_totales,
+        emergencias_abiertas=db.query(func.count(models.Emergencia.id)).filter(models.Emergencia.estado.in_(ABIERTAS)).scalar(),
+    )
+    db.add(muestra)
+    db.query(models.OcupacionMuestra).filter(
+        models.OcupacionMuestra.timestamp < ahora - timedelta(hours=CICLO_SERIE_HORAS)
+    ).delete(synchronize_session=False)
+    return muestra
+
+
+def proximo_vencimiento(db: Session) -> Optional[datetime]:
+    """Earliest pending phase end or discharge (lets a virtual clock jump straight to it)."""
+    fases = db.query(func.min(models.Emergencia.fase_hasta)).filter(models.Emergencia.estado.in_(TEMPORIZADAS)).scalar()
+    altas = db.query(func.min(models.Reserva.expira_en)).filter(
+        models.Reserva.recurso == "hospital", models.Reserva.estado == "confirmada"
+    ).scalar()
+    return min((t for t in (fases, altas) if t is not None), default=None)
+
+
+def avanzar(db: Session, ahora: datetime) -> Dict[str, int]:
+    """One lifecycle step at time `ahora`, in the caller's transaction."""
+    return {
+        "iniciadas": _arrancar(db, ahora),
+        "avanzadas": _vencidas(db, ahora),
+        "altas": reservas.dar_altas(db, ahora),
+        "archivadas": archivar(db, ahora),
+    }
+
+
+class MotorCiclo:
+    """Runs `avanzar` every CICLO_TICK_S on a thread, plus the occupancy sampling. `reloj` can be
+    replaced (simulator) so phases follow a virtual clock."""
+
+    def __init__(self, tick_s: float = CICLO_TICK_S, reloj: Callable[[], datetime] = datetime.utcnow):
+        self.tick_s = tick_s
+        self.reloj = reloj
+        self.ultima_muestra: Optional[datetime] = None
+        self.task: Optional[asyncio.Task] = None
+
+    def paso(self) -> Dict[str, int]:
+        ahora = self.reloj()
+        with metrics.span("ciclo.paso"), database.unidad_de_trabajo() as db:
+            resultado = avanzar(db, ahora)
+            if self.ultima_muestra is None or (ahora - self.ultima_muestra).total_seconds() >= CICLO_MUESTREO_S:
+                muestrear(db, ahora)
+                self.ultima_muestra = ahora
+        return resultado
+
+    async def iniciar(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self._loop())
+
+    async def detener(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def _loop(self):
+        print(f"[Ciclo] Motor de ciclo de vida activo (tick {self.tick_s}s, aceleración x{CICLO_ACELERACION}).", flush=True)
+        while True:
+            await asyncio.sleep(self.tick_s)
+            try:
+                resultado = await asyncio.to_thread(self.paso)
+                if any(resultado.values()):
+                    print(f"[Ciclo] {resultado}", flush=True)
+            except Exception as e:
+                print(f"[Ciclo] Error avanzando emergencias: {e}", flush=True)
+
+
+motor = MotorCiclo()
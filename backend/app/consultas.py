@@ -0,0 +1,90 @@
+import os
+import json
+import base64
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from sqlalchemy import and_, or_, select
+from sqlalchemy.orm import Session
+
+# Keyset pagination for the list endpoints (GET /api/emergencias, /actividades, /hospitales, /vehiculos).
+#
+# Every listing has a unique order: (timestamp, id) newest first, or id. The cursor handed back with a
+# page is that key of its last row, and the next page starts right after it (WHERE key < cursor), so
+# any page costs one index range scan instead of skipping OFFSET rows, and rows inserted meanwhile
+# never shift the pages. `campos` narrows the SELECT to the columns the client renders.
+
+# Rows per page by default and at most
+CONSULTA_LIMITE = int(os.getenv("CONSULTA_LIMITE", "50"))
+CONSULTA_LIMITE_MAX = int(os.getenv("CONSULTA_LIMITE_MAX", "500"))
+
+
+class ConsultaInvalida(ValueError):
+    pass
+
+
+def lista(valor: Optional[str]) -> List[str]:
+    """"activa,asignada" -> ["activa", "asignada"]; query parameters accept comma-separated values."""
+    return [v.strip() for v in (valor or "").split(",") if v.strip()]
+
+
+def _codificar(clave: List) -> str:
+    crudo = json.dumps([v.isoformat() if isinstance(v, datetime) else v for v in clave])
+    return base64.urlsafe_b64encode(crudo.encode()).decode().rstrip("=")
+
+
+def _decodificar(cursor: str, con_fecha: bool) -> List:
+    try:
+        clave = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if con_fecha:
+            return [datetime.fromisoformat(clave[0]), int(clave[1])]
+        return [int(clave[0])]
+    except (ValueError, TypeError, IndexError, KeyError):
+        raise ConsultaInvalida("cursor inválido")
+
+
+def _columnas(modelo, campos: Optional[str], excluidas: tuple) -> List:
+    tabla = modelo.__table__
+    if not campos:
+        return [c for c in tabla.columns if c.name not in excluidas]
+    pedidas = lista(campos)
+    desconocidas = [c for c in pedidas if c not in tabla.columns]
+    if desconocidas:
+        raise ConsultaInvalida(f"campos desconocidos: {', '.join(desconocidas)}")
+    return [tabla.columns[c] for c in pedidas]
+
+
+def paginar(db: Session, modelo, filtros: List, campos: Optional[str] = None, limite: Optional[int] = None,
+            cursor: Optional[str] = None, fecha: Optional[str] = None, excluidas: tuple = ()) -> Dict:
+    """One page of `modelo` rows matching `filtros`, newest `fecha` first (or by id when None).
+
+    Returns {"items": [...], "siguiente": cursor of the next page or None}. Columns in `excluidas`
+    (large ones) are only returned when asked for in `campos`.
+    """
+    tabla = modelo.__table__
+    limite = min(max(limite or CONSULTA_LIMITE, 1), CONSULTA_LIMITE_MAX)
+    columnas = _columnas(modelo, campos, excluidas)
+    clave = ([tabla.c[fecha]] if fecha else []) + [tabla.c.id]
+    # The key is always read (for the cursor) even if not among the requested fields
+    nombres = [c.name for c in columnas]
+    extra = [c for c in clave if c.name not in nombres]
+
+    condiciones = list(filtros)
+    if cursor:
+        valores = _decodificar(cursor, bool(fecha))
+        if fecha:
+            # (fecha, id) < cursor, written so the index on fecha bounds the scan
+            ts, ts_c, id_c = clave[0], valores[0], valores[1]
+            condiciones.append(and_(ts <= ts_c, or_(ts < ts_c, tabla.c.id < id_c)))
+        else:
+            condiciones.append(tabla.c.id > valores[0])
+    orden = [clave[0].desc(), tabla.c.id.desc()] if fecha else [tabla.c.id]
+
+    filas = db.execute(
+        select(*columnas, *extra).where(*condiciones).order_by(*orden).limit(limite + 1)
+    ).mappings().all()
+    siguiente = None
+    if len(filas) > limite:
+        filas = filas[:limite]
+        siguiente = _codificar([filas[-1][c.name] for c in clave])
+    return {"items": [{n: f[n] for n in nombres} for f in filas], "siguiente": siguiente}
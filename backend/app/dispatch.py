@@ -0,0 +1,474 @@
+import os
+import json
+import time
+import asyncio
+from typing import Dict, List, Optional
+
+from openai import AsyncOpenAI
+from sqlalchemy import update
+
+from . import models, database, agents, scoring, geo, pubsub, asignacion, reservas, actividades, metrics, narrativas, ciclo, capacidad, capa_llm
+
+# off: rule-based dispatch only. explicar: AnalystAgent narrates the decision.
+# override: full agent chain runs after the dispatch and may replace the assignment.
+LLM_MODO = os.getenv("LLM_MODO", "explicar")
+# How the AnalystAgent's dashboard narrative is produced. separada: its own call after the decision.
+# fusionada: the CoordinatorAgent returns it with the decision (override mode; one call fewer).
+# diferida: queued in the background at low priority (narrativas.py), off the job's critical path.
+LLM_NARRATIVA = os.getenv("LLM_NARRATIVA", "separada")
+# Nearest available vehicles / hospitals (spatial index) considered per emergency
+VEHICULOS_K = int(os.getenv("DISPATCH_VEHICULOS_K", "20"))
+HOSPITALES_K = int(os.getenv("DISPATCH_HOSPITALES_K", "20"))
+# Best-ranked candidates of each kind sent to the LLM agents
+AGENT_TOP_K = int(os.getenv("AGENT_TOP_K", "5"))
+# Largest batch accepted by POST /api/emergencias/batch
+LOTE_MAX = int(os.getenv("DISPATCH_LOTE_MAX", "500"))
+# Times a decision is re-made after losing a vehicle/bed to a concurrent dispatch
+RESERVA_REINTENTOS = int(os.getenv("RESERVA_REINTENTOS", "5"))
+
+
+def capa_llm_activa() -> bool:
+    return LLM_MODO != "off" and agents.llm_habilitado()
+
+
+async def procesar_job(job_id: int, llm_client: AsyncOpenAI):
+    """Runs the dispatch pipeline for one DispatchJob. Executed by the worker pool, never inside a request.
+
+    The assignment itself comes from the deterministic scorer and is committed before any LLM call;
+    the agents only add an explanation (or an override) afterwards, from capa_llm.cola, so the worker
+    is free for the next job as soon as the assignment is written. DB work happens in short
+    synchronous phases on a thread (asyncio.to_thread).
+    """
+    metrics.iniciar_traza()
+    with metrics.span("db.tomar_job"):
+        ctx = await asyncio.to_thread(_tomar_job, job_id)
+    if ctx is None:
+        return
+
+    emergencia_id = ctx["emergencia_id"]
+    print(f"\n[SAR] --- PROCESANDO EMERGENCIA #{emergencia_id}: {ctx['emergencia']['tipo']} (job {job_id}, intento {ctx['intento']}) ---", flush=True)
+    # While the agents may still replace the assignment, resources are only held (see reservas.py)
+    llm = capa_llm_activa()
+    deliberan = LLM_MODO == "override" and llm
+    ttl = reservas.RESERVA_TTL_S if deliberan else None
+    # Unless the agents may still replace it, the job is finished by the transaction that applies the decision
+    completar_con_decision = None if deliberan else job_id
+    try:
+        # 1. Deterministic dispatch (critical path, no remote calls)
+        t0 = time.perf_counter()
+        with metrics.span("scoring"):
+            hosp_proposals = scoring.rankear_hospitales(ctx["emergencia"], ctx["hospitales"])
+            veh_proposals = scoring.rankear_vehiculos(ctx["emergencia"], ctx["vehiculos"])
+        if ctx["ya_asignada"]:
+            # Assigned on a previous attempt or by a batch: keep it, the agents only narrate it
+            decision = ctx["asignacion"]
+        else:
+            for intento in range(RESERVA_REINTENTOS):
+                decision = scoring.decidir(ctx["emergencia"], hosp_proposals, veh_proposals)
+                with metrics.span("db.aplicar_decision") as sp:
+                    conflictos = await asyncio.to_thread(_aplicar_decision, emergencia_id, decision, ttl, completar_con_decision)
+                    sp.set(conflictos=len(conflictos or ()))
+                if not conflictos:
+                    break
+                # Taken by a concurrent dispatch since we loaded the candidates: decide again without it
+                print(f"[SAR] Conflicto de reserva ({', '.join(conflictos)}) para emergencia #{emergencia_id}, redecidiendo.", flush=True)
+                if "hospital" in conflictos:
+                    hosp_proposals = [p for p in hosp_proposals if p["hospital_id"] != decision["hospital_id"]]
+                if "vehiculo" in conflictos:
+                    veh_proposals = [p for p in veh_proposals if p["vehiculo_id"] != decision["vehiculo_id"]]
+            else:
+                raise RuntimeError(f"sin reserva tras {RESERVA_REINTENTOS} intentos")
+            if conflictos is None:
+                # Closed by an operator while the rules ran: nothing was reserved, nothing to explain
+                print(f"[SAR] Emergencia #{emergencia_id} cerrada durante el despacho.", flush=True)
+                if deliberan:
+                    await asyncio.to_thread(_finalizar_job, job_id, emergencia_id, False)
+                await _guardar_traza(emergencia_id)
+                return
+            pubsub.broker.publicar("decision_aplicada", {"emergencia_id": emergencia_id, "origen": "MotorDespacho", **decision})
+        print(f"[SAR] Decision (motor de reglas, {(time.perf_counter() - t0) * 1000:.2f} ms): {json.dumps(decision)}", flush=True)
+    except Exception as e:
+        print(f"[SAR] Error procesando job {job_id}: {e}", flush=True)
+        await asyncio.to_thread(_marcar_error, job_id, str(e))
+        return
+
+    if ctx["ya_asignada"] and not deliberan:
+        # Nothing was applied, so nothing completed the job yet
+        with metrics.span("db.finalizar_job"):
+            await asyncio.to_thread(_finalizar_job, job_id, emergencia_id, False)
+    await _guardar_traza(emergencia_id)
+
+    # 2. Optional LLM layer, queued: the worker moves on to the next job. While the agents
+    # deliberate the job stays in progress and its holds are confirmed once they are done
+    if llm:
+        capa_llm.cola.encolar(
+            emergencia_id,
+            lambda: _capa_llm_job(llm_client, job_id, ctx, decision, hosp_proposals, veh_proposals, deliberan),
+            (lambda: _finalizar_deliberacion(job_id, emergencia_id)) if deliberan else None,
+        )
+    print(f"[SAR] --- DESPACHO COMPLETADO (emergencia #{emergencia_id}) ---\n", flush=True)
+
+
+async def _capa_llm_job(llm_client: AsyncOpenAI, job_id: int, ctx: Dict, decision: Dict, hosp_proposals: List[Dict],
+                        veh_proposals: List[Dict], deliberan: bool):
+    emergencia_id = ctx["emergencia_id"]
+    # Failures here never undo the dispatch
+    try:
+        await _capa_llm(agents.AgentSystem(llm_client), ctx, decision, hosp_proposals, veh_proposals)
+    except Exception as e:
+        print(f"[SAR] Capa LLM fallo para emergencia #{emergencia_id}: {e}", flush=True)
+    if deliberan:
+        await _finalizar_deliberacion(job_id, emergencia_id)
+    else:
+        await _guardar_traza(emergencia_id)
+    print(f"[SAR] --- CAPA LLM COMPLETADA (emergencia #{emergencia_id}) ---\n", flush=True)
+
+
+async def _finalizar_deliberacion(job_id: int, emergencia_id: int):
+    with metrics.span("db.finalizar_job"):
+        finalizado = await asyncio.to_thread(_finalizar_job, job_id, emergencia_id, True)
+    if not finalizado:
+        # The hold expired mid-deliberation; the sweeper already re-queued this job
+        print(f"[SAR] Reserva vencida para emergencia #{emergencia_id}; se reprocesa.", flush=True)
+    await _guardar_traza(emergencia_id)
+
+
+async def _guardar_traza(emergencia_id: int):
+    """Stores the spans recorded so far in this run. Called once they are closed, so the trace
+    includes the DB write that ended the phase."""
+    # Copied on the loop: the LLM layer may still be appending to the same trace
+    spans = list(metrics.traza_actual())
+    try:
+        await asyncio.to_thread(_escribir_traza, emergencia_id, spans)
+    except Exception as e:
+        print(f"[SAR] No se pudo guardar la traza de emergencia #{emergencia_id}: {e}", flush=True)
+
+
+async def _agente(nombre: str, emergencia_id: int, coro):
+    """Runs one agent coroutine, announcing start/finish (with its output) on the dashboard stream."""
+    pubsub.broker.publicar("agente_iniciado", {"emergencia_id": emergencia_id, "agente": nombre})
+    async with metrics.span("agente", agente=nombre):
+        resultado = await coro
+    pubsub.broker.publicar("agente_finalizado", {"emergencia_id": emergencia_id, "agente": nombre, "resultado": resultado})
+    return resultado
+
+
+async def _capa_llm(agent_sys: agents.AgentSystem, ctx: Dict, decision: Dict, hosp_proposals: List[Dict], veh_proposals: List[Dict]):
+    emergencia_id = ctx["emergencia_id"]
+    emergencia_data = agents.emergencia_contexto(ctx["emergencia"])
+    activities: List[Dict] = []
+    if LLM_MODO == "override":
+        # Only the scorer's top candidates go into the prompts
+        hosp_data = [ctx["hospitales_llm"][i] for i in scoring.top_k(hosp_proposals, AGENT_TOP_K, "hospital_id")]
+        veh_data = [ctx["vehiculos_llm"][i] for i in scoring.top_k(veh_proposals, AGENT_TOP_K, "vehiculo_id")]
+        print(f"\n{'='*10} AGENTS: HOSPITAL + VEHICLE {'='*10}", flush=True)
+        print(f"[SAR] Candidatos para agentes: {len(hosp_data)}/{len(hosp_proposals)} hospitales, {len(veh_data)}/{len(veh_proposals)} vehiculos.", flush=True)
+        # HospitalAgent and VehicleAgent are independent: run them concurrently
+        llm_hosp, llm_veh = await asyncio.gather(
+            _agente("HospitalAgent", emergencia_id, agent_sys.run_hospital_agent(emergencia_data, hosp_data)),
+            _agente("VehicleAgent", emergencia_id, agent_sys.run_vehicle_agent(emergencia_data, veh_data))
+        )
+        print(f"[SAR] HospitalAgent propuso: {len(llm_hosp)} opciones. VehicleAgent propuso: {len(llm_veh)} opciones.", flush=True)
+
+        print(f"\n{'='*10} AGENT: COORDINATOR {'='*10}", flush=True)
+        # While streaming, the override is applied as soon as both ids are out (see _DecisionTemprana)
+        temprana = _DecisionTemprana(emergencia_id, decision) if agents.STREAMING else None
+        if LLM_NARRATIVA == "fusionada":
+            llm_decision, activities = await _agente("CoordinatorAgent", emergencia_id, agent_sys.run_coordinator_narrado(emergencia_data, llm_hosp, llm_veh, al_campo=temprana))
+        else:
+            llm_decision = await _agente("CoordinatorAgent", emergencia_id, agent_sys.run_coordinator_agent(emergencia_data, llm_hosp, llm_veh, al_campo=temprana))
+        print(f"[SAR] Decision CoordinatorAgent: {json.dumps(llm_decision)}", flush=True)
+
+        if temprana and temprana.task:
+            aplicado = await temprana.task
+            # The streamed ids are the ones that were acted on
+            llm_decision = {**llm_decision, **temprana.ids}
+            if aplicado:
+                actividades.escritor.registrar("CoordinatorAgent", "override", llm_decision.get("justificacion") or "Reasignación propuesta por el CoordinatorAgent")
+        else:
+            with metrics.span("db.aplicar_override"):
+                aplicado = await asyncio.to_thread(_aplicar_override, emergencia_id, decision, llm_decision)
+            if aplicado:
+                pubsub.broker.publicar("decision_aplicada", {"emergencia_id": emergencia_id, "origen": "CoordinatorAgent", **llm_decision})
+        coincide = (llm_decision.get("hospital_id"), llm_decision.get("vehiculo_id")) == (decision.get("hospital_id"), decision.get("vehiculo_id"))
+        if aplicado:
+            decision, hosp_proposals, veh_proposals = llm_decision, llm_hosp, llm_veh
+        if activities and (aplicado or coincide):
+            # The merged narrative describes the assignment that stands: no AnalystAgent call
+            _registrar_narrativa(activities)
+            return
+
+    hosp_proposals, veh_proposals = hosp_proposals[:AGENT_TOP_K], veh_proposals[:AGENT_TOP_K]
+    if LLM_NARRATIVA == "diferida":
+        narrativas.cola.encolar(emergencia_id, lambda: _narrar(agent_sys, emergencia_id, emergencia_data, decision, hosp_proposals, veh_proposals))
+        print("[SAR] Narrativa del AnalystAgent diferida.", flush=True)
+        return
+    await _narrar(agent_sys, emergencia_id, emergencia_data, decision, hosp_proposals, veh_proposals)
+
+
+class _DecisionTemprana:
+    """`al_campo` callback for the CoordinatorAgent's stream: once hospital_id and vehiculo_id have
+    both been emitted, applies the override in the background while the justification (and, when
+    merged, the narrative) is still arriving. `task` resolves to whether it was applied."""
+
+    def __init__(self, emergencia_id: int, decision: Dict):
+        self.emergencia_id = emergencia_id
+        self.decision = decision
+        self.ids: Dict = {}
+        self.task: Optional[asyncio.Task] = None
+
+    def __call__(self, ruta, valor):
+        if self.task or len(ruta) != 2 or ruta[0] != "decision" or ruta[1] not in ("hospital_id", "vehiculo_id"):
+            return
+        try:
+            self.ids[ruta[1]] = int(valor) if valor is not None else None
+        except (TypeError, ValueError):
+            self.ids[ruta[1]] = None
+        if len(self.ids) == 2:
+            self.task = asyncio.create_task(self._aplicar())
+
+    async def _aplicar(self) -> bool:
+        with metrics.span("db.aplicar_override") as sp:
+            sp.set(temprana=True)
+            # The activity entry waits for the full justification
+            aplicado = await asyncio.to_thread(_aplicar_override, self.emergencia_id, self.decision, self.ids, False)
+        if aplicado:
+            print(f"[SAR] Override aplicado antes de terminar la respuesta: {json.dumps(self.ids)}", flush=True)
+            pubsub.broker.publicar("decision_aplicada", {"emergencia_id": self.emergencia_id, "origen": "CoordinatorAgent", **self.ids})
+        return aplicado
+
+
+async def _narrar(agent_sys: agents.AgentSystem, emergencia_id: int, emergencia_data: Dict, decision: Dict,
+                  hosp_proposals: List[Dict], veh_proposals: List[Dict]):
+    print(f"\n{'='*10} AGENT: ANALYST {'='*10}", flush=True)
+    activities = await _agente("AnalystAgent", emergencia_id, agent_sys.run_analyst_agent(emergencia_data, decision, hosp_proposals, veh_proposals))
+    _registrar_narrativa(activities)
+
+
+def _registrar_narrativa(activities: List[Dict]):
+    # Narrative log entries: batched with other jobs' by the activity writer
+    actividades.escritor.registrar_muchas(activities)
+    print(f"[SAR] {len(activities)} actividades del AnalystAgent encoladas.", flush=True)
+
+
+def _tomar_job(job_id: int) -> Optional[Dict]:
+    with database.unidad_de_trabajo() as db:
+        job = db.query(models.DispatchJob).filter(models.DispatchJob.id == job_id).first()
+        if not job or job.estado == "completado":
+            return None
+
+        # Reads first, the job/emergency status writes last: the write transaction stays short
+        db_emergencia = job.emergencia
+        if db_emergencia.estado == "resuelta":
+            # Closed by an operator while queued: nothing left to dispatch
+            job.estado = "completado"
+            return None
+        emergencia = scoring.emergencia_candidato(db_emergencia, db_emergencia.zona)
+        hosp_ids, etas = _ids_candidatos(emergencia)
+        hospitales, vehiculos = _cargar_candidatos(db, hosp_ids, etas)
+
+        job.estado = "en_proceso"
+        job.intentos = (job.intentos or 0) + 1
+        # A resumed job may already have its assignment committed (the unit on its way, or a bed held)
+        ya_asignada = db_emergencia.estado in ciclo.EN_CURSO or db_emergencia.hospital_asignado_id is not None
+        if not ya_asignada:
+            db_emergencia.estado = "analizando"
+
+        ctx = {
+            "job_id": job.id,
+            "intento": job.intentos,
+            "ya_asignada": ya_asignada,
+            "asignacion": {
+                "hospital_id": db_emergencia.hospital_asignado_id,
+                "vehiculo_id": db_emergencia.vehiculo_asignado_id,
+                "justificacion": "Asignación ya registrada.",
+            },
+            "emergencia_id": db_emergencia.id,
+            "emergencia": emergencia,
+            "hospitales": [scoring.hospital_candidato(h) for h in hospitales],
+            "vehiculos": [scoring.vehiculo_candidato(v) for v in vehiculos],
+        }
+        if LLM_MODO == "override" and agents.llm_habilitado():
+            ctx["hospitales_llm"] = {h["id"]: h for h in agents.hospitales_contexto(hospitales)}
+            ctx["vehiculos_llm"] = {v["id"]: v for v in agents.vehiculos_contexto(vehiculos, etas)}
+        return ctx
+
+
+def _ids_candidatos(emergencia: Dict):
+    """Nearest hospitals plus the nearest ones fully equipped for this emergency, and the nearest
+    available vehicles with their ETA, from the spatial index. (None, {}) without coordinates."""
+    if emergencia["latitud"] is None:
+        return None, {}
+    lat, lon = emergencia["latitud"], emergencia["longitud"]
+    hosp_ids = {h["id"] for h in geo.indice.hospitales_cercanos(lat, lon, HOSPITALES_K)}
+    hosp_ids |= {h["id"] for h in geo.indice.hospitales_cercanos(lat, lon, HOSPITALES_K, emergencia["perfil"]["capacidades"])}
+    etas = {v["id"]: v["eta_min"] for v in geo.indice.vehiculos_cercanos(lat, lon, VEHICULOS_K)}
+    return hosp_ids, etas
+
+
+def _cargar_candidatos(db, hosp_ids, etas):
+    # Hospitals come from the in-memory capacity view (all of them if the index had nothing to
+    # offer): a bed counted free there but taken since just loses the CAS in reservas.tomar_cama
+    hospitales = capacidad.vista.filas(hosp_ids or None)
+    vehiculos_q = db.query(models.VehiculoRescate).filter(models.VehiculoRescate.estado == "disponible")
+    if hosp_ids is not None:
+        vehiculos_q = vehiculos_q.filter(models.VehiculoRescate.id.in_(list(etas)))
+    return hospitales, vehiculos_q.all()
+
+
+def despachar_lote(db, emergencias: List[models.Emergencia]) -> List[Dict]:
+    """Assigns a batch of new (flushed, uncommitted) emergencies jointly, inside the caller's transaction.
+
+    Candidates of every emergency are loaded in one query per table and ranked with the same scorer
+    as single dispatch; asignacion.decidir_lote then picks hospitals and vehicles for the whole batch
+    at minimum total cost, so two incidents never get the same vehicle or overfill a hospital.
+    """
+    t0 = time.perf_counter()
+    zonas = {z.id: z for z in db.query(models.Zona).filter(models.Zona.id.in_({e.zona_id for e in emergencias}))}
+    datos = [scoring.emergencia_candidato(e, zonas.get(e.zona_id)) for e in emergencias]
+    ids = [_ids_candidatos(d) for d in datos]
+
+    todos_hosp = set()
+    todas_etas = {}
+    for hosp_ids, etas in ids:
+        if hosp_ids is None:
+            todos_hosp, todas_etas = None, None
+            break
+        todos_hosp |= hosp_ids
+        todas_etas.update(etas)
+    hospitales, vehiculos = _cargar_candidatos(db, todos_hosp, todas_etas)
+    hosp_cand = {h["id"]: scoring.hospital_candidato(h) for h in hospitales}
+    veh_cand = {v.id: scoring.vehiculo_candidato(v) for v in vehiculos}
+
+    hosp_proposals, veh_proposals = [], []
+    for d, (hosp_ids, etas) in zip(datos, ids):
+        hosp_proposals.append(scoring.rankear_hospitales(d, [h for i, h in hosp_cand.items() if hosp_ids is None or i in hosp_ids]))
+        veh_proposals.append(scoring.rankear_vehiculos(d, [v for i, v in veh_cand.items() if hosp_ids is None or i in etas]))
+    decisiones = asignacion.decidir_lote(hosp_proposals, veh_proposals, {i: h["libres"] for i, h in hosp_cand.items()})
+
+    for e, decision in zip(emergencias, decisiones):
+        conflictos = reservas.reservar(db, e.id, decision["hospital_id"], decision["vehiculo_id"])
+        if conflictos:
+            # Lost to a concurrent dispatch (reservar kept nothing): leave it to the worker queue
+            decision.update(hospital_id=None, vehiculo_id=None, justificacion=f"Recursos tomados por otro despacho ({', '.join(conflictos)}); reencolada.")
+            e.estado = "en_cola"
+            continue
+        e.hospital_asignado_id = decision["hospital_id"]
+        e.vehiculo_asignado_id = decision["vehiculo_id"]
+        # asignada means a unit is on its way; a bed alone waits in activa (see ciclo._sin_vehiculo)
+        e.estado = "asignada" if decision["vehiculo_id"] else "activa"
+    db.add_all([
+        models.Actividad(agente="MotorDespacho", tipo="decision", descripcion=f"Emergencia #{e.id}: {d['justificacion']}")
+        for e, d in zip(emergencias, decisiones)
+    ])
+    print(f"[SAR] Lote de {len(emergencias)} emergencias asignado en {(time.perf_counter() - t0) * 1000:.1f} ms "
+          f"({sum(1 for d in decisiones if d['vehiculo_id'])} con vehiculo, {sum(1 for d in decisiones if d['hospital_id'])} con hospital).", flush=True)
+    return decisiones
+
+
+def _aplicar_decision(emergencia_id: int, decision: Dict, ttl: Optional[float] = None,
+                      job_id: Optional[int] = None) -> Optional[List[str]]:
+    """Reserves the decided resources and records the assignment in one transaction; returns the
+    conflicting ones (and writes nothing) when a concurrent dispatch took them first, or None when
+    the emergency was closed meanwhile. With `job_id` the job is completed in the same transaction
+    (no LLM layer follows)."""
+    with database.unidad_de_trabajo() as db:
+        db_emergencia = db.query(models.Emergencia).filter(models.Emergencia.id == emergencia_id).first()
+        if db_emergencia.estado == "resuelta":
+            if job_id is not None:
+                _completar(db, job_id)
+            return None
+        h_id = decision.get("hospital_id")
+        v_id = decision.get("vehiculo_id")
+        conflictos = reservas.reservar(db, emergencia_id, h_id, v_id, ttl)
+        if conflictos:
+            db.rollback()
+            return conflictos
+
+        db_emergencia.hospital_asignado_id = h_id
+        db_emergencia.vehiculo_asignado_id = v_id
+        db_emergencia.estado = "asignada" if v_id else "activa"
+        db.add(models.Actividad(
+            agente="MotorDespacho",
+            tipo="decision",
+            descripcion=decision.get("justificacion", "Sin justificación")
+        ))
+        if job_id is not None:
+            _completar(db, job_id)
+        return []
+
+
+def _aplicar_override(emergencia_id: int, decision: Dict, llm_decision: Dict, actividad: bool = True) -> bool:
+    """Applies the CoordinatorAgent's choice if it differs from the rule-based one and is still feasible."""
+    h_id = llm_decision.get("hospital_id")
+    v_id = llm_decision.get("vehiculo_id")
+    if not (h_id or v_id) or (h_id == decision.get("hospital_id") and v_id == decision.get("vehiculo_id")):
+        return False
+
+    with database.unidad_de_trabajo() as db:
+        db_emergencia = db.query(models.Emergencia).filter(models.Emergencia.id == emergencia_id).first()
+        if db_emergencia.estado not in ("asignada", "activa"):
+            return False  # resolved (or past the dispatch) meanwhile
+        nuevo_h = h_id if h_id and h_id != db_emergencia.hospital_asignado_id else None
+        nuevo_v = v_id if v_id and v_id != db_emergencia.vehiculo_asignado_id else None
+        # Take the new resources first (same hold as the rule-based choice), then give back the old ones
+        conflictos = reservas.reservar(db, emergencia_id, nuevo_h, nuevo_v, reservas.RESERVA_TTL_S)
+        if conflictos:
+            print(f"[SAR] Override descartado: {', '.join(conflictos)} sin cupo o no disponible.", flush=True)
+            db.rollback()
+            return False
+        if nuevo_h:
+            if db_emergencia.hospital_asignado_id:
+                reservas.liberar(db, emergencia_id, "hospital", db_emergencia.hospital_asignado_id)
+            db_emergencia.hospital_asignado_id = nuevo_h
+        if nuevo_v:
+            if db_emergencia.vehiculo_asignado_id:
+                reservas.liberar(db, emergencia_id, "vehiculo", db_emergencia.vehiculo_asignado_id)
+            db_emergencia.vehiculo_asignado_id = nuevo_v
+            # A unit is on its way now: its travel timer replaces the bed's wait for one
+            db_emergencia.estado = "asignada"
+            db_emergencia.fase_hasta = None
+        if actividad:
+            db.add(models.Actividad(
+                agente="CoordinatorAgent",
+                tipo="override",
+                descripcion=llm_decision.get("justificacion", "Reasignación propuesta por el CoordinatorAgent")
+            ))
+        return True
+
+
+def _finalizar_job(job_id: int, emergencia_id: int, confirmar: bool) -> bool:
+    """Confirms the emergency's holds (if any were taken) and completes the job, in one transaction.
+    False if the holds expired meanwhile."""
+    with database.unidad_de_trabajo() as db:
+        if confirmar:
+            db_emergencia = db.query(models.Emergencia).filter(models.Emergencia.id == emergencia_id).first()
+            resuelta = db_emergencia.estado == "resuelta"
+            if not resuelta and (db_emergencia.estado not in ("asignada", "activa") or not reservas.confirmar(db, emergencia_id)):
+                db.rollback()
+                return False
+        _completar(db, job_id)
+        return True
+
+
+def _completar(db, job_id: int):
+    job = db.query(models.DispatchJob).filter(models.DispatchJob.id == job_id).first()
+    job.estado = "completado"
+    job.error = None
+
+
+def _escribir_traza(emergencia_id: int, spans: List[Dict]):
+    # Core UPDATE, left out of the change feed: only GET /traza reads it
+    with database.unidad_de_trabajo() as db:
+        db.execute(update(models.Emergencia.__table__).where(models.Emergencia.id == emergencia_id)
+                   .values(traza=json.dumps(spans, ensure_ascii=False)))
+
+
+def _marcar_error(job_id: int, error: str):
+    with database.unidad_de_trabajo() as db:
+        job = db.query(models.DispatchJob).filter(models.DispatchJob.id == job_id).first()
+        job.estado = "error"
+        job.error = error[:500]
+        job.emergencia.traza = json.dumps(metrics.traza_actual(), ensure_ascii=False)
+        if job.emergencia.estado == "analizando":
+            job.emergencia.estado = "activa"
@@ -0,0 +1,102 @@
+import os
+import time
+import threading
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Which model answers each agent call.
+#
+# LLM_MODELOS is the pool, in preference order (defaults to LLM_MODEL alone). Each call goes to the
+# first model of `orden()`; if it has not answered after LLM_HEDGE_MS a hedged request goes to the
+# second and the first valid answer wins (AgentSystem._call_llm_enrutado). The order follows the
+# recent tail latency and error rate of each model, so a model that turns slow stops being primary.
+
+DEFAULT_MODEL = "nvidia/nemotron-nano-12b-v2-vl:free"
+# Whole call, hedges and fallbacks included; past it the rule-based dispatch stands
+DEADLINE_S = float(os.getenv("LLM_DEADLINE_S", "45"))
+# 0 disables hedging (the next model is then only tried after a failure)
+HEDGE_S = float(os.getenv("LLM_HEDGE_MS", "4000")) / 1000
+# Stats window: older samples are forgotten, so a model that recovers gets traffic back
+VENTANA_S = float(os.getenv("LLM_VENTANA_S", "300"))
+MIN_MUESTRAS = 5
+# An error weighs like this many times the model's p95
+PESO_ERROR = 4.0
+
+
+def _modelos_configurados() -> List[str]:
+    modelos = [m.strip() for m in os.getenv("LLM_MODELOS", "").split(",") if m.strip()]
+    return modelos or [os.getenv("LLM_MODEL", DEFAULT_MODEL)]
+
+
+def _percentil(valores: List[float], p: float) -> float:
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(p * len(ordenados)))]
+
+
+class EnrutadorModelos:
+    def __init__(self, modelos: List[str], deadline_s: float = DEADLINE_S, hedge_s: float = HEDGE_S):
+        self.modelos = modelos
+        self.deadline_s = deadline_s
+        self.hedge_s = hedge_s
+        self.lock = threading.Lock()
+        self.muestras: Dict[str, Deque[Tuple[float, float, bool]]] = {m: deque(maxlen=200) for m in modelos}
+        self.hedges = {"lanzados": 0, "ganados": 0}
+
+    def registrar(self, modelo: str, segundos: float, ok: bool):
+        with self.lock:
+            self.muestras.setdefault(modelo, deque(maxlen=200)).append((time.monotonic(), segundos, ok))
+
+    def _recientes(self, modelo: str) -> List[Tuple[float, float, bool]]:
+        desde = time.monotonic() - VENTANA_S
+        muestras = self.muestras.get(modelo, ())
+        while muestras and muestras[0][0] < desde:
+            muestras.popleft()
+        return list(muestras)
+
+    def _puntaje(self, modelo: str) -> Optional[float]:
+        """p95 latency inflated by the error rate; None until there are MIN_MUESTRAS recent samples."""
+        muestras = self._recientes(modelo)
+        if len(muestras) < MIN_MUESTRAS:
+            return None
+        latencias = [s for _, s, ok in muestras if ok]
+        if not latencias:
+            return float("inf")
+        errores = sum(1 for _, _, ok in muestras if not ok) / len(muestras)
+        return _percentil(latencias, 0.95) * (1 + PESO_ERROR * errores)
+
+    def orden(self) -> List[str]:
+        """Models to try, best first. Models without recent samples go right after the best measured
+        one, so hedges keep measuring them."""
+        with self.lock:
+            puntajes = {m: self._puntaje(m) for m in self.modelos}
+        medidos = sorted((m for m in self.modelos if puntajes[m] is not None), key=lambda m: puntajes[m])
+        sin_datos = [m for m in self.modelos if puntajes[m] is None]
+        return medidos[:1] + sin_datos + medidos[1:]
+
+    def hedge(self, ganado: bool):
+        with self.lock:
+            self.hedges["ganados" if ganado else "lanzados"] += 1
+
+    def resumen(self) -> Dict:
+        with self.lock:
+            modelos = {}
+            for m in self.modelos:
+                muestras = self._recientes(m)
+                latencias = [s for _, s, ok in muestras if ok]
+                modelos[m] = {
+                    "llamadas": len(muestras),
+                    "errores": sum(1 for _, _, ok in muestras if not ok),
+                    "p50_ms": round(_percentil(latencias, 0.5) * 1000, 1) if latencias else None,
+                    "p95_ms": round(_percentil(latencias, 0.95) * 1000, 1) if latencias else None,
+                    "p99_ms": round(_percentil(latencias, 0.99) * 1000, 1) if latencias else None,
+                }
+            hedges = dict(self.hedges)
+        return {"orden": self.orden(), "deadline_s": self.deadline_s, "hedge_ms": self.hedge_s * 1000,
+                "hedges": hedges, "modelos": modelos}
+
+
+enrutador = EnrutadorModelos(_modelos_configurados())
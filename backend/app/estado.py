@@ -0,0 +1,117 @@
+import os
+import json
+import time
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from . import models, schemas, changes, ciclo, capacidad
+
+# Rows kept in the change log; a client further behind than this gets the full snapshot again
+ESTADO_MAX_CAMBIOS = int(os.getenv("ESTADO_MAX_CAMBIOS", "5000"))
+MAX_ACTIVIDADES = 30
+
+# Tables that make up /api/estado; hospitals are served as capacity rows (capacidad.py)
+TABLAS = ("emergencias", "hospitales", "vehiculos", "actividades")
+
+
+def _json_default(o):
+    if hasattr(o, "isoformat"):
+        return o.isoformat()
+    return str(o)
+
+
+class EstadoCache:
+    """Versioned view of /api/estado.
+
+    Every committed change bumps a monotonic version and records the latest snapshot of the row,
+    so `delta(since)` returns only what changed after a client's version. The full snapshot is
+    serialized once per version and reused by every dashboard until the next write.
+    """
+
+    def __init__(self, max_cambios: int = ESTADO_MAX_CAMBIOS):
+        self.max_cambios = max_cambios
+        # Starts at wall-clock ms so versions handed out by a previous process are never reused
+        self.version = int(time.time() * 1000)
+        self.desde = self.version  # oldest version the log can still answer from
+        self.cambios: "OrderedDict[Tuple[str, int], Dict]" = OrderedDict()
+        self.snapshot_json: Optional[bytes] = None
+        self.snapshot_version = 0
+        self.versiones = changes.Versiones()
+        self.lock = threading.Lock()
+
+    def etag(self, version: int) -> str:
+        return f'"v{version}"'
+
+    def on_cambios(self, cambios: List[Dict]):
+        cambios = [c for c in capacidad.como_filas(cambios) if c["tabla"] in TABLAS]
+        if not cambios:
+            return
+        with self.lock:
+            # Concurrent commits of one row can be notified out of order: keep the newest
+            cambios = [c for c in cambios if self.versiones.vigente(c["tabla"], c["datos"])]
+            if not cambios:
+                return
+            self.version += 1
+            for c in cambios:
+                key = (c["tabla"], c["datos"]["id"])
+                previo = self.cambios.pop(key, None)
+                datos = c["datos"]
+                if previo and c["accion"] == "update":
+                    # Core updates (changes.registrar) may carry only the columns they touched
+                    datos = {**previo["datos"], **datos}
+                self.cambios[key] = {"version": self.version, "tabla": c["tabla"], "accion": c["accion"], "datos": datos}
+            while len(self.cambios) > self.max_cambios:
+                _, viejo = self.cambios.popitem(last=False)
+                self.desde = viejo["version"]
+            self.snapshot_json = None
+
+    def delta(self, since: int) -> Optional[bytes]:
+        """Rows changed after `since`, or None when the log no longer reaches that far back."""
+        with self.lock:
+            if since < self.desde or since > self.version:
+                return None
+            filas = []
+            for cambio in reversed(self.cambios.values()):
+                if cambio["version"] <= since:
+                    break
+                filas.append(cambio)
+            version = self.version
+
+        resultado = {"version": version, "completo": False, **{t: [] for t in TABLAS},
+                     "eliminados": {t: [] for t in TABLAS}}
+        for cambio in reversed(filas):
+            tabla, datos = cambio["tabla"], cambio["datos"]
+            resuelta = tabla == "emergencias" and datos.get("estado") == "resuelta"
+            if cambio["accion"] == "delete" or resuelta:
+                resultado["eliminados"][tabla].append(datos["id"])
+            else:
+                resultado[tabla].append(datos)
+        resultado["actividades"] = resultado["actividades"][-MAX_ACTIVIDADES:][::-1]
+        return json.dumps(resultado, default=_json_default, ensure_ascii=False).encode("utf-8")
+
+    def snapshot(self, db: Session) -> Tuple[bytes, int]:
+        with self.lock:
+            if self.snapshot_json is not None:
+                return self.snapshot_json, self.snapshot_version
+            version = self.version
+
+        estado = schemas.SystemState.model_validate({
+            "version": version,
+            "emergencias": db.query(models.Emergencia).filter(models.Emergencia.estado.in_(ciclo.ABIERTAS)).all(),
+            "hospitales": capacidad.vista.filas(),
+            "vehiculos": db.query(models.VehiculoRescate).all(),
+            "actividades": db.query(models.Actividad).order_by(models.Actividad.timestamp.desc()).limit(MAX_ACTIVIDADES).all(),
+        }, from_attributes=True)
+        cuerpo = estado.model_dump_json().encode("utf-8")
+        with self.lock:
+            # A write that landed while we were reading bumps the version; don't cache a possibly stale body
+            if self.version == version:
+                self.snapshot_json, self.snapshot_version = cuerpo, version
+        return cuerpo, version
+
+
+cache = EstadoCache()
+changes.suscribir(cache.on_cambios)
@@ -0,0 +1,207 @@
+import os
+import math
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from . import models, changes, scoring
+
+RADIO_TIERRA_KM = 6371.0
+KM_POR_GRADO = math.pi * RADIO_TIERRA_KM / 180
+CELDA_GRADOS = float(os.getenv("GEO_CELDA_GRADOS", "0.02"))  # ~2.2 km
+
+# Average speed (km/h) and fixed activation time (min) per vehicle type
+VELOCIDAD_KMH = {"ambulancia": 40.0, "ambulancia_uti": 40.0, "helicoptero": 180.0}
+ACTIVACION_MIN = {"ambulancia": 1.0, "ambulancia_uti": 2.0, "helicoptero": 8.0}
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    rlat1, rlat2 = math.radians(lat1), math.radians(lat2)
+    dlat = rlat2 - rlat1
+    dlon = math.radians(lon2 - lon1)
+    a = math.sin(dlat / 2) ** 2 + math.cos(rlat1) * math.cos(rlat2) * math.sin(dlon / 2) ** 2
+    return 2 * RADIO_TIERRA_KM * math.asin(math.sqrt(a))
+
+
+def eta_min(tipo: str, distancia_km: float) -> float:
+    velocidad = VELOCIDAD_KMH.get(tipo, VELOCIDAD_KMH["ambulancia"])
+    return ACTIVACION_MIN.get(tipo, 1.0) + distancia_km / velocidad * 60
+
+
+class SpatialIndex:
+    """Uniform lat/long grid answering k-nearest queries by haversine distance.
+
+    Points are bucketed in square cells of `celda` degrees; a query scans rings of cells around
+    the query point and stops once no unvisited ring can hold anything closer than the current k-th.
+    """
+
+    def __init__(self, celda: float = CELDA_GRADOS):
+        self.celda = celda
+        self.items: Dict[int, Dict] = {}
+        self.celdas: Dict[Tuple[int, int], set] = {}
+        self.limites: Optional[List[int]] = None  # min_i, max_i, min_j, max_j of occupied cells
+        self.lock = threading.Lock()
+
+    def _celda(self, lat: float, lon: float) -> Tuple[int, int]:
+        return (math.floor(lat / self.celda), math.floor(lon / self.celda))
+
+    def upsert(self, item_id: int, lat: Optional[float], lon: Optional[float], **datos):
+        with self.lock:
+            self._quitar(item_id)
+            if lat is None or lon is None:
+                return
+            celda = self._celda(lat, lon)
+            self.items[item_id] = {"id": item_id, "latitud": lat, "longitud": lon, "celda": celda, **datos}
+            self.celdas.setdefault(celda, set()).add(item_id)
+            if self.limites is None:
+                self.limites = [celda[0], celda[0], celda[1], celda[1]]
+            else:
+                self.limites = [min(self.limites[0], celda[0]), max(self.limites[1], celda[0]),
+                                min(self.limites[2], celda[1]), max(self.limites[3], celda[1])]
+
+    def remove(self, item_id: int):
+        with self.lock:
+            self._quitar(item_id)
+
+    def _quitar(self, item_id: int):
+        item = self.items.pop(item_id, None)
+        if item:
+            ids = self.celdas.get(item["celda"])
+            ids.discard(item_id)
+            if not ids:
+                del self.celdas[item["celda"]]
+
+    def __len__(self):
+        return len(self.items)
+
+    @staticmethod
+    def _anillo(ci: int, cj: int, r: int):
+        if r == 0:
+            yield (ci, cj)
+            return
+        for j in range(cj - r, cj + r + 1):
+            yield (ci - r, j)
+            yield (ci + r, j)
+        for i in range(ci - r + 1, ci + r):
+            yield (i, cj - r)
+            yield (i, cj + r)
+
+    def vecinos(self, lat: float, lon: float, k: int, filtro: Optional[Callable[[Dict], bool]] = None) -> List[Tuple[float, Dict]]:
+        """Returns up to k (distance_km, item) pairs, closest first."""
+        with self.lock:
+            if not self.celdas:
+                return []
+            ci, cj = self._celda(lat, lon)
+            # Worst-case width of one cell in km at this latitude (longitude degrees shrink with cos(lat))
+            paso_km = self.celda * KM_POR_GRADO * max(math.cos(math.radians(abs(lat) + self.celda)), 0.01)
+            min_i, max_i, min_j, max_j = self.limites
+            max_anillo = max(ci - min_i, max_i - ci, cj - min_j, max_j - cj, 0)
+            encontrados: List[Tuple[float, Dict]] = []
+            if len(self.items) <= (2 * max_anillo + 1) ** 2 // 4:
+                # Few points spread over many cells (e.g. a filter only some hospitals pass): walking
+                # the rings would visit more empty cells than there are points, so scan them all
+                encontrados = [(haversine_km(lat, lon, item["latitud"], item["longitud"]), item)
+                               for item in self.items.values() if not filtro or filtro(item)]
+                encontrados.sort(key=lambda x: x[0])
+                return encontrados[:k]
+            for r in range(max_anillo + 1):
+                for celda in self._anillo(ci, cj, r):
+                    for item_id in self.celdas.get(celda, ()):
+                        item = self.items[item_id]
+                        if filtro and not filtro(item):
+                            continue
+                        encontrados.append((haversine_km(lat, lon, item["latitud"], item["longitud"]), item))
+                if len(encontrados) >= k:
+                    encontrados.sort(key=lambda x: x[0])
+                    # Anything in ring r+1 or beyond is at least r * paso_km away
+                    if encontrados[k - 1][0] <= r * paso_km:
+                        break
+            encontrados.sort(key=lambda x: x[0])
+            return encontrados[:k]
+
+
+class IndiceRecursos:
+    """Available vehicles and hospitals, kept in sync with committed DB changes."""
+
+    def __init__(self):
+        self.vehiculos = SpatialIndex()
+        self.hospitales = SpatialIndex()
+        self.versiones = changes.Versiones()
+        self.lock = threading.Lock()
+
+    def cargar(self, db: Session):
+        vehiculos = [changes.snapshot(v) for v in db.query(models.VehiculoRescate).all()]
+        hospitales = [changes.snapshot(h) for h in db.query(models.Hospital).all()]
+        with self.lock:
+            self.versiones = changes.Versiones()
+            for datos in vehiculos:
+                self._aplicar(models.VehiculoRescate.__tablename__, "update", datos)
+            for datos in hospitales:
+                self._aplicar(models.Hospital.__tablename__, "update", datos)
+        print(f"[Geo] Indice cargado: {len(self.vehiculos)} vehiculos disponibles, {len(self.hospitales)} hospitales.", flush=True)
+
+    def _vehiculo(self, datos: Dict):
+        if datos.get("estado") == "disponible":
+            self.vehiculos.upsert(datos["id"], datos.get("latitud"), datos.get("longitud"), tipo=datos.get("tipo"), zona_id=datos.get("zona_id"))
+        else:
+            self.vehiculos.remove(datos["id"])
+
+    def _hospital(self, datos: Dict):
+        self.hospitales.upsert(
+            datos["id"], datos.get("latitud"), datos.get("longitud"),
+            zona_id=datos.get("zona_id"),
+            capacidades=scoring.capacidades_hospital(datos),
+            libres=(datos.get("capacidad_total") or 0) - (datos.get("ocupacion_actual") or 0)
+        )
+
+    def _aplicar(self, tabla: str, accion: str, datos: Dict):
+        # An older snapshot notified after a newer one (concurrent commits) must not bring a taken
+        # vehicle back or restore a bed count
+        if not self.versiones.vigente(tabla, datos):
+            return
+        if tabla == models.VehiculoRescate.__tablename__:
+            if accion == "delete":
+                self.vehiculos.remove(datos["id"])
+            else:
+                self._vehiculo(datos)
+        elif accion == "delete":
+            self.hospitales.remove(datos["id"])
+        else:
+            self._hospital(datos)
+
+    def on_cambios(self, cambios: List[Dict]):
+        cambios = [c for c in cambios if c["tabla"] in (models.VehiculoRescate.__tablename__, models.Hospital.__tablename__)]
+        if not cambios:
+            return
+        with self.lock:
+            for c in cambios:
+                self._aplicar(c["tabla"], c["accion"], c["datos"])
+
+    def vehiculos_cercanos(self, lat: float, lon: float, k: int) -> List[Dict]:
+        """k available vehicles with the lowest ETA, computed for their type.
+
+        Faster types (helicopter) can beat a closer ambulance, so the k nearest of each type are
+        collected first and then ordered by ETA.
+        """
+        with self.vehiculos.lock:
+            tipos = {item["tipo"] for item in self.vehiculos.items.values()}
+        resultado = []
+        for tipo in tipos:
+            for d, item in self.vehiculos.vecinos(lat, lon, k, filtro=lambda it, t=tipo: it["tipo"] == t):
+                resultado.append({"id": item["id"], "tipo": tipo, "distancia_km": round(d, 2), "eta_min": round(eta_min(tipo, d), 1)})
+        resultado.sort(key=lambda v: v["eta_min"])
+        return resultado[:k]
+
+    def hospitales_cercanos(self, lat: float, lon: float, k: int, capacidades: int = 0) -> List[Dict]:
+        """k nearest hospitals with free beds that have every capability bit in `capacidades`."""
+        def filtro(item):
+            return item["libres"] > 0 and item["capacidades"] & capacidades == capacidades
+        return [
+            {"id": item["id"], "distancia_km": round(d, 2)}
+            for d, item in self.hospitales.vecinos(lat, lon, k, filtro=filtro)
+        ]
+
+
+indice = IndiceRecursos()
+changes.suscribir(indice.on_cambios)
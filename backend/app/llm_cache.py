@@ -0,0 +1,143 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional
+
+from . import changes
+
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", "600"))
+LLM_CACHE_MAX = int(os.getenv("LLM_CACHE_MAX", "512"))
+# Optional second tier on disk (SQLite file); empty disables it
+LLM_CACHE_DB = os.getenv("LLM_CACHE_DB", "")
+
+
+def clave(model: str, system_prompt: str, payload: Any) -> str:
+    """Content address of an LLM call: model + system prompt + canonical JSON of the user payload."""
+    canonico = json.dumps([model, system_prompt, payload], sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.sha256(canonico.encode("utf-8")).hexdigest()
+
+
+def tag(tabla: str, recurso_id: Any) -> str:
+    return f"{tabla}:{recurso_id}"
+
+
+class ResponseCache:
+    """TTL + LRU cache of LLM responses, with an optional SQLite tier.
+
+    Every entry is tagged with the resources (hospitals, vehicles) its prompt described; a
+    committed change to any of them drops the entry, so a cached answer never outlives the
+    state it was computed from.
+    """
+
+    def __init__(self, max_entries: int = LLM_CACHE_MAX, ttl: float = LLM_CACHE_TTL, db_path: str = LLM_CACHE_DB):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries: "OrderedDict[str, Dict]" = OrderedDict()
+        self.por_tag: Dict[str, set] = {}
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "hits_disco": 0, "misses": 0, "evicciones": 0, "invalidaciones": 0}
+        self.db = None
+        if db_path:
+            self.db = sqlite3.connect(db_path, check_same_thread=False)
+            self.db.execute("CREATE TABLE IF NOT EXISTS llm_cache (clave TEXT PRIMARY KEY, respuesta TEXT, expira REAL)")
+            self.db.execute("CREATE TABLE IF NOT EXISTS llm_cache_tags (clave TEXT, tag TEXT)")
+            self.db.execute("CREATE INDEX IF NOT EXISTS ix_llm_cache_tags_tag ON llm_cache_tags (tag)")
+            self.db.commit()
+
+    def get(self, key: str) -> Optional[str]:
+        ahora = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry["expira"] > ahora:
+                self.entries.move_to_end(key)
+                self.stats["hits"] += 1
+                return entry["respuesta"]
+            if entry:
+                self._quitar(key)
+
+            if self.db is not None:
+                row = self.db.execute("SELECT respuesta, expira FROM llm_cache WHERE clave = ?", (key,)).fetchone()
+                if row and row[1] > ahora:
+                    tags = [t for (t,) in self.db.execute("SELECT tag FROM llm_cache_tags WHERE clave = ?", (key,))]
+                    self._guardar_memoria(key, row[0], row[1], tags)
+                    self.stats["hits_disco"] += 1
+                    return row[0]
+
+            self.stats["misses"] += 1
+            return None
+
+    def set(self, key: str, respuesta: str, tags: Iterable[str] = ()):
+        tags = list(tags)
+        expira = time.time() + self.ttl
+        with self.lock:
+            self._guardar_memoria(key, respuesta, expira, tags)
+            if self.db is not None:
+                self.db.execute("INSERT OR REPLACE INTO llm_cache (clave, respuesta, expira) VALUES (?, ?, ?)", (key, respuesta, expira))
+                self.db.execute("DELETE FROM llm_cache_tags WHERE clave = ?", (key,))
+                self.db.executemany("INSERT INTO llm_cache_tags (clave, tag) VALUES (?, ?)", [(key, t) for t in tags])
+                self.db.commit()
+
+    def invalidar(self, tags: Iterable[str]):
+        tags = list(tags)
+        with self.lock:
+            for t in tags:
+                for key in list(self.por_tag.get(t, ())):
+                    self._quitar(key)
+                    self.stats["invalidaciones"] += 1
+            if self.db is not None and tags:
+                marcas = ",".join("?" * len(tags))
+                claves = [k for (k,) in self.db.execute(f"SELECT DISTINCT clave FROM llm_cache_tags WHERE tag IN ({marcas})", tags)]
+                if claves:
+                    marcas = ",".join("?" * len(claves))
+                    self.db.execute(f"DELETE FROM llm_cache WHERE clave IN ({marcas})", claves)
+                    self.db.execute(f"DELETE FROM llm_cache_tags WHERE clave IN ({marcas})", claves)
+                    self.db.commit()
+
+    def resumen(self) -> Dict:
+        with self.lock:
+            consultas = self.stats["hits"] + self.stats["hits_disco"] + self.stats["misses"]
+            return {
+                **self.stats,
+                "entradas": len(self.entries),
+                "hit_rate": round((self.stats["hits"] + self.stats["hits_disco"]) / consultas, 3) if consultas else 0.0,
+            }
+
+    def _guardar_memoria(self, key: str, respuesta: str, expira: float, tags: List[str]):
+        if key in self.entries:
+            self._quitar(key)
+        self.entries[key] = {"respuesta": respuesta, "expira": expira, "tags": tags}
+        for t in tags:
+            self.por_tag.setdefault(t, set()).add(key)
+        while len(self.entries) > self.max_entries:
+            viejo = next(iter(self.entries))
+            self._quitar(viejo)
+            self.stats["evicciones"] += 1
+
+    def _quitar(self, key: str):
+        entry = self.entries.pop(key, None)
+        if entry:
+            for t in entry["tags"]:
+                keys = self.por_tag.get(t)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del self.por_tag[t]
+
+    def on_cambios(self, cambios: List[Dict]):
+        tags = set()
+        for c in cambios:
+            datos = c["datos"]
+            if c["tabla"] in ("hospitales", "vehiculos"):
+                tags.add(tag(c["tabla"], datos["id"]))
+            elif c["tabla"] == "doctores":
+                tags.add(tag("hospitales", datos.get("hospital_id")))
+        if tags:
+            self.invalidar(tags)
+
+
+cache = ResponseCache()
+changes.suscribir(cache.on_cambios)
@@ -0,0 +1,58 @@
+import os
+from typing import Dict
+
+import httpx
+from openai import AsyncOpenAI
+from dotenv import load_dotenv
+
+load_dotenv()
+
+OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
+BASE_URL = os.getenv("OPENROUTER_BASE_URL") or "https://openrouter.ai/api/v1"
+
+LLM_HTTP2 = os.getenv("LLM_HTTP2", "1") == "1"
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+LLM_READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", "30"))
+LLM_MAX_CONEXIONES = int(os.getenv("LLM_MAX_CONEXIONES", "20"))
+LLM_KEEPALIVE_CONEXIONES = int(os.getenv("LLM_KEEPALIVE_CONEXIONES", "10"))
+LLM_KEEPALIVE_S = float(os.getenv("LLM_KEEPALIVE_S", "60"))
+
+
+def _http2_disponible() -> bool:
+    try:
+        import h2  # noqa: F401  (httpx[http2] extra)
+        return True
+    except ImportError:
+        return False
+
+
+def crear_cliente() -> AsyncOpenAI:
+    """One pooled client for the whole process: keep-alive (HTTP/2 when available), explicit timeouts."""
+    http2 = LLM_HTTP2 and _http2_disponible()
+    http_client = httpx.AsyncClient(
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=LLM_MAX_CONEXIONES,
+            max_keepalive_connections=LLM_KEEPALIVE_CONEXIONES,
+            keepalive_expiry=LLM_KEEPALIVE_S,
+        ),
+        timeout=httpx.Timeout(LLM_READ_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+    )
+    print(f"[LLMClient] Cliente compartido: {BASE_URL} (http2={http2}, max_conexiones={LLM_MAX_CONEXIONES}).", flush=True)
+    return AsyncOpenAI(
+        base_url=BASE_URL,
+        api_key=OPENROUTER_API_KEY or "sin-clave",
+        http_client=http_client,
+        max_retries=0  # retries and backoff are handled by AgentSystem / llm_gate
+    )
+
+
+def configuracion() -> Dict:
+    return {
+        "base_url": BASE_URL,
+        "http2": LLM_HTTP2 and _http2_disponible(),
+        "max_conexiones": LLM_MAX_CONEXIONES,
+        "keepalive_conexiones": LLM_KEEPALIVE_CONEXIONES,
+        "connect_timeout_s": LLM_CONNECT_TIMEOUT,
+        "read_timeout_s": LLM_READ_TIMEOUT,
+    }
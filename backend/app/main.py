@@ -1,13 +1,19 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from . import models, routes, seed
-from .database import engine, SessionLocal
+from fastapi.responses import PlainTextResponse
+from . import models, routes, seed, worker, geo, llm_client, pubsub, actividades, metrics, ciclo, capacidad, migraciones
+from .database import engine, SessionLocal, configuracion
 
 models.Base.metadata.create_all(bind=engine)
+# Databases created by an earlier version get the columns/indexes added since
+migraciones.actualizar(engine)
+print(f"[DB] {configuracion()['url']} ({configuracion()['dialecto']})", flush=True)
 
 # Seed data if empty
 db = SessionLocal()
 seed.init_db(db)
+geo.indice.cargar(db)
+capacidad.vista.cargar(db)
 db.close()
 
 app = FastAPI(title="SAR Multi-Agent System")
@@ -22,7 +28,27 @@ app.add_middleware(
 
 app.include_router(routes.router, prefix="/api")
 
+@app.on_event("startup")
+async def start_workers():
+    # One pooled LLM client for the whole app, shared by requests and background workers
+    app.state.llm_client = llm_client.crear_cliente()
+    pubsub.broker.iniciar()
+    await actividades.escritor.iniciar()
+    await worker.dispatcher.start(app.state.llm_client)
+    await ciclo.motor.iniciar()
+
+@app.on_event("shutdown")
+async def stop_workers():
+    await ciclo.motor.detener()
+    await worker.dispatcher.stop()
+    await actividades.escritor.detener()
+    await app.state.llm_client.close()
+
 @app.get("/")
 def read_root():
     return {"message": "SAR System Backend Running"}
 
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    # Prometheus text exposition format
+    return PlainTextResponse(metrics.registro.exportar(), media_type="text/plain; version=0.0.4")
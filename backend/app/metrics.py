@@ -0,0 +1,177 @@
+import os
+import time
+import threading
+import contextvars
+from typing import Dict, List, Optional, Tuple
+
+# Structured timing for the dispatch pipeline.
+#
+# `span("nombre", agente=...)` times a block (sync or async) into a Prometheus histogram and, when
+# a trace is active (iniciar_traza), appends it to the per-emergency trace stored in
+# Emergencia.traza. Counters carry tokens, retries, fallbacks and cost. GET /metrics renders all of
+# it in the Prometheus text format.
+
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# USD per 1k tokens, for the cost counter (the default model is a free tier)
+COSTO_PROMPT_1K = float(os.getenv("LLM_COSTO_PROMPT_1K", "0"))
+COSTO_COMPLETION_1K = float(os.getenv("LLM_COSTO_COMPLETION_1K", "0"))
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Dict) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items() if v is not None))
+
+
+def _formato_labels(labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    pares = list(labels) + ([extra] if extra else [])
+    if not pares:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in pares) + "}"
+
+
+class Histogram:
+    def __init__(self, nombre: str, ayuda: str, buckets=BUCKETS):
+        self.nombre, self.ayuda, self.buckets = nombre, ayuda, buckets
+        self.series: Dict[Labels, Dict] = {}
+
+    def observar(self, valor: float, **labels):
+        serie = self.series.setdefault(_labels(labels), {"cuentas": [0] * len(self.buckets), "suma": 0.0, "n": 0})
+        for i, limite in enumerate(self.buckets):
+            if valor <= limite:
+                serie["cuentas"][i] += 1
+        serie["suma"] += valor
+        serie["n"] += 1
+
+    def exportar(self) -> List[str]:
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} histogram"]
+        for labels, serie in sorted(self.series.items()):
+            for limite, cuenta in zip(self.buckets, serie["cuentas"]):
+                lineas.append(f"{self.nombre}_bucket{_formato_labels(labels, ('le', str(limite)))} {cuenta}")
+            lineas.append(f"{self.nombre}_bucket{_formato_labels(labels, ('le', '+Inf'))} {serie['n']}")
+            lineas.append(f"{self.nombre}_sum{_formato_labels(labels)} {serie['suma']:.6f}")
+            lineas.append(f"{self.nombre}_count{_formato_labels(labels)} {serie['n']}")
+        return lineas
+
+
+class Counter:
+    def __init__(self, nombre: str, ayuda: str):
+        self.nombre, self.ayuda = nombre, ayuda
+        self.series: Dict[Labels, float] = {}
+
+    def inc(self, valor: float = 1, **labels):
+        key = _labels(labels)
+        self.series[key] = self.series.get(key, 0) + valor
+
+    def exportar(self) -> List[str]:
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} counter"]
+        for labels, valor in sorted(self.series.items()):
+            lineas.append(f"{self.nombre}{_formato_labels(labels)} {valor:g}")
+        return lineas
+
+
+class Registro:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metricas: List = []
+
+    def histogram(self, nombre: str, ayuda: str) -> Histogram:
+        h = Histogram(nombre, ayuda)
+        self.metricas.append(h)
+        return h
+
+    def counter(self, nombre: str, ayuda: str) -> Counter:
+        c = Counter(nombre, ayuda)
+        self.metricas.append(c)
+        return c
+
+    def exportar(self) -> str:
+        with self.lock:
+            return "\n".join(linea for m in self.metricas for linea in m.exportar()) + "\n"
+
+
+registro = Registro()
+span_segundos = registro.histogram("sar_span_seconds", "Duración de cada fase del pipeline de despacho")
+llm_modelo_segundos = registro.histogram("sar_llm_modelo_seconds", "Latencia de cada request al proveedor, por modelo y resultado")
+llm_tokens = registro.counter("sar_llm_tokens_total", "Tokens reportados por el proveedor (usage)")
+llm_reintentos = registro.counter("sar_llm_reintentos_total", "Reintentos de llamadas al LLM por motivo")
+llm_fallbacks = registro.counter("sar_llm_fallbacks_total", "Respuestas reemplazadas por el fallback local, por motivo")
+llm_hedges = registro.counter("sar_llm_hedges_total", "Requests de cobertura a un segundo modelo (lanzados / ganados)")
+llm_cache_hits = registro.counter("sar_llm_cache_hits_total", "Respuestas servidas desde el cache")
+llm_json_reparado = registro.counter("sar_llm_json_reparado_total", "Respuestas recuperadas por el parser tolerante")
+llm_items_descartados = registro.counter("sar_llm_items_descartados_total", "Elementos de respuestas que no validaron contra el esquema")
+narrativas_descartadas = registro.counter("sar_narrativas_descartadas_total", "Narrativas diferidas del AnalystAgent que no se generaron")
+capa_llm_descartadas = registro.counter("sar_capa_llm_descartadas_total", "Capas LLM (explicación / override) que no se ejecutaron")
+ciclo_transiciones = registro.counter("sar_ciclo_transiciones_total", "Cambios de fase de emergencias, por estado alcanzado")
+llm_costo = registro.counter("sar_llm_costo_usd_total", "Costo estimado de las llamadas al LLM")
+
+_traza: contextvars.ContextVar[Optional[Dict]] = contextvars.ContextVar("traza", default=None)
+
+
+def iniciar_traza() -> Dict:
+    """Starts collecting spans for the current task (and the threads it hands work to)."""
+    traza = {"inicio": time.perf_counter(), "spans": []}
+    _traza.set(traza)
+    return traza
+
+
+def traza_actual() -> List[Dict]:
+    traza = _traza.get()
+    return traza["spans"] if traza else []
+
+
+class span:
+    """Times a block: `with span("db.tomar_job"):` or `async with span("llm", agente=...) as s: s.set(...)`."""
+
+    def __init__(self, nombre: str, **labels):
+        self.nombre = nombre
+        self.labels = labels
+        self.attrs: Dict = {}
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duracion = time.perf_counter() - self.t0
+        with registro.lock:
+            span_segundos.observar(duracion, span=self.nombre, **self.labels)
+        traza = _traza.get()
+        if traza is not None:
+            traza["spans"].append({
+                "span": self.nombre,
+                **{k: v for k, v in self.labels.items() if v is not None},
+                "inicio_ms": round((self.t0 - traza["inicio"]) * 1000, 2),
+                "duracion_ms": round(duracion * 1000, 2),
+                **self.attrs,
+                **({"error": exc_type.__name__} if exc_type else {}),
+            })
+        return False
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return self.__exit__(exc_type, exc, tb)
+
+
+def observar(histogram: Histogram, valor: float, **labels):
+    with registro.lock:
+        histogram.observar(valor, **labels)
+
+
+def contar(counter: Counter, valor: float = 1, **labels):
+    with registro.lock:
+        counter.inc(valor, **labels)
+
+
+def registrar_tokens(agente: str, prompt_tokens: int, completion_tokens: int):
+    with registro.lock:
+        llm_tokens.inc(prompt_tokens, agente=agente, tipo="prompt")
+        llm_tokens.inc(completion_tokens, agente=agente, tipo="completion")
+        costo = prompt_tokens / 1000 * COSTO_PROMPT_1K + completion_tokens / 1000 * COSTO_COMPLETION_1K
+        if costo:
+            llm_costo.inc(costo, agente=agente)
@@ -0,0 +1,99 @@
+from typing import List
+
+from sqlalchemy import MetaData, Table, inspect, literal, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.schema import CreateTable
+
+from . import models
+
+# Schema upgrade for databases created by an earlier version of the app.
+#
+# create_all only creates missing tables, so a database from before a model change would lack its
+# new columns (e.g. `version`) and every query naming them would fail. At startup `actualizar`
+# compares each existing table with the models and adds what is missing: columns (ALTER TABLE ADD
+# COLUMN, with the column's default so NOT NULL ones can be added to tables that have rows) and
+# indexes. Table options no ALTER can change (SQLite AUTOINCREMENT on emergencias) are applied by
+# rebuilding the table. Every step is idempotent and the whole upgrade runs in one transaction, so
+# a failed one leaves the database as it was.
+
+
+def _default_sql(columna, conn: Connection):
+    if columna.server_default is not None:
+        arg = columna.server_default.arg
+        return arg.text if hasattr(arg, "text") else f"'{arg}'"
+    if columna.default is not None and columna.default.is_scalar:
+        return str(literal(columna.default.arg, columna.type).compile(dialect=conn.dialect, compile_kwargs={"literal_binds": True}))
+    return None
+
+
+def _columnas(conn: Connection, tabla: Table) -> List[str]:
+    existentes = {c["name"] for c in inspect(conn).get_columns(tabla.name)}
+    q = conn.dialect.identifier_preparer.quote
+    pasos = []
+    for columna in tabla.columns:
+        if columna.name in existentes:
+            continue
+        ddl = f"ALTER TABLE {q(tabla.name)} ADD COLUMN {q(columna.name)} {columna.type.compile(dialect=conn.dialect)}"
+        default = _default_sql(columna, conn)
+        if default is not None:
+            ddl += f" DEFAULT {default}"
+            if not columna.nullable:
+                ddl += " NOT NULL"
+        conn.execute(text(ddl))
+        pasos.append(f"{tabla.name}.{columna.name}")
+    return pasos
+
+
+def _indices(conn: Connection, tabla: Table) -> List[str]:
+    existentes = {i["name"] for i in inspect(conn).get_indexes(tabla.name)}
+    pasos = []
+    for indice in sorted(tabla.indexes, key=lambda i: i.name):
+        if indice.name not in existentes:
+            indice.create(conn)
+            pasos.append(indice.name)
+    return pasos
+
+
+def _autoincrement_sqlite(conn: Connection, tabla: Table, archivo: Table) -> List[str]:
+    """Rebuilds `tabla` with AUTOINCREMENT (copy, drop, rename), so ids of rows moved to `archivo`
+    are never handed out again."""
+    sql = conn.execute(text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :n"), {"n": tabla.name}).scalar()
+    if not sql or "AUTOINCREMENT" in sql.upper():
+        return []
+    # Same definition under a temporary name; foreign keys resolve against a copy of the whole schema
+    copia = MetaData()
+    for t in models.Base.metadata.sorted_tables:
+        t.to_metadata(copia)
+    nueva = tabla.to_metadata(copia, name=f"{tabla.name}_nueva")
+    columnas = ", ".join(conn.dialect.identifier_preparer.quote(c.name) for c in tabla.columns)
+    conn.execute(CreateTable(nueva))
+    conn.execute(text(f"INSERT INTO {nueva.name} ({columnas}) SELECT {columnas} FROM {tabla.name}"))
+    conn.execute(text(f"DROP TABLE {tabla.name}"))
+    conn.execute(text(f"ALTER TABLE {nueva.name} RENAME TO {tabla.name}"))
+    ultimo = conn.execute(text(
+        f"SELECT max(id) FROM (SELECT max(id) AS id FROM {tabla.name} UNION ALL SELECT max(id) FROM {archivo.name})"
+    )).scalar()
+    conn.execute(text("DELETE FROM sqlite_sequence WHERE name = :n"), {"n": tabla.name})
+    conn.execute(text("INSERT INTO sqlite_sequence (name, seq) VALUES (:n, :s)"), {"n": tabla.name, "s": ultimo or 0})
+    return [f"{tabla.name} AUTOINCREMENT"]
+
+
+def actualizar(engine: Engine) -> List[str]:
+    """Brings the tables created by create_all up to the current models; returns the steps applied."""
+    pasos: List[str] = []
+    with engine.begin() as conn:
+        if conn.dialect.name == "sqlite":
+            # pysqlite only opens transactions before DML: without this the DDL (and a half-done
+            # table rebuild) would be committed statement by statement
+            conn.exec_driver_sql("BEGIN")
+        tablas = set(inspect(conn).get_table_names())
+        for tabla in models.Base.metadata.sorted_tables:
+            if tabla.name in tablas:
+                pasos += _columnas(conn, tabla)
+        if conn.dialect.name == "sqlite":
+            pasos += _autoincrement_sqlite(conn, models.Emergencia.__table__, models.EmergenciaArchivada.__table__)
+        for tabla in models.Base.metadata.sorted_tables:
+            pasos += _indices(conn, tabla)
+    if pasos:
+        print(f"[DB] Esquema actualizado: {', '.join(pasos)}", flush=True)
+    return pasos
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, Boolean, ForeignKey, DateTime
+from sqlalchemy import Column, Integer, String, Float, Boolean, ForeignKey, DateTime, Index, Text, text
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from .database import Base
@@ -28,11 +28,17 @@ class Hospital(Base):
     tiene_unidad_quemados = Column(Boolean, default=False)
     latitud = Column(Float)
     longitud = Column(Float)
+    # Optimistic concurrency: every bed-count change bumps it (see reservas.py)
+    version = Column(Integer, nullable=False, default=0, server_default=text("0"))
 
     zona = relationship("Zona", back_populates="hospitales")
     doctores = relationship("Doctor", back_populates="hospital")
     emergencias = relationship("Emergencia", back_populates="hospital_asignado")
 
+    __mapper_args__ = {"version_id_col": version}
+    # GET /api/hospitales?zona_id=, in id order
+    __table_args__ = (Index("ix_hospitales_zona", "zona_id", "id"),)
+
 class Doctor(Base):
     __tablename__ = "doctores"
     id = Column(Integer, primary_key=True, index=True)
@@ -49,13 +55,18 @@ class VehiculoRescate(Base):
     nombre = Column(String)
     tipo = Column(String) # ambulancia, helicoptero, etc.
     zona_id = Column(Integer, ForeignKey("zonas.id"))
-    estado = Column(String, default="disponible") # disponible, en_camino, ocupado
+    estado = Column(String, default="disponible", index=True) # disponible, reservado, en_camino, en_escena, trasladando, ocupado
     latitud = Column(Float)
     longitud = Column(Float)
+    version = Column(Integer, nullable=False, default=0, server_default=text("0"))
 
     zona = relationship("Zona", back_populates="vehiculos")
     emergencias = relationship("Emergencia", back_populates="vehiculo_asignado")
 
+    __mapper_args__ = {"version_id_col": version}
+    # GET /api/vehiculos?zona_id=&estado=, in id order
+    __table_args__ = (Index("ix_vehiculos_zona_estado", "zona_id", "estado", "id"),)
+
 class Emergencia(Base):
     __tablename__ = "emergencias"
     id = Column(Integer, primary_key=True, index=True)
@@ -64,23 +75,110 @@ class Emergencia(Base):
     zona_id = Column(Integer, ForeignKey("zonas.id"))
     latitud = Column(Float, nullable=True)
     longitud = Column(Float, nullable=True)
-    estado = Column(String, default="activa") # activa, asignada, resuelta
+    # en_cola, analizando, activa (no unit; at most a bed on hold), asignada (unit en camino), en_escena, trasladando, resuelta
+    estado = Column(String, default="activa", index=True)
     
     vehiculo_asignado_id = Column(Integer, ForeignKey("vehiculos.id"), nullable=True)
     hospital_asignado_id = Column(Integer, ForeignKey("hospitales.id"), nullable=True)
     
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # JSON list of timed spans of the last dispatch run (metrics.py), GET /api/emergencias/{id}/traza
+    traza = Column(Text, nullable=True)
+    # When the lifecycle engine (ciclo.py) moves it to its next phase
+    fase_hasta = Column(DateTime, nullable=True, index=True)
+    resuelta_at = Column(DateTime, nullable=True)
 
     zona = relationship("Zona", back_populates="emergencias")
     vehiculo_asignado = relationship("VehiculoRescate", back_populates="emergencias")
     hospital_asignado = relationship("Hospital", back_populates="emergencias")
 
+    # Open emergencies by status, oldest first (/api/estado, dashboards). AUTOINCREMENT: SQLite would
+    # otherwise hand out the id of the newest emergency again once it has been archived
+    __table_args__ = (
+        Index("ix_emergencias_estado_created", "estado", "created_at"),
+        # Keyset pages of GET /api/emergencias filtered by zone or type: (filter, created_at, id)
+        Index("ix_emergencias_zona_created", "zona_id", "created_at", "id"),
+        Index("ix_emergencias_tipo_created", "tipo", "created_at", "id"),
+        {"sqlite_autoincrement": True},
+    )
+
 class Actividad(Base):
     __tablename__ = "actividades"
     id = Column(Integer, primary_key=True, index=True)
     agente = Column(String)
     tipo = Column(String)
     descripcion = Column(String)
-    timestamp = Column(DateTime, default=datetime.utcnow)
+    timestamp = Column(DateTime, default=datetime.utcnow, index=True)
+
+    # GET /api/actividades by type or agent, newest first
+    __table_args__ = (
+        Index("ix_actividades_tipo_timestamp", "tipo", "timestamp", "id"),
+        Index("ix_actividades_agente_timestamp", "agente", "timestamp", "id"),
+    )
+
+
+class DispatchJob(Base):
+    __tablename__ = "dispatch_jobs"
+    id = Column(Integer, primary_key=True, index=True)
+    emergencia_id = Column(Integer, ForeignKey("emergencias.id"), index=True)
+    estado = Column(String, default="pendiente", index=True) # pendiente, en_proceso, completado, error
+    intentos = Column(Integer, default=0)
+    error = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    emergencia = relationship("Emergencia")
+
+
+class Reserva(Base):
+    """A vehicle or hospital bed taken for an emergency. `retenida` holds expire at expira_en."""
+    __tablename__ = "reservas"
+    id = Column(Integer, primary_key=True, index=True)
+    emergencia_id = Column(Integer, ForeignKey("emergencias.id"), index=True)
+    recurso = Column(String) # vehiculo, hospital
+    recurso_id = Column(Integer)
+    estado = Column(String, default="retenida") # retenida, confirmada, liberada, expirada
+    # Hold deadline; for a confirmed bed, the patient's discharge (set when the emergency resolves)
+    expira_en = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (Index("ix_reservas_estado_expira", "estado", "expira_en"),)
+
+
+class EmergenciaArchivada(Base):
+    """Resolved emergencies moved out of `emergencias` by ciclo.archivar (cold storage, no FKs)."""
+    __tablename__ = "emergencias_archivo"
+    id = Column(Integer, primary_key=True)
+    tipo = Column(String)
+    descripcion = Column(String)
+    zona_id = Column(Integer)
+    latitud = Column(Float, nullable=True)
+    longitud = Column(Float, nullable=True)
+    estado = Column(String)
+    vehiculo_asignado_id = Column(Integer, nullable=True)
+    hospital_asignado_id = Column(Integer, nullable=True)
+    created_at = Column(DateTime)
+    updated_at = Column(DateTime)
+    traza = Column(Text, nullable=True)
+    resuelta_at = Column(DateTime, index=True)
+    archivada_at = Column(DateTime, default=datetime.utcnow)
 
+    # GET /api/emergencias?archivo=true, newest first, optionally by zone
+    __table_args__ = (
+        Index("ix_emergencias_archivo_created", "created_at", "id"),
+        Index("ix_emergencias_archivo_zona_created", "zona_id", "created_at", "id"),
+    )
+
+
+class OcupacionMuestra(Base):
+    """Fleet and bed occupancy sampled every CICLO_MUESTREO_S (GET /api/ocupacion)."""
+    __tablename__ = "ocupacion_serie"
+    id = Column(Integer, primary_key=True, index=True)
+    timestamp = Column(DateTime, default=datetime.utcnow, index=True)
+    vehiculos_disponibles = Column(Integer)
+    vehiculos_en_servicio = Column(Integer)
+    camas_ocupadas = Column(Integer)
+    camas_totales = Column(Integer)
+    emergencias_abiertas = Column(Integer)
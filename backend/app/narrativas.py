@@ -0,0 +1,72 @@
+import os
+import time
+import asyncio
+from typing import Awaitable, Callable, Optional
+
+from . import metrics
+
+# Deferred AnalystAgent narratives (LLM_NARRATIVA=diferida).
+#
+# The dashboard narrative is not needed to dispatch, so jobs hand it to this queue and finish.
+# A single consumer runs the narratives only while the dispatch queue is idle; when it is full
+# the oldest narrative is dropped, and one that waited too long is dropped instead of run.
+
+NARRATIVA_COLA_MAX = int(os.getenv("NARRATIVA_COLA_MAX", "50"))
+# Narratives older than this are stale for the dashboard
+NARRATIVA_MAX_ESPERA_S = float(os.getenv("NARRATIVA_MAX_ESPERA_S", "60"))
+# How often the consumer re-checks a busy dispatch queue
+NARRATIVA_PAUSA_S = 0.5
+
+
+class ColaNarrativas:
+    def __init__(self, maximo: int = NARRATIVA_COLA_MAX):
+        self.maximo = maximo
+        self.queue: Optional[asyncio.Queue] = None
+        self.task: Optional[asyncio.Task] = None
+        self.ocupado: Callable[[], bool] = lambda: False
+
+    def iniciar(self, ocupado: Callable[[], bool]):
+        """`ocupado()` tells whether dispatch work is waiting; narratives yield to it."""
+        self.ocupado = ocupado
+        self.queue = asyncio.Queue(maxsize=self.maximo)
+        self.task = asyncio.create_task(self._loop())
+
+    async def detener(self):
+        if self.task:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        if self.queue:
+            descartadas = self.queue.qsize()
+            if descartadas:
+                metrics.contar(metrics.narrativas_descartadas, descartadas, motivo="apagado")
+            self.queue = None
+
+    def encolar(self, emergencia_id: int, crear: Callable[[], Awaitable]):
+        """Queues `crear()` (a coroutine factory) for later; returns immediately. Must be called
+        on the event loop."""
+        if self.queue is None:
+            metrics.contar(metrics.narrativas_descartadas, motivo="sin_cola")
+            return
+        if self.queue.full():
+            viejo_id, _, _ = self.queue.get_nowait()
+            print(f"[Narrativas] Cola llena: se descarta la narrativa de emergencia #{viejo_id}.", flush=True)
+            metrics.contar(metrics.narrativas_descartadas, motivo="cola_llena")
+        self.queue.put_nowait((emergencia_id, time.monotonic(), crear))
+
+    async def _loop(self):
+        while True:
+            emergencia_id, encolada, crear = await self.queue.get()
+            while self.ocupado() and time.monotonic() - encolada < NARRATIVA_MAX_ESPERA_S:
+                await asyncio.sleep(NARRATIVA_PAUSA_S)
+            if time.monotonic() - encolada >= NARRATIVA_MAX_ESPERA_S:
+                print(f"[Narrativas] Narrativa de emergencia #{emergencia_id} vencida, descartada.", flush=True)
+                metrics.contar(metrics.narrativas_descartadas, motivo="vencida")
+                continue
+            try:
+                await crear()
+            except Exception as e:
+                print(f"[Narrativas] Error en narrativa de emergencia #{emergencia_id}: {e}", flush=True)
+
+
+cola = ColaNarrativas()
@@ -0,0 +1,91 @@
+import os
+import json
+import asyncio
+import itertools
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Set
+
+from . import changes, capacidad
+
+# Events buffered per dashboard client; a slow client loses its oldest events, never blocks publishers
+MAX_COLA_CLIENTE = int(os.getenv("STREAM_MAX_COLA", "200"))
+
+# Committed row changes forwarded to dashboards: table -> (insert event, update event)
+EVENTOS_TABLA = {
+    "emergencias": ("emergencia_creada", "emergencia_actualizada"),
+    "vehiculos": ("vehiculo_actualizado", "vehiculo_actualizado"),
+    "hospitales": ("hospital_actualizado", "hospital_actualizado"),
+    "actividades": ("actividad", "actividad"),
+}
+
+
+def _json_default(o: Any):
+    if isinstance(o, datetime):
+        return o.isoformat()
+    return str(o)
+
+
+class Broker:
+    """In-process pub/sub backing /api/stream.
+
+    Each event is serialized once and fanned out to every subscriber queue, so the cost of a
+    publish does not depend on how the dashboards consume it and no client ever polls the DB.
+    """
+
+    def __init__(self, max_cola: int = MAX_COLA_CLIENTE):
+        self.max_cola = max_cola
+        self.suscriptores: Set[asyncio.Queue] = set()
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.secuencia = itertools.count(1)
+        self.versiones = changes.Versiones()
+        self.lock = threading.Lock()
+
+    def iniciar(self):
+        self.loop = asyncio.get_running_loop()
+
+    def suscribir(self) -> asyncio.Queue:
+        cola = asyncio.Queue(maxsize=self.max_cola)
+        self.suscriptores.add(cola)
+        return cola
+
+    def desuscribir(self, cola: asyncio.Queue):
+        self.suscriptores.discard(cola)
+
+    def publicar(self, tipo: str, datos: Dict):
+        """Safe to call from any thread (DB phases run on worker threads)."""
+        if self.loop is None or not self.suscriptores:
+            return
+        evento = {"id": next(self.secuencia), "tipo": tipo, "data": json.dumps(datos, default=_json_default, ensure_ascii=False)}
+        try:
+            en_loop = asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            en_loop = False
+        if en_loop:
+            self._entregar(evento)
+        else:
+            self.loop.call_soon_threadsafe(self._entregar, evento)
+
+    def _entregar(self, evento: Dict):
+        for cola in list(self.suscriptores):
+            if cola.full():
+                cola.get_nowait()
+            cola.put_nowait(evento)
+
+    def on_cambios(self, cambios: List[Dict]):
+        # Hospitals go out as capacity rows (free beds, doctors per specialty), also when a doctor changes
+        filas = capacidad.como_filas(cambios)
+        # Under the lock, so a stale row can neither be published nor overtake a newer one
+        with self.lock:
+            for c in filas:
+                eventos = EVENTOS_TABLA.get(c["tabla"])
+                if eventos and c["accion"] != "delete" and self.versiones.vigente(c["tabla"], c["datos"]):
+                    self.publicar(eventos[0] if c["accion"] == "insert" else eventos[1], c["datos"])
+
+
+def formato_sse(evento: Dict) -> str:
+    return f"id: {evento['id']}\nevent: {evento['tipo']}\ndata: {evento['data']}\n\n"
+
+
+broker = Broker()
+changes.suscribir(broker.on_cambios)
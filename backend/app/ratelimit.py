@@ -0,0 +1,147 @@
+import os
+import time
+import asyncio
+from typing import Optional
+
+LLM_RPM = float(os.getenv("LLM_RPM", "20"))
+LLM_BURST = int(os.getenv("LLM_BURST", "4"))
+# Tokens per minute (prompt + completion); 0 disables the token budget
+LLM_TPM = float(os.getenv("LLM_TPM", "0"))
+CB_UMBRAL_FALLOS = int(os.getenv("LLM_CB_FALLOS", "5"))
+CB_ENFRIAMIENTO_S = float(os.getenv("LLM_CB_ENFRIAMIENTO", "30"))
+
+
+class AsyncRateLimiter:
+    """Token bucket: at most `rate` units per `per` seconds, with bursts of up to `burst`.
+
+    Waiting is done with asyncio.sleep, so a throttled agent call never blocks a thread.
+    Waiters are served in arrival order (asyncio.Lock is FIFO).
+    """
+
+    def __init__(self, rate: float, per: float = 60.0, burst: float = 1):
+        self.rate = rate
+        self.per = per
+        self.capacity = max(1.0, float(burst))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.pausa_hasta = 0.0
+        self._lock: Optional[asyncio.Lock] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _get_lock(self) -> asyncio.Lock:
+        # The limiter is module-level; rebind the lock if the event loop changed (tests, reloads).
+        loop = asyncio.get_running_loop()
+        if self._lock is None or self._loop is not loop:
+            self._lock = asyncio.Lock()
+            self._loop = loop
+        return self._lock
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate / self.per)
+        self.updated = now
+
+    async def acquire(self, cantidad: float = 1):
+        if self.rate <= 0:
+            return
+        # A single request larger than the bucket would wait forever; let it drain the bucket instead
+        cantidad = min(cantidad, self.capacity)
+        async with self._get_lock():
+            while True:
+                espera = self.pausa_hasta - time.monotonic()
+                if espera > 0:
+                    await asyncio.sleep(espera)
+                self._refill()
+                if self.tokens >= cantidad:
+                    break
+                await asyncio.sleep((cantidad - self.tokens) * self.per / self.rate)
+            self.tokens -= cantidad
+
+    def ajustar(self, delta: float):
+        """Charges (or refunds) the difference between an estimate and the real consumption."""
+        if self.rate > 0:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens - delta)
+
+    def pausar(self, segundos: float):
+        """Provider asked us to back off (429): every caller waits, not just the one that got it."""
+        self.pausa_hasta = max(self.pausa_hasta, time.monotonic() + segundos)
+
+
+class CircuitBreaker:
+    """cerrado -> abierto after `umbral` consecutive failures; after `enfriamiento` seconds one probe
+    call is let through (semi_abierto) and its outcome closes or re-opens the circuit. A probe that
+    ends without an outcome (cancelled, rejected request) hands the turn to the next call, and one
+    that never reports back stops blocking after another `enfriamiento`."""
+
+    def __init__(self, umbral: int = CB_UMBRAL_FALLOS, enfriamiento: float = CB_ENFRIAMIENTO_S):
+        self.umbral = umbral
+        self.enfriamiento = enfriamiento
+        self.estado = "cerrado"
+        self.fallos = 0
+        self.abierto_desde = 0.0
+        self.prueba_desde = 0.0
+        self.rechazadas = 0
+
+    def permitir(self) -> bool:
+        if self.estado == "cerrado":
+            return True
+        ahora = time.monotonic()
+        if (self.estado == "abierto" and ahora - self.abierto_desde >= self.enfriamiento) \
+                or (self.estado == "semi_abierto" and ahora - self.prueba_desde >= self.enfriamiento):
+            self.estado = "semi_abierto"
+            self.prueba_desde = ahora
+            return True
+        self.rechazadas += 1
+        return False
+
+    def exito(self):
+        self.estado = "cerrado"
+        self.fallos = 0
+
+    def fallo(self):
+        self.fallos += 1
+        if self.estado == "semi_abierto" or self.fallos >= self.umbral:
+            if self.estado != "abierto":
+                print(f"[CircuitBreaker] Abierto tras {self.fallos} fallos; usando fallback local por {self.enfriamiento:.0f}s.", flush=True)
+            self.estado = "abierto"
+            self.abierto_desde = time.monotonic()
+
+    def cancelar_prueba(self):
+        """The probe ended without telling whether the provider is back: open again, with the
+        cooldown already served, so the next call probes."""
+        if self.estado == "semi_abierto":
+            self.estado = "abierto"
+
+
+class LLMGate:
+    """Process-wide admission control for every LLM call: requests/minute, tokens/minute and a circuit breaker."""
+
+    def __init__(self):
+        self.rpm = AsyncRateLimiter(LLM_RPM, per=60.0, burst=LLM_BURST)
+        self.tpm = AsyncRateLimiter(LLM_TPM, per=60.0, burst=LLM_TPM)
+        self.breaker = CircuitBreaker()
+
+    async def acquire(self, tokens_estimados: int):
+        await self.rpm.acquire()
+        await self.tpm.acquire(tokens_estimados)
+
+    def registrar_tokens(self, estimados: int, reales: int):
+        self.tpm.ajustar(reales - estimados)
+
+    def pausar(self, segundos: float):
+        self.rpm.pausar(segundos)
+        self.tpm.pausar(segundos)
+
+    def resumen(self) -> dict:
+        return {
+            "circuito": self.breaker.estado,
+            "fallos_consecutivos": self.breaker.fallos,
+            "rechazadas": self.breaker.rechazadas,
+            "rpm_disponibles": round(self.rpm.tokens, 2),
+            "tpm_disponibles": round(self.tpm.tokens, 2) if LLM_TPM > 0 else None,
+        }
+
+
+# Shared by every AgentSystem in the process
+llm_gate = LLMGate()
@@ -0,0 +1,177 @@
+import os
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.util import identity_key
+
+from . import models, changes
+
+# Vehicles and beds are taken with compare-and-set UPDATEs (WHERE estado = 'disponible',
+# WHERE ocupacion_actual < capacidad_total) that bump the row version. Two workers racing for
+# the same unit cannot both win, and nothing is locked beyond the single row being written,
+# so any number of workers can dispatch in parallel.
+
+# Lifetime of a hold taken while the agents deliberate (LLM_MODO=override)
+RESERVA_TTL_S = float(os.getenv("RESERVA_TTL_S", "60"))
+# How often the worker releases expired holds
+RESERVA_BARRIDO_S = float(os.getenv("RESERVA_BARRIDO_S", "5"))
+
+ACTIVAS = ("retenida", "confirmada")
+# Vehicle states that belong to an emergency (ciclo.py moves them along)
+EN_MISION = ("reservado", "en_camino", "en_escena", "trasladando")
+
+
+def _cas(db: Session, modelo, recurso_id: int, condiciones: List, valores: Dict) -> bool:
+    """UPDATE ... WHERE id = :id AND <condiciones>; True if this call won the row."""
+    tabla = modelo.__table__
+    resultado = db.execute(
+        update(tabla)
+        .where(tabla.c.id == recurso_id, *condiciones)
+        .values(version=tabla.c.version + 1, **valores)
+    )
+    if resultado.rowcount != 1:
+        return False
+    # Objects of this row already in the session are now stale
+    obj = db.identity_map.get(identity_key(modelo, recurso_id))
+    if obj is not None:
+        db.expire(obj)
+    fila = db.execute(select(tabla).where(tabla.c.id == recurso_id)).mappings().first()
+    changes.registrar(db, tabla.name, "update", dict(fila))
+    return True
+
+
+def tomar_vehiculo(db: Session, vehiculo_id: int, estado: str = "en_camino") -> bool:
+    v = models.VehiculoRescate.__table__.c
+    return _cas(db, models.VehiculoRescate, vehiculo_id, [v.estado == "disponible"], {"estado": estado})
+
+
+def tomar_cama(db: Session, hospital_id: int) -> bool:
+    h = models.Hospital.__table__.c
+    return _cas(db, models.Hospital, hospital_id, [h.ocupacion_actual < h.capacidad_total],
+                {"ocupacion_actual": h.ocupacion_actual + 1})
+
+
+def devolver_vehiculo(db: Session, vehiculo_id: int, posicion: Optional[Tuple[float, float]] = None) -> bool:
+    """Back to 'disponible' from any mission state, optionally where the mission left it."""
+    v = models.VehiculoRescate.__table__.c
+    valores = {"estado": "disponible", **_posicion(posicion)}
+    return _cas(db, models.VehiculoRescate, vehiculo_id, [v.estado.in_(EN_MISION)], valores)
+
+
+def mover_vehiculo(db: Session, vehiculo_id: int, desde: str, hasta: str,
+                   posicion: Optional[Tuple[float, float]] = None) -> bool:
+    """Mission phase change (en_camino -> en_escena -> trasladando), only from the expected state."""
+    v = models.VehiculoRescate.__table__.c
+    return _cas(db, models.VehiculoRescate, vehiculo_id, [v.estado == desde], {"estado": hasta, **_posicion(posicion)})
+
+
+def _posicion(posicion: Optional[Tuple[float, float]]) -> Dict:
+    if not posicion or posicion[0] is None or posicion[1] is None:
+        return {}
+    return {"latitud": posicion[0], "longitud": posicion[1]}
+
+
+def devolver_cama(db: Session, hospital_id: int) -> bool:
+    h = models.Hospital.__table__.c
+    return _cas(db, models.Hospital, hospital_id, [h.ocupacion_actual > 0], {"ocupacion_actual": h.ocupacion_actual - 1})
+
+
+def reservar(db: Session, emergencia_id: int, hospital_id: Optional[int], vehiculo_id: Optional[int],
+             ttl: Optional[float] = None) -> List[str]:
+    """Takes the hospital bed and the vehicle for an emergency, in the caller's transaction.
+
+    With `ttl` the vehicle is only held (estado 'reservado') until `confirmar`; otherwise it goes
+    straight to 'en_camino'. Returns the resources that were already taken ('hospital',
+    'vehiculo'); in that case nothing is kept (a unit this call did win is given back) and the
+    caller should decide again without them.
+    """
+    estado = "retenida" if ttl is not None else "confirmada"
+    expira = datetime.utcnow() + timedelta(seconds=ttl) if ttl is not None else None
+    conflictos, tomados = [], []
+    if vehiculo_id:
+        if tomar_vehiculo(db, vehiculo_id, "reservado" if ttl is not None else "en_camino"):
+            tomados.append(("vehiculo", vehiculo_id))
+        else:
+            conflictos.append("vehiculo")
+    if hospital_id:
+        if tomar_cama(db, hospital_id):
+            tomados.append(("hospital", hospital_id))
+        else:
+            conflictos.append("hospital")
+    if conflictos:
+        # All or nothing: batch dispatch keeps its transaction going after a conflict
+        for recurso, recurso_id in tomados:
+            if recurso == "vehiculo":
+                devolver_vehiculo(db, recurso_id)
+            else:
+                devolver_cama(db, recurso_id)
+        return conflictos
+    db.add_all([
+        models.Reserva(emergencia_id=emergencia_id, recurso=recurso, recurso_id=recurso_id, estado=estado, expira_en=expira)
+        for recurso, recurso_id in tomados
+    ])
+    return []
+
+
+def confirmar(db: Session, emergencia_id: int) -> bool:
+    """Turns the emergency's holds into firm reservations. False if a hold was lost (expired)."""
+    retenidas = db.query(models.Reserva).filter(
+        models.Reserva.emergencia_id == emergencia_id,
+        models.Reserva.estado == "retenida"
+    ).all()
+    v = models.VehiculoRescate.__table__.c
+    for r in retenidas:
+        if r.recurso == "vehiculo" and not _cas(db, models.VehiculoRescate, r.recurso_id, [v.estado == "reservado"], {"estado": "en_camino"}):
+            return False
+        r.estado = "confirmada"
+        r.expira_en = None
+    return True
+
+
+def liberar(db: Session, emergencia_id: int, recurso: Optional[str] = None, recurso_id: Optional[int] = None,
+            estado_final: str = "liberada", posicion: Optional[Tuple[float, float]] = None) -> List[models.Reserva]:
+    """Gives back the emergency's active reservations (optionally only one resource); a released
+    vehicle is left at `posicion` if given."""
+    q = db.query(models.Reserva).filter(
+        models.Reserva.emergencia_id == emergencia_id,
+        models.Reserva.estado.in_(ACTIVAS)
+    )
+    if recurso:
+        q = q.filter(models.Reserva.recurso == recurso)
+    if recurso_id:
+        q = q.filter(models.Reserva.recurso_id == recurso_id)
+    reservas = q.all()
+    for r in reservas:
+        if r.recurso == "vehiculo":
+            devolver_vehiculo(db, r.recurso_id, posicion)
+        else:
+            devolver_cama(db, r.recurso_id)
+        r.estado = estado_final
+    return reservas
+
+
+def dar_altas(db: Session, ahora: Optional[datetime] = None) -> int:
+    """Frees the beds of patients whose discharge time (expira_en of a confirmed bed) has passed."""
+    altas = db.query(models.Reserva).filter(
+        models.Reserva.recurso == "hospital",
+        models.Reserva.estado == "confirmada",
+        models.Reserva.expira_en <= (ahora or datetime.utcnow())
+    ).all()
+    for r in altas:
+        devolver_cama(db, r.recurso_id)
+        r.estado = "liberada"
+    return len(altas)
+
+
+def expirar_vencidas(db: Session) -> List[int]:
+    """Releases holds past their deadline; returns the ids of the emergencies that lost them."""
+    vencidas = db.query(models.Reserva.emergencia_id).filter(
+        models.Reserva.estado == "retenida",
+        models.Reserva.expira_en < datetime.utcnow()
+    ).distinct().all()
+    emergencias = [r.emergencia_id for r in vencidas]
+    for emergencia_id in emergencias:
+        liberar(db, emergencia_id, estado_final="expirada")
+    return emergencias
@@ -0,0 +1,323 @@
+import json
+from typing import Any, Dict, List, Optional, Tuple, Type, get_args, get_origin
+
+from pydantic import BaseModel, ValidationError, field_validator
+
+# Shapes of the agents' JSON answers.
+#
+# The models double as the JSON schema sent as `response_format` when the provider supports
+# structured output, and as the validator for whatever comes back. Answers are parsed tolerantly:
+# code fences and text around the object are ignored, and a truncated or sloppy object gets one
+# bounded repair pass before it is given up on. Invalid list items are dropped one by one instead
+# of discarding the whole answer.
+
+# Longer answers are not repaired (the agents' answers are a few hundred tokens)
+REPARAR_MAX_CHARS = 64 * 1024
+
+
+class PropuestaHospital(BaseModel):
+    hospital_id: int
+    acepta: bool
+    prioridad: float = 0.0
+    motivo: str = ""
+    ocupacion_proyectada: Optional[int] = None
+
+    @field_validator("prioridad")
+    @classmethod
+    def _rango(cls, v: float) -> float:
+        return min(1.0, max(0.0, v))
+
+
+class PropuestaVehiculo(BaseModel):
+    vehiculo_id: int
+    acepta: bool
+    prioridad: float = 0.0
+    eta_min: Optional[float] = None
+    motivo: str = ""
+
+    @field_validator("prioridad")
+    @classmethod
+    def _rango(cls, v: float) -> float:
+        return min(1.0, max(0.0, v))
+
+
+class Decision(BaseModel):
+    hospital_id: Optional[int] = None
+    vehiculo_id: Optional[int] = None
+    justificacion: str = ""
+
+
+class DescripcionActividad(BaseModel):
+    agente: str
+    tipo: str = "info"
+    descripcion: str
+
+
+class RespuestaHospital(BaseModel):
+    hospital_proposals: List[PropuestaHospital] = []
+
+
+class RespuestaVehiculo(BaseModel):
+    vehicle_proposals: List[PropuestaVehiculo] = []
+
+
+class RespuestaCoordinador(BaseModel):
+    decision: Decision = Decision()
+
+
+class RespuestaAnalista(BaseModel):
+    activity_descriptions: List[DescripcionActividad] = []
+
+
+class RespuestaCoordinadorNarrada(BaseModel):
+    """LLM_NARRATIVA=fusionada: the CoordinatorAgent decides and narrates in one call."""
+    decision: Decision = Decision()
+    activity_descriptions: List[DescripcionActividad] = []
+
+
+_formatos: Dict[Tuple[Type[BaseModel], str], Dict] = {}
+
+
+def response_format(modelo: Type[BaseModel], modo: str) -> Optional[Dict]:
+    """`response_format` for chat.completions: "json_schema", "json_object" or anything else for none."""
+    if modo not in ("json_schema", "json_object"):
+        return None
+    key = (modelo, modo)
+    if key not in _formatos:
+        if modo == "json_object":
+            _formatos[key] = {"type": "json_object"}
+        else:
+            _formatos[key] = {
+                "type": "json_schema",
+                "json_schema": {"name": next(iter(modelo.model_fields)), "schema": modelo.model_json_schema()},
+            }
+    return _formatos[key]
+
+
+def _sin_fences(texto: str) -> str:
+    texto = texto.strip()
+    if "```json" in texto:
+        texto = texto.split("```json")[1].split("```")[0]
+    elif "```" in texto:
+        texto = texto.split("```")[1].split("```")[0]
+    return texto.strip()
+
+
+_LITERALES = {"True": "true", "False": "false", "None": "null"}
+
+
+def _reparar(texto: str) -> Optional[str]:
+    """One pass over the text: keeps the first JSON value, drops trailing commas, maps Python
+    literals, and if the value is cut off, truncates it at the last complete element and closes
+    the open brackets. Returns None if there is nothing to salvage."""
+    inicio = min((i for i in (texto.find("{"), texto.find("[")) if i >= 0), default=-1)
+    if inicio < 0 or len(texto) > REPARAR_MAX_CHARS:
+        return None
+
+    out: List[str] = []
+    pila: List[str] = []        # open containers
+    espera_clave: List[bool] = []
+    corte: Tuple[int, Tuple[str, ...]] = (0, ())  # last point where the value is complete
+
+    def completo():
+        nonlocal corte
+        corte = (len(out), tuple(pila))
+
+    i, n = inicio, len(texto)
+    while i < n:
+        c = texto[i]
+        if c in "{[":
+            pila.append(c)
+            espera_clave.append(c == "{")
+            out.append(c)
+            completo()
+            i += 1
+        elif c in "}]":
+            if not pila:
+                break
+            while out and out[-1].isspace():
+                out.pop()
+            if out and out[-1] == ",":
+                out.pop()
+            pila.pop()
+            espera_clave.pop()
+            out.append("}" if c == "}" else "]")
+            i += 1
+            if not pila:
+                return "".join(out)
+            completo()
+        elif c == '"':
+            j = i + 1
+            while j < n and texto[j] != '"':
+                j += 2 if texto[j] == "\\" else 1
+            if j >= n:
+                break  # unterminated string
+            out.append(texto[i:j + 1])
+            i = j + 1
+            if pila and pila[-1] == "{" and espera_clave[-1]:
+                espera_clave[-1] = False
+            else:
+                completo()
+        elif c == ",":
+            if pila and pila[-1] == "{":
+                espera_clave[-1] = True
+            out.append(c)
+            i += 1
+        elif c == ":" or c.isspace():
+            out.append(c)
+            i += 1
+        else:
+            j = i
+            while j < n and (texto[j].isalnum() or texto[j] in "+-."):
+                j += 1
+            if j == i or j >= n:
+                break  # stray character or a literal cut off at the end
+            literal = texto[i:j]
+            out.append(_LITERALES.get(literal, literal))
+            i = j
+            completo()
+
+    largo, abiertos = corte
+    if not abiertos:
+        return None
+    cierre = "".join("}" if c == "{" else "]" for c in reversed(abiertos))
+    cuerpo = "".join(out[:largo]).rstrip()
+    if cuerpo.endswith(","):
+        cuerpo = cuerpo[:-1]
+    return cuerpo + cierre
+
+
+def extraer_json(texto: str) -> Tuple[Any, bool]:
+    """Parses an agent answer. Returns (value, reparado); raises ValueError if even the repair
+    pass yields nothing parseable."""
+    texto = _sin_fences(texto or "")
+    try:
+        return json.loads(texto), False
+    except ValueError:
+        pass
+    # Text before/after the object: decode from the first bracket and ignore the rest
+    inicio = min((i for i in (texto.find("{"), texto.find("[")) if i >= 0), default=-1)
+    if inicio >= 0:
+        try:
+            return json.JSONDecoder().raw_decode(texto, inicio)[0], True
+        except ValueError:
+            pass
+    reparado = _reparar(texto)
+    if reparado is None:
+        raise ValueError("respuesta sin JSON recuperable")
+    return json.loads(reparado), True
+
+
+class ParserIncremental:
+    """Streaming counterpart of extraer_json: fed the answer chunk by chunk, reports every scalar
+    value as soon as it is complete, keyed by its path (("decision", "hospital_id"),
+    ("activity_descriptions", 0, "descripcion"), ...). Text before the first "{" (code fences) and
+    after the top-level object is ignored."""
+
+    def __init__(self):
+        self.pila: List[List] = []   # [container, clave actual / índice, espera_clave]
+        self.cadena: Optional[List[str]] = None
+        self.escape = False
+        self.literal: List[str] = []
+        self.terminado = False
+
+    def _ruta(self) -> Tuple:
+        return tuple(nivel[1] for nivel in self.pila)
+
+    def _valor(self, valor: Any, eventos: List):
+        if self.pila:
+            eventos.append((self._ruta(), valor))
+
+    def _cerrar_literal(self, eventos: List):
+        literal = "".join(self.literal)
+        self.literal = []
+        try:
+            self._valor(json.loads(_LITERALES.get(literal, literal)), eventos)
+        except ValueError:
+            pass
+
+    def alimentar(self, texto: str) -> List[Tuple[Tuple, Any]]:
+        eventos: List[Tuple[Tuple, Any]] = []
+        for c in texto:
+            if self.terminado:
+                break
+            if self.cadena is not None:
+                if self.escape:
+                    self.escape = False
+                elif c == "\\":
+                    self.escape = True
+                elif c == '"':
+                    crudo = "".join(self.cadena)
+                    self.cadena = None
+                    try:
+                        valor = json.loads('"' + crudo + '"')
+                    except ValueError:
+                        valor = crudo
+                    nivel = self.pila[-1] if self.pila else None
+                    if nivel and nivel[0] == "{" and nivel[2]:
+                        nivel[1], nivel[2] = valor, False
+                    else:
+                        self._valor(valor, eventos)
+                    continue
+                self.cadena.append(c)
+                continue
+            if self.literal and (c in ",}]" or c.isspace()):
+                self._cerrar_literal(eventos)
+            if not self.pila and c != "{":
+                continue
+            if c == '"':
+                self.cadena = []
+            elif c in "{[":
+                self.pila.append([c, None if c == "{" else 0, c == "{"])
+            elif c in "}]":
+                self.pila.pop()
+                self.terminado = not self.pila
+            elif c == ",":
+                nivel = self.pila[-1]
+                if nivel[0] == "[":
+                    nivel[1] += 1
+                else:
+                    nivel[2] = True
+            elif not (c == ":" or c.isspace()):
+                self.literal.append(c)
+        return eventos
+
+
+def _validar_campo(campo, valor: Any) -> Tuple[Any, int]:
+    if get_origin(campo.annotation) is list:
+        tipo_item = get_args(campo.annotation)[0]
+        if isinstance(valor, dict):
+            valor = [valor]  # a single item without the list around it
+        validos, descartados = [], 0
+        for item in valor if isinstance(valor, list) else []:
+            try:
+                validos.append(tipo_item.model_validate(item).model_dump())
+            except ValidationError:
+                descartados += 1
+        return validos, descartados
+    if valor is None:
+        return {}, 0
+    try:
+        return campo.annotation.model_validate(valor).model_dump(), 0
+    except ValidationError:
+        return {}, 1
+
+
+def validar(modelo: Type[BaseModel], data: Any) -> Tuple[Dict, int]:
+    """Validates `data` against a Respuesta* model. List items are checked one by one and the
+    invalid ones dropped; returns (plain dict, items descartados)."""
+    campos = modelo.model_fields
+    if len(campos) == 1:
+        clave, campo = next(iter(campos.items()))
+        if not isinstance(data, dict):
+            data = {clave: data}
+        elif clave not in data and get_origin(campo.annotation) is not list \
+                and data.keys() & campo.annotation.model_fields.keys():
+            data = {clave: data}  # the object without its wrapper
+    if not isinstance(data, dict):
+        data = {}
+    resultado, descartados = {}, 0
+    for clave, campo in campos.items():
+        resultado[clave], n = _validar_campo(campo, data.get(clave))
+        descartados += n
+    return resultado, descartados
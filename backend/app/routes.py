@@ -1,10 +1,13 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import Response, StreamingResponse
+from openai import AsyncOpenAI
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
+import asyncio
 import datetime
 import json
 
-from . import models, schemas, database, agents
+from . import models, schemas, database, worker, dispatch, geo, agents, llm_cache, ratelimit, llm_client, pubsub, estado, enrutador, ciclo, consultas, capacidad
 
 router = APIRouter()
 
@@ -15,108 +18,248 @@ def get_db():
     finally:
         db.close()
 
-import time
+def get_llm_client(request: Request) -> AsyncOpenAI:
+    # Application-scoped client created on startup (main.py)
+    return request.app.state.llm_client
 
-@router.post("/emergencias", response_model=schemas.Emergencia)
-def crear_emergencia(emergencia: schemas.EmergenciaCreate, db: Session = Depends(get_db)):
+def get_agent_system(client: AsyncOpenAI = Depends(get_llm_client)) -> agents.AgentSystem:
+    return agents.AgentSystem(client)
+
+@router.post("/emergencias", response_model=schemas.Emergencia, status_code=202)
+def crear_emergencia(emergencia: schemas.EmergenciaCreate):
     print(f"\n[SAR] --- NUEVA EMERGENCIA: {emergencia.tipo} ---", flush=True)
-    # 1. Create Emergency
-    db_emergencia = models.Emergencia(**emergencia.dict())
-    db.add(db_emergencia)
-    db.commit()
-    db.refresh(db_emergencia)
-
-    # Initial Activity
-    act_init = models.Actividad(
-        agente="SensorEmergencias",
-        tipo="emergencia_creada",
-        descripcion=f"Nueva emergencia reportada: {emergencia.tipo} en zona {emergencia.zona_id}"
-    )
-    db.add(act_init)
-    db.commit()
-
-    # 2. Agent Orchestration
-    agent_sys = agents.AgentSystem(db)
-    
-    # Get candidates
-    hospitales = db.query(models.Hospital).all()
-    vehiculos = db.query(models.VehiculoRescate).filter(models.VehiculoRescate.estado == "disponible").all()
-
-    print(f"\n{'='*10} AGENT: HOSPITAL {'='*10}", flush=True)
-    print(f"[SAR] Ejecutando HospitalAgent con {len(hospitales)} candidatos...", flush=True)
-    # A. Hospital Agent
-    hosp_proposals = agent_sys.run_hospital_agent(db_emergencia, hospitales)
-    print(f"[SAR] HospitalAgent propuso: {len(hosp_proposals)} opciones.", flush=True)
-    
-    time.sleep(2) # Rate limit spacing
-
-    print(f"\n{'='*10} AGENT: VEHICLE {'='*10}", flush=True)
-    print(f"[SAR] Ejecutando VehicleAgent con {len(vehiculos)} candidatos...", flush=True)
-    # B. Vehicle Agent
-    veh_proposals = agent_sys.run_vehicle_agent(db_emergencia, vehiculos)
-    print(f"[SAR] VehicleAgent propuso: {len(veh_proposals)} opciones.", flush=True)
-
-    time.sleep(2) # Rate limit spacing
-
-    print(f"\n{'='*10} AGENT: COORDINATOR {'='*10}", flush=True)
-    print(f"[SAR] Ejecutando CoordinatorAgent...", flush=True)
-    # C. Coordinator Agent
-    decision = agent_sys.run_coordinator_agent(db_emergencia, hosp_proposals, veh_proposals)
-    print(f"[SAR] Decision Final: {json.dumps(decision)}", flush=True)
-
-    time.sleep(2) # Rate limit spacing
-
-    # Apply Decision
-    h_id = decision.get("hospital_id")
-    v_id = decision.get("vehiculo_id")
-    justificacion = decision.get("justificacion", "Sin justificación")
-
-    if h_id:
-        db_emergencia.hospital_asignado_id = h_id
-    if v_id:
-        db_emergencia.vehiculo_asignado_id = v_id
-        # Update vehicle status
-        veh = db.query(models.VehiculoRescate).filter(models.VehiculoRescate.id == v_id).first()
-        if veh:
-            veh.estado = "en_camino"
-    
-    if h_id or v_id:
-        db_emergencia.estado = "asignada"
-    
-    db.commit()
-    db.refresh(db_emergencia)
-
-    print(f"\n{'='*10} AGENT: ANALYST {'='*10}", flush=True)
-    print(f"[SAR] Generando analisis (AnalystAgent)...", flush=True)
-    # D. Analyst Agent
-    activities = agent_sys.run_analyst_agent(db_emergencia, decision, hosp_proposals, veh_proposals)
-    
-    # Save activities
-    for act in activities:
-        print(f"[SAR] Actividad registrada: {act.get('agente')} - {act.get('descripcion')[:50]}...", flush=True)
-        db_act = models.Actividad(
-            agente=act.get("agente", "System"),
-            tipo=act.get("tipo", "info"),
-            descripcion=act.get("descripcion", "")
-        )
-        db.add(db_act)
-    
-    db.commit()
-    print(f"[SAR] --- PROCESO COMPLETADO ---\n")
-    
+    # Emergency, initial activity and dispatch job are written in one transaction
+    with database.unidad_de_trabajo() as db:
+        # 1. Create Emergency, queued for the agent pipeline
+        db_emergencia = models.Emergencia(**emergencia.dict(), estado="en_cola")
+        # 2. Dispatch job (the table is the durable queue, see worker.py)
+        job = models.DispatchJob(emergencia=db_emergencia)
+        db.add_all([
+            db_emergencia,
+            models.Actividad(
+                agente="SensorEmergencias",
+                tipo="emergencia_creada",
+                descripcion=f"Nueva emergencia reportada: {emergencia.tipo} en zona {emergencia.zona_id}"
+            ),
+            job,
+        ])
+
+    worker.dispatcher.enqueue(job.id)
+    print(f"[SAR] Emergencia #{db_emergencia.id} encolada (job {job.id}).", flush=True)
+
+    return db_emergencia
+
+@router.post("/emergencias/batch", response_model=List[schemas.Emergencia])
+def crear_emergencias_lote(emergencias: List[schemas.EmergenciaCreate]):
+    """Mass-casualty intake: N emergencies inserted and assigned jointly in one transaction."""
+    if not emergencias:
+        raise HTTPException(status_code=400, detail="El lote está vacío")
+    if len(emergencias) > dispatch.LOTE_MAX:
+        raise HTTPException(status_code=413, detail=f"El lote supera el máximo de {dispatch.LOTE_MAX} emergencias")
+    print(f"\n[SAR] --- LOTE DE {len(emergencias)} EMERGENCIAS ---", flush=True)
+
+    with database.unidad_de_trabajo() as db:
+        db_emergencias = [models.Emergencia(**e.dict(), estado="analizando") for e in emergencias]
+        db.add_all(db_emergencias)
+        db.add(models.Actividad(
+            agente="SensorEmergencias",
+            tipo="emergencia_creada",
+            descripcion=f"Lote de {len(emergencias)} emergencias reportadas en zonas {sorted({e.zona_id for e in emergencias})}"
+        ))
+        db.flush()  # one multi-row INSERT for the whole batch
+
+        dispatch.despachar_lote(db, db_emergencias)
+
+        # Assigned emergencies only need a job for the optional LLM layer (explanations / override);
+        # the ones that lost a resource to a concurrent dispatch go through the normal queue
+        llm = dispatch.capa_llm_activa()
+        jobs = [models.DispatchJob(emergencia_id=e.id) for e in db_emergencias
+                if e.estado == "en_cola" or (llm and (e.vehiculo_asignado_id or e.hospital_asignado_id))]
+        db.add_all(jobs)
+
+    for job in jobs:
+        worker.dispatcher.enqueue(job.id)
+    return db_emergencias
+
+def _pagina(db: Session, modelo, filtros: List, campos: Optional[str], limite: Optional[int], cursor: Optional[str],
+            fecha: Optional[str] = None, excluidas: tuple = ()):
+    try:
+        return consultas.paginar(db, modelo, filtros, campos, limite, cursor, fecha, excluidas)
+    except consultas.ConsultaInvalida as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/emergencias")
+def listar_emergencias(estado: Optional[str] = None, zona_id: Optional[int] = None, tipo: Optional[str] = None,
+                       desde: Optional[datetime.datetime] = None, hasta: Optional[datetime.datetime] = None,
+                       archivo: bool = False, campos: Optional[str] = None, limite: Optional[int] = None,
+                       cursor: Optional[str] = None, db: Session = Depends(get_db)):
+    """Emergencies newest first, one keyset page at a time (pass back `siguiente` as ?cursor=).
+
+    Filters: estado and tipo (comma-separated), zona_id, created_at in [desde, hasta). ?archivo=true
+    searches the archived (resolved) ones; ?campos=id,estado,... returns only those columns.
+    """
+    modelo = models.EmergenciaArchivada if archivo else models.Emergencia
+    filtros = []
+    if estado:
+        filtros.append(modelo.estado.in_(consultas.lista(estado)))
+    if zona_id is not None:
+        filtros.append(modelo.zona_id == zona_id)
+    if tipo:
+        filtros.append(modelo.tipo.in_(consultas.lista(tipo)))
+    if desde:
+        filtros.append(modelo.created_at >= desde)
+    if hasta:
+        filtros.append(modelo.created_at < hasta)
+    return _pagina(db, modelo, filtros, campos, limite, cursor, "created_at", excluidas=("traza",))
+
+@router.get("/actividades")
+def listar_actividades(tipo: Optional[str] = None, agente: Optional[str] = None,
+                       desde: Optional[datetime.datetime] = None, hasta: Optional[datetime.datetime] = None,
+                       campos: Optional[str] = None, limite: Optional[int] = None, cursor: Optional[str] = None,
+                       db: Session = Depends(get_db)):
+    """Activity log newest first, beyond the last entries carried by /api/estado. Filters: tipo and
+    agente (comma-separated), timestamp in [desde, hasta)."""
+    filtros = []
+    if tipo:
+        filtros.append(models.Actividad.tipo.in_(consultas.lista(tipo)))
+    if agente:
+        filtros.append(models.Actividad.agente.in_(consultas.lista(agente)))
+    if desde:
+        filtros.append(models.Actividad.timestamp >= desde)
+    if hasta:
+        filtros.append(models.Actividad.timestamp < hasta)
+    return _pagina(db, models.Actividad, filtros, campos, limite, cursor, "timestamp")
+
+@router.get("/hospitales")
+def listar_hospitales(zona_id: Optional[int] = None, campos: Optional[str] = None, limite: Optional[int] = None,
+                      cursor: Optional[str] = None, db: Session = Depends(get_db)):
+    """Hospitals in id order (keyset pages), optionally of one zone."""
+    filtros = [models.Hospital.zona_id == zona_id] if zona_id is not None else []
+    return _pagina(db, models.Hospital, filtros, campos, limite, cursor)
+
+@router.get("/hospitales/capacidad", response_model=List[schemas.HospitalCapacidad])
+def capacidad_hospitales(zona_id: Optional[int] = None, especialidad: Optional[str] = None, con_camas: bool = False):
+    """Free beds, capabilities and available doctors per specialty, from the in-memory view.
+
+    `especialidad` (comma-separated) keeps hospitals with an available doctor of each one;
+    `con_camas` only those with a free bed.
+    """
+    esps = consultas.lista(especialidad)
+    return [
+        h for h in capacidad.vista.filas()
+        if (zona_id is None or h["zona_id"] == zona_id)
+        and all(h["especialidades"].get(e) for e in esps)
+        and (not con_camas or h["libres"] > 0)
+    ]
+
+@router.get("/vehiculos")
+def listar_vehiculos(estado: Optional[str] = None, zona_id: Optional[int] = None, tipo: Optional[str] = None,
+                     campos: Optional[str] = None, limite: Optional[int] = None, cursor: Optional[str] = None,
+                     db: Session = Depends(get_db)):
+    """Vehicles in id order (keyset pages). Filters: estado and tipo (comma-separated), zona_id."""
+    filtros = []
+    if estado:
+        filtros.append(models.VehiculoRescate.estado.in_(consultas.lista(estado)))
+    if zona_id is not None:
+        filtros.append(models.VehiculoRescate.zona_id == zona_id)
+    if tipo:
+        filtros.append(models.VehiculoRescate.tipo.in_(consultas.lista(tipo)))
+    return _pagina(db, models.VehiculoRescate, filtros, campos, limite, cursor)
+
+def _buscar_emergencia(db: Session, emergencia_id: int):
+    # Resolved emergencies may already have been moved to the archive (ciclo.archivar)
+    db_emergencia = db.query(models.Emergencia).filter(models.Emergencia.id == emergencia_id).first() \
+        or db.query(models.EmergenciaArchivada).filter(models.EmergenciaArchivada.id == emergencia_id).first()
+    if not db_emergencia:
+        raise HTTPException(status_code=404, detail="Emergencia no encontrada")
+    return db_emergencia
+
+@router.get("/emergencias/{emergencia_id}", response_model=schemas.Emergencia)
+def get_emergencia(emergencia_id: int, db: Session = Depends(get_db)):
+    return _buscar_emergencia(db, emergencia_id)
+
+@router.post("/emergencias/{emergencia_id}/transicion", response_model=schemas.Emergencia)
+def transicionar_emergencia(emergencia_id: int, transicion: schemas.EmergenciaTransicion):
+    """Operator-driven phase change (en_escena, trasladando, resuelta); resolving frees the vehicle,
+    and the bed too unless the patient already reached the hospital. Resolving one still queued or
+    being analyzed cancels its dispatch."""
+    with database.unidad_de_trabajo() as db:
+        db_emergencia = db.query(models.Emergencia).filter(models.Emergencia.id == emergencia_id).first()
+        if not db_emergencia:
+            raise HTTPException(status_code=404, detail="Emergencia no encontrada")
+        try:
+            ciclo.transicionar(db, db_emergencia, transicion.estado)
+        except ciclo.TransicionInvalida as e:
+            raise HTTPException(status_code=409, detail=str(e))
     return db_emergencia
 
+@router.get("/emergencias/{emergencia_id}/traza")
+def get_traza_emergencia(emergencia_id: int, db: Session = Depends(get_db)):
+    """Timed spans (DB phases, scoring, agents, LLM calls, JSON parsing) of the last dispatch run."""
+    db_emergencia = _buscar_emergencia(db, emergencia_id)
+    spans = json.loads(db_emergencia.traza) if db_emergencia.traza else []
+    # Spans nest (agente > llm > json_parse) and overlap (agents run concurrently): report wall time
+    total_ms = max((s["inicio_ms"] + s["duracion_ms"] for s in spans), default=0)
+    return {"emergencia_id": emergencia_id, "total_ms": round(total_ms, 2), "spans": spans}
+
 @router.get("/estado", response_model=schemas.SystemState)
-def get_estado(db: Session = Depends(get_db)):
-    emergencias = db.query(models.Emergencia).filter(models.Emergencia.estado != "resuelta").all()
-    hospitales = db.query(models.Hospital).all()
-    vehiculos = db.query(models.VehiculoRescate).all()
-    # Limit activities to last 30
-    actividades = db.query(models.Actividad).order_by(models.Actividad.timestamp.desc()).limit(30).all()
-    
+def get_estado(request: Request, since: Optional[int] = None, db: Session = Depends(get_db)):
+    """Full snapshot, or with ?since=<version> only the rows changed after that version.
+
+    Both are served from estado.cache; If-None-Match with the current ETag answers 304.
+    """
+    etag = estado.cache.etag(estado.cache.version)
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+
+    if since is not None:
+        cuerpo = estado.cache.delta(since)
+        if cuerpo is not None:
+            return Response(cuerpo, media_type="application/json", headers={"ETag": etag})
+
+    cuerpo, version = estado.cache.snapshot(db)
+    return Response(cuerpo, media_type="application/json", headers={"ETag": estado.cache.etag(version)})
+
+@router.get("/ocupacion", response_model=List[schemas.OcupacionMuestra])
+def get_ocupacion(horas: float = 24, db: Session = Depends(get_db)):
+    """Fleet and bed occupancy over time, oldest first (one sample every CICLO_MUESTREO_S)."""
+    desde = datetime.datetime.utcnow() - datetime.timedelta(hours=horas)
+    return db.query(models.OcupacionMuestra).filter(models.OcupacionMuestra.timestamp >= desde) \
+        .order_by(models.OcupacionMuestra.timestamp).all()
+
+@router.get("/vehiculos/cercanos", response_model=List[schemas.VehiculoCercano])
+def get_vehiculos_cercanos(lat: float, lon: float, k: int = 5):
+    # Served from the in-memory spatial index, no DB round-trip
+    return geo.indice.vehiculos_cercanos(lat, lon, k)
+
+@router.get("/llm/stats")
+def get_llm_stats(agent_sys: agents.AgentSystem = Depends(get_agent_system)):
     return {
-        "emergencias": emergencias,
-        "hospitales": hospitales,
-        "vehiculos": vehiculos,
-        "actividades": actividades
+        "modelo": agent_sys.model,
+        "enrutador": enrutador.enrutador.resumen(),
+        "cliente": llm_client.configuracion(),
+        "tokens": agents.uso_tokens,
+        "cache": llm_cache.cache.resumen(),
+        "limites": ratelimit.llm_gate.resumen()
     }
+
+@router.get("/stream")
+async def stream(request: Request):
+    """Server-Sent Events: emergency/vehicle/hospital changes, new activities and agent progress."""
+    cola = pubsub.broker.suscribir()
+
+    async def eventos():
+        try:
+            yield "retry: 3000\n\n"
+            while not await request.is_disconnected():
+                try:
+                    evento = await asyncio.wait_for(cola.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield pubsub.formato_sse(evento)
+        finally:
+            pubsub.broker.desuscribir(cola)
+
+    return StreamingResponse(eventos(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Dict, List, Optional
 from datetime import datetime
 
 # Base Schemas
@@ -39,10 +39,14 @@ class HospitalBase(BaseModel):
 class Hospital(HospitalBase):
     id: int
     zona_id: int
-    doctores: List[Doctor] = []
     class Config:
         from_attributes = True
 
+class HospitalCapacidad(Hospital):
+    libres: int
+    capacidades: int  # bitmask, see scoring.CAP_*
+    especialidades: Dict[str, int] = {}  # available doctors per especialidad
+
 class VehiculoBase(BaseModel):
     nombre: str
     tipo: str
@@ -56,6 +60,12 @@ class Vehiculo(VehiculoBase):
     class Config:
         from_attributes = True
 
+class VehiculoCercano(BaseModel):
+    id: int
+    tipo: str
+    distancia_km: float
+    eta_min: float
+
 class EmergenciaBase(BaseModel):
     tipo: str
     descripcion: str
@@ -71,11 +81,25 @@ class Emergencia(EmergenciaBase):
     estado: str
     vehiculo_asignado_id: Optional[int] = None
     hospital_asignado_id: Optional[int] = None
+    fase_hasta: Optional[datetime] = None
     created_at: datetime
     updated_at: datetime
     class Config:
         from_attributes = True
 
+class EmergenciaTransicion(BaseModel):
+    estado: str  # en_escena, trasladando, resuelta
+
+class OcupacionMuestra(BaseModel):
+    timestamp: datetime
+    vehiculos_disponibles: int
+    vehiculos_en_servicio: int
+    camas_ocupadas: int
+    camas_totales: int
+    emergencias_abiertas: int
+    class Config:
+        from_attributes = True
+
 class ActividadBase(BaseModel):
     agente: str
     tipo: str
@@ -88,8 +112,9 @@ class Actividad(ActividadBase):
         from_attributes = True
 
 class SystemState(BaseModel):
+    version: int = 0  # pass back as /api/estado?since= to get only later changes
     emergencias: List[Emergencia]
-    hospitales: List[Hospital]
+    hospitales: List[HospitalCapacidad]
     vehiculos: List[Vehiculo]
     actividades: List[Actividad]
 
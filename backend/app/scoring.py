@@ -0,0 +1,178 @@
+import unicodedata
+from typing import List, Dict, Optional
+
+from . import models, geo
+
+# Hospital capability flags as a bitmask
+CAP_SUERO = 1 << 0
+CAP_TRAUMA = 1 << 1
+CAP_CARDIO = 1 << 2
+CAP_PEDIATRIA = 1 << 3
+CAP_QUEMADOS = 1 << 4
+
+# (keywords in tipo/descripcion, required capabilities, required specialties, severity 0-1)
+PERFILES = [
+    (("alacran", "escorpion", "picadura"), CAP_SUERO, ("toxicologo",), 0.7),
+    (("cardi", "infarto", "paro"), CAP_CARDIO, ("cardiologo",), 1.0),
+    (("incendio", "quemad", "fuego"), CAP_QUEMADOS, (), 0.8),
+    (("accidente", "transito", "colision", "trauma", "caida", "herid"), CAP_TRAUMA, ("traumatologo",), 0.9),
+    (("nino", "nina", "pediatr", "bebe", "menor"), CAP_PEDIATRIA, ("pediatra",), 0.0),
+]
+
+# Suitability of each vehicle type for (grave, no grave) emergencies
+APTITUD_VEHICULO = {
+    "ambulancia": (0.7, 1.0),
+    "ambulancia_uti": (1.0, 0.8),
+    "helicoptero": (0.8, 0.5),
+}
+UMBRAL_GRAVE = 0.9
+
+
+def _normalizar(texto: Optional[str]) -> str:
+    texto = unicodedata.normalize("NFKD", texto or "")
+    return "".join(c for c in texto if not unicodedata.combining(c)).lower()
+
+
+def perfil_emergencia(tipo: str, descripcion: Optional[str]) -> Dict:
+    texto = _normalizar(f"{tipo} {descripcion or ''}")
+    capacidades, especialidades, gravedad = 0, set(), 0.5
+    for claves, cap, esps, grav in PERFILES:
+        if any(k in texto for k in claves):
+            capacidades |= cap
+            especialidades.update(esps)
+            gravedad = max(gravedad, grav)
+    return {"capacidades": capacidades, "especialidades": especialidades, "gravedad": gravedad}
+
+
+def capacidades_hospital(h) -> int:
+    """Capability bitmask of a Hospital row or of its column snapshot (changes.snapshot)."""
+    flag = h.get if isinstance(h, dict) else lambda attr: getattr(h, attr)
+    return (
+        (CAP_SUERO if flag("tiene_suero_antiescorpionico") else 0)
+        | (CAP_TRAUMA if flag("tiene_unidad_trauma") else 0)
+        | (CAP_CARDIO if flag("tiene_cardiologia") else 0)
+        | (CAP_PEDIATRIA if flag("tiene_pediatria") else 0)
+        | (CAP_QUEMADOS if flag("tiene_unidad_quemados") else 0)
+    )
+
+
+def hospital_candidato(h: Dict) -> Dict:
+    """Scoring view of a capacity row (capacidad.vista)."""
+    return {
+        "id": h["id"],
+        "nombre": h["nombre"],
+        "zona_id": h["zona_id"],
+        "latitud": h["latitud"],
+        "longitud": h["longitud"],
+        "capacidad": h["capacidad_total"] or 0,
+        "libres": h["libres"],
+        "capacidades": h["capacidades"],
+        "especialidades": set(h["especialidades"]),
+    }
+
+
+def vehiculo_candidato(v: models.VehiculoRescate) -> Dict:
+    return {
+        "id": v.id,
+        "nombre": v.nombre,
+        "tipo": v.tipo,
+        "zona_id": v.zona_id,
+        "latitud": v.latitud,
+        "longitud": v.longitud,
+    }
+
+
+def emergencia_candidato(e: models.Emergencia, zona: Optional[models.Zona]) -> Dict:
+    # Reports without coordinates are placed at their zone centroid
+    lat = e.latitud if e.latitud is not None else (zona.latitud if zona else None)
+    lon = e.longitud if e.longitud is not None else (zona.longitud if zona else None)
+    return {
+        "tipo": e.tipo,
+        "descripcion": e.descripcion,
+        "zona_id": e.zona_id,
+        "latitud": lat,
+        "longitud": lon,
+        "perfil": perfil_emergencia(e.tipo, e.descripcion),
+    }
+
+
+def _distancia(emergencia: Dict, cand: Dict) -> float:
+    if emergencia["latitud"] is None or cand["latitud"] is None:
+        # No coordinates: same zone counts as close, anything else as far
+        return 2.0 if cand["zona_id"] == emergencia["zona_id"] else 15.0
+    return geo.haversine_km(emergencia["latitud"], emergencia["longitud"], cand["latitud"], cand["longitud"])
+
+
+def rankear_hospitales(emergencia: Dict, hospitales: List[Dict]) -> List[Dict]:
+    """Scores hospitals in a single pass and returns proposals (HospitalAgent shape), best first."""
+    perfil = emergencia["perfil"]
+    req_caps = perfil["capacidades"]
+    n_caps = bin(req_caps).count("1")
+    req_esps = perfil["especialidades"]
+
+    proposals = []
+    for h in hospitales:
+        libres = h["libres"]
+        cubre_caps = bin(h["capacidades"] & req_caps).count("1")
+        cubre_esps = len(req_esps & h["especialidades"])
+        distancia = _distancia(emergencia, h)
+        score = (
+            0.45 * (cubre_caps / n_caps if n_caps else 1.0)
+            + 0.20 * (cubre_esps / len(req_esps) if req_esps else 1.0)
+            + 0.15 * (libres / h["capacidad"] if h["capacidad"] else 0.0)
+            + 0.20 / (1 + distancia / 5)
+        )
+        acepta = libres > 0
+        faltantes = n_caps - cubre_caps
+        proposals.append({
+            "hospital_id": h["id"],
+            "acepta": acepta,
+            "prioridad": round(score if acepta else 0.0, 3),
+            "motivo": (
+                f"{h['nombre']}: {max(libres, 0)} camas libres, {distancia:.1f} km"
+                + (f", le faltan {faltantes} recursos requeridos" if faltantes else ", cubre los recursos requeridos")
+            ),
+            "ocupacion_proyectada": h["capacidad"] - libres + 1,
+        })
+    proposals.sort(key=lambda p: p["prioridad"], reverse=True)
+    return proposals
+
+
+def rankear_vehiculos(emergencia: Dict, vehiculos: List[Dict]) -> List[Dict]:
+    """Scores available vehicles by type suitability and computed ETA (VehicleAgent shape), best first."""
+    grave = emergencia["perfil"]["gravedad"] >= UMBRAL_GRAVE
+    proposals = []
+    for v in vehiculos:
+        eta = geo.eta_min(v["tipo"], _distancia(emergencia, v))
+        aptitud = APTITUD_VEHICULO.get(v["tipo"], (0.5, 0.5))[0 if grave else 1]
+        score = 0.35 * aptitud + 0.65 / (1 + eta / 10)
+        proposals.append({
+            "vehiculo_id": v["id"],
+            "acepta": True,
+            "prioridad": round(score, 3),
+            "eta_min": round(eta, 1),
+            "motivo": f"{v['nombre']} ({v['tipo']}), ETA {eta:.0f} min",
+        })
+    proposals.sort(key=lambda p: p["prioridad"], reverse=True)
+    return proposals
+
+
+def top_k(proposals: List[Dict], k: int, campo: str) -> List[int]:
+    """Ids of the k best accepted proposals: the pre-filter applied before prompting the agents."""
+    return [p[campo] for p in proposals if p["acepta"]][:k]
+
+
+def decidir(emergencia: Dict, hosp_proposals: List[Dict], veh_proposals: List[Dict]) -> Dict:
+    """Deterministic CoordinatorAgent: best accepted hospital + best vehicle."""
+    hosp = next((p for p in hosp_proposals if p["acepta"]), None)
+    veh = next((p for p in veh_proposals if p["acepta"]), None)
+    partes = []
+    if hosp:
+        partes.append(f"Hospital: {hosp['motivo']} (score {hosp['prioridad']})")
+    if veh:
+        partes.append(f"Vehículo: {veh['motivo']} (score {veh['prioridad']})")
+    return {
+        "hospital_id": hosp["hospital_id"] if hosp else None,
+        "vehiculo_id": veh["vehiculo_id"] if veh else None,
+        "justificacion": ". ".join(partes) if partes else "Sin recursos disponibles para asignar.",
+    }
@@ -1,13 +1,145 @@
+import os
+import math
 import random
+import argparse
+from typing import Dict, List, Optional
+
+from sqlalchemy import insert, func
 from sqlalchemy.orm import Session
 from . import models
 from .database import SessionLocal, engine
+from .geo import KM_POR_GRADO
+
+# demo: the fixed 4-zone city below. sintetica: generar_ciudad with the SEED_* sizes (benchmarks,
+# load tests, capacity planning); also `python -m app.seed --zonas 400 --hospitales 2000 ...`
+SEED_CIUDAD = os.getenv("SEED_CIUDAD", "demo")
+SEED_ZONAS = int(os.getenv("SEED_ZONAS", "100"))
+SEED_HOSPITALES = int(os.getenv("SEED_HOSPITALES", "500"))
+SEED_VEHICULOS = int(os.getenv("SEED_VEHICULOS", "1500"))
+SEED_RADIO_KM = float(os.getenv("SEED_RADIO_KM", "25"))
+# Same seed and sizes, same city
+SEED_SEMILLA = int(os.getenv("SEED_SEMILLA", "42"))
+
+# San Miguel de Tucumán
+CENTRO = (-26.83, -65.20)
+TIPOS_VEHICULO = [("ambulancia", 0.6), ("ambulancia_uti", 0.3), ("helicoptero", 0.1)]
+ESPECIALIDADES = ["pediatra", "cardiologo", "traumatologo", "toxicologo", "medicina_interna"]
+APELLIDOS = ["Perez", "Gomez", "Diaz", "Lopez", "Martinez", "Fernandez", "Romero", "Sosa", "Ruiz", "Alvarez"]
+# Hospital capability -> the specialist it mostly staffs
+ESPECIALISTA = {
+    "tiene_pediatria": "pediatra",
+    "tiene_cardiologia": "cardiologo",
+    "tiene_unidad_trauma": "traumatologo",
+    "tiene_suero_antiescorpionico": "toxicologo",
+}
+# Rows per multi-row INSERT
+LOTE_INSERT = 5000
+
+
+def _insertar(db: Session, modelo, filas: List[Dict]):
+    """Multi-row INSERTs that leave the ids to the database, so SERIAL/IDENTITY sequences (PostgreSQL)
+    stay in step with the rows; the assigned ids are written back into `filas`."""
+    for i in range(0, len(filas), LOTE_INSERT):
+        lote = filas[i:i + LOTE_INSERT]
+        ids = db.execute(insert(modelo).returning(modelo.id, sort_by_parameter_order=True), lote).scalars().all()
+        for fila, id_ in zip(lote, ids):
+            fila["id"] = id_
+
+
+def _siguiente_numero(db: Session, modelo) -> int:
+    # Only numbers the names (Zona-N, Hospital-N, ...) on from the rows already there
+    return (db.query(func.max(modelo.id)).scalar() or 0) + 1
+
+
+def generar_ciudad(db: Session, zonas: int = SEED_ZONAS, hospitales: int = SEED_HOSPITALES, vehiculos: int = SEED_VEHICULOS,
+                   radio_km: float = SEED_RADIO_KM, semilla: int = SEED_SEMILLA, centro=CENTRO) -> Dict:
+    """Synthetic city written with multi-row INSERTs and deterministic for a given `semilla`.
+
+    Zone centroids fill a disc of `radio_km` evenly (sunflower layout) and each zone gets a
+    population weight; hospitals and vehicles go to zones by weight and scatter around the
+    centroid (normal, about half the zone spacing). Bigger hospitals have more services, and
+    their doctors follow those services.
+    """
+    rnd = random.Random(semilla)
+    km_lat = KM_POR_GRADO
+    km_lon = KM_POR_GRADO * math.cos(math.radians(centro[0]))
+    separacion_km = radio_km * math.sqrt(math.pi / max(zonas, 1))
+
+    def alrededor(lat: float, lon: float, sigma_km: float):
+        return lat + rnd.gauss(0, sigma_km) / km_lat, lon + rnd.gauss(0, sigma_km) / km_lon
+
+    zona_0 = _siguiente_numero(db, models.Zona)
+    filas_zonas, pesos = [], []
+    angulo = math.pi * (3 - math.sqrt(5))
+    for n in range(zonas):
+        r = radio_km * math.sqrt((n + 0.5) / zonas)
+        lat, lon = alrededor(centro[0] + r * math.sin(n * angulo) / km_lat, centro[1] + r * math.cos(n * angulo) / km_lon,
+                             separacion_km / 6)
+        filas_zonas.append({"nombre": f"Zona-{zona_0 + n}", "latitud": lat, "longitud": lon})
+        # Denser towards the centre, with some busy outskirts
+        pesos.append(rnd.lognormvariate(0, 0.6) * (1.5 - r / radio_km))
+    _insertar(db, models.Zona, filas_zonas)
+
+    hosp_0 = _siguiente_numero(db, models.Hospital)
+    filas_hosp, filas_doc = [], []
+    for n, z in enumerate(rnd.choices(filas_zonas, pesos, k=hospitales)):
+        lat, lon = alrededor(z["latitud"], z["longitud"], separacion_km / 2)
+        capacidad = rnd.choice([20, 40, 60, 80, 100, 150, 250])
+        tamano = capacidad / 250
+        servicios = {
+            "tiene_suero_antiescorpionico": rnd.random() < 0.2 + 0.4 * tamano,
+            "tiene_unidad_trauma": rnd.random() < 0.2 + 0.6 * tamano,
+            "tiene_cardiologia": rnd.random() < 0.3 + 0.5 * tamano,
+            "tiene_pediatria": rnd.random() < 0.3 + 0.3 * tamano,
+            "tiene_unidad_quemados": rnd.random() < 0.05 + 0.3 * tamano,
+        }
+        filas_hosp.append({
+            "nombre": f"Hospital-{hosp_0 + n}", "zona_id": z["id"], "latitud": lat, "longitud": lon,
+            "capacidad_total": capacidad, "ocupacion_actual": int(capacidad * rnd.uniform(0.3, 0.9)), "version": 0,
+            **servicios,
+        })
+        plantel = [ESPECIALISTA[s] for s, tiene in servicios.items() if tiene and s in ESPECIALISTA] or ["medicina_interna"]
+        for _ in range(2 + capacidad // 25):
+            filas_doc.append({
+                "nombre": f"Dr. {rnd.choice(APELLIDOS)}",
+                "especialidad": rnd.choice(plantel) if rnd.random() < 0.7 else rnd.choice(ESPECIALIDADES),
+                # Position in filas_hosp until the hospitals have their ids
+                "hospital_id": n, "disponible": rnd.random() < 0.7,
+            })
+    _insertar(db, models.Hospital, filas_hosp)
+    for fila in filas_doc:
+        fila["hospital_id"] = filas_hosp[fila["hospital_id"]]["id"]
+    _insertar(db, models.Doctor, filas_doc)
+
+    tipos, pesos_tipo = zip(*TIPOS_VEHICULO)
+    veh_0 = _siguiente_numero(db, models.VehiculoRescate)
+    filas_veh = []
+    for n, z in enumerate(rnd.choices(filas_zonas, pesos, k=vehiculos)):
+        lat, lon = alrededor(z["latitud"], z["longitud"], separacion_km / 2)
+        filas_veh.append({
+            "nombre": f"Movil-{veh_0 + n}", "tipo": rnd.choices(tipos, pesos_tipo)[0], "zona_id": z["id"],
+            "estado": "disponible", "latitud": lat, "longitud": lon, "version": 0,
+        })
+    _insertar(db, models.VehiculoRescate, filas_veh)
+    db.commit()
+
+    grados_lat, grados_lon = radio_km / km_lat, radio_km / km_lon
+    return {"zonas": zonas, "hospitales": hospitales, "doctores": len(filas_doc), "vehiculos": vehiculos,
+            "radio_km": radio_km, "separacion_km": separacion_km, "semilla": semilla,
+            "limites": (centro[0] - grados_lat, centro[0] + grados_lat, centro[1] - grados_lon, centro[1] + grados_lon)}
+
 
 def init_db(db: Session):
     # Check if data exists
     if db.query(models.Zona).first():
         return
 
+    if SEED_CIUDAD == "sintetica":
+        info = generar_ciudad(db)
+        print(f"[Seed] Ciudad sintética: {info['zonas']} zonas, {info['hospitales']} hospitales, "
+              f"{info['doctores']} doctores, {info['vehiculos']} vehiculos (semilla {info['semilla']}).", flush=True)
+        return
+
     # Create Zones (San Miguel de Tucuman approx)
     zonas = [
         models.Zona(nombre="Centro", latitud=-26.8300, longitud=-65.2000),
@@ -80,14 +212,15 @@ def init_db(db: Session):
 
     # Doctors
     especialidades = ["pediatra", "cardiologo", "traumatologo", "toxicologo", "medicina_interna"]
-    for h in hospitales:
-        for _ in range(random.randint(3, 6)):
-            db.add(models.Doctor(
-                nombre=f"Dr. {random.choice(['Perez', 'Gomez', 'Diaz', 'Lopez', 'Martinez'])}",
-                especialidad=random.choice(especialidades),
-                hospital_id=h.id,
-                disponible=random.choice([True, True, False]) # Mostly available
-            ))
+    db.add_all([
+        models.Doctor(
+            nombre=f"Dr. {random.choice(['Perez', 'Gomez', 'Diaz', 'Lopez', 'Martinez'])}",
+            especialidad=random.choice(especialidades),
+            hospital_id=h.id,
+            disponible=random.choice([True, True, False]) # Mostly available
+        )
+        for h in hospitales for _ in range(random.randint(3, 6))
+    ])
     db.commit()
 
     # Vehicles
@@ -101,9 +234,30 @@ def init_db(db: Session):
     db.add_all(vehiculos)
     db.commit()
 
-if __name__ == "__main__":
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Genera la ciudad sintética en DATABASE_URL")
+    parser.add_argument("--zonas", type=int, default=SEED_ZONAS)
+    parser.add_argument("--hospitales", type=int, default=SEED_HOSPITALES)
+    parser.add_argument("--vehiculos", type=int, default=SEED_VEHICULOS)
+    parser.add_argument("--radio-km", type=float, default=SEED_RADIO_KM)
+    parser.add_argument("--semilla", type=int, default=SEED_SEMILLA)
+    parser.add_argument("--reset", action="store_true", help="borra y recrea todas las tablas antes")
+    args = parser.parse_args(argv)
+
+    if args.reset:
+        models.Base.metadata.drop_all(bind=engine)
     models.Base.metadata.create_all(bind=engine)
     db = SessionLocal()
-    init_db(db)
-    db.close()
+    try:
+        if db.query(models.Zona).first():
+            raise SystemExit("La base ya tiene datos; usar --reset para regenerarla.")
+        info = generar_ciudad(db, args.zonas, args.hospitales, args.vehiculos, args.radio_km, args.semilla)
+    finally:
+        db.close()
+    print(f"[Seed] {info['zonas']} zonas, {info['hospitales']} hospitales, {info['doctores']} doctores, "
+          f"{info['vehiculos']} vehiculos en {engine.url.render_as_string(hide_password=True)}.", flush=True)
+
+
+if __name__ == "__main__":
+    main()
 
@@ -0,0 +1,124 @@
+import os
+import asyncio
+from typing import List, Optional
+
+from openai import AsyncOpenAI
+
+from . import models, database, dispatch, reservas, narrativas, capa_llm
+
+WORKER_CONCURRENCY = int(os.getenv("DISPATCH_WORKERS", "4"))
+MAX_INTENTOS = int(os.getenv("DISPATCH_MAX_RETRIES", "3"))
+
+
+class DispatchWorker:
+    """In-process worker pool that drives the agent pipeline for queued emergencies.
+
+    The queue itself is the `dispatch_jobs` table: the in-memory asyncio.Queue only holds
+    job ids, so on restart every pending/in-progress job is picked up again.
+    """
+
+    def __init__(self, concurrency: int = WORKER_CONCURRENCY):
+        self.concurrency = concurrency
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.queue: Optional[asyncio.Queue] = None
+        self.tasks: List[asyncio.Task] = []
+        self.llm_client: Optional[AsyncOpenAI] = None
+
+    async def start(self, llm_client: AsyncOpenAI):
+        self.llm_client = llm_client
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+        for job_id in await asyncio.to_thread(self._jobs_pendientes):
+            self.queue.put_nowait(job_id)
+        print(f"[Worker] Iniciando {self.concurrency} workers ({self.queue.qsize()} jobs pendientes).", flush=True)
+        self.tasks = [asyncio.create_task(self._run(n)) for n in range(self.concurrency)]
+        self.tasks.append(asyncio.create_task(self._barrer_reservas()))
+        # Deferred narratives only run while no dispatch job is waiting
+        narrativas.cola.iniciar(ocupado=lambda: self.queue.qsize() > 0)
+        capa_llm.cola.iniciar()
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        await narrativas.cola.detener()
+        await capa_llm.cola.detener()
+
+    def enqueue(self, job_id: int):
+        # Called from the request threadpool, so hand the id over to the event loop thread.
+        if self.loop is None:
+            print(f"[Worker] Worker no iniciado, job {job_id} queda pendiente en la tabla.", flush=True)
+            return
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, job_id)
+
+    def _jobs_pendientes(self) -> List[int]:
+        db = database.SessionLocal()
+        try:
+            # Interrupted on their last attempt (e.g. a crash): no retry left, so they take the same
+            # fallback as a job that failed (dispatch._marcar_error) instead of staying in progress
+            agotados = db.query(models.DispatchJob).filter(
+                models.DispatchJob.estado.in_(["pendiente", "en_proceso"]),
+                models.DispatchJob.intentos >= MAX_INTENTOS
+            ).all()
+            for job in agotados:
+                job.estado = "error"
+                job.error = f"Interrumpido tras {job.intentos} intentos"
+                if job.emergencia.estado == "analizando":
+                    job.emergencia.estado = "activa"
+            if agotados:
+                db.commit()
+                print(f"[Worker] {len(agotados)} jobs sin reintentos marcados con error.", flush=True)
+
+            jobs = db.query(models.DispatchJob.id).filter(
+                models.DispatchJob.estado.in_(["pendiente", "en_proceso"]),
+                models.DispatchJob.intentos < MAX_INTENTOS
+            ).order_by(models.DispatchJob.id).all()
+            return [j.id for j in jobs]
+        finally:
+            db.close()
+
+    def _expirar_reservas(self) -> List[int]:
+        """Releases expired holds and sends their emergencies back to the queue; returns the job ids."""
+        db = database.SessionLocal()
+        try:
+            emergencias = reservas.expirar_vencidas(db)
+            if not emergencias:
+                return []
+            for e in db.query(models.Emergencia).filter(models.Emergencia.id.in_(emergencias)):
+                e.estado = "en_cola"
+                e.hospital_asignado_id = None
+                e.vehiculo_asignado_id = None
+            jobs = db.query(models.DispatchJob).filter(
+                models.DispatchJob.emergencia_id.in_(emergencias),
+                models.DispatchJob.estado != "completado"
+            ).all()
+            for job in jobs:
+                job.estado = "pendiente"
+            db.commit()
+            print(f"[Worker] Reservas vencidas liberadas para emergencias {emergencias}.", flush=True)
+            return [job.id for job in jobs]
+        finally:
+            db.close()
+
+    async def _barrer_reservas(self):
+        while True:
+            await asyncio.sleep(reservas.RESERVA_BARRIDO_S)
+            try:
+                for job_id in await asyncio.to_thread(self._expirar_reservas):
+                    self.queue.put_nowait(job_id)
+            except Exception as e:
+                print(f"[Worker] Error liberando reservas: {e}", flush=True)
+
+    async def _run(self, n: int):
+        while True:
+            job_id = await self.queue.get()
+            try:
+                await dispatch.procesar_job(job_id, self.llm_client)
+            except Exception as e:
+                print(f"[Worker-{n}] Job {job_id} fallo: {e}", flush=True)
+            finally:
+                self.queue.task_done()
+
+
+dispatcher = DispatchWorker()
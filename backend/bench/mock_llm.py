@@ -0,0 +1,104 @@
+import json
+import re
+import random
+import asyncio
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# OpenAI-compatible stand-in for the LLM provider: answers each agent with a well-formed
+# proposal built from the ids in its prompt, after a configurable latency, and injects
+# 500s and 429s at the requested rates. With tokens_por_s the answer is generated at that
+# speed (streamed when the request asks for it), as a real model would.
+
+
+def _respuesta(system_prompt: str, user_prompt: str) -> dict:
+    if system_prompt.startswith("Eres el HospitalAgent"):
+        ids = [int(x) for x in re.findall(r'"id":\s*(\d+)', user_prompt)]
+        return {"hospital_proposals": [
+            {"hospital_id": i, "acepta": True, "prioridad": round(1 - n / 10, 2), "motivo": "Capacidad y recursos adecuados", "ocupacion_proyectada": 1}
+            for n, i in enumerate(ids[:3])
+        ]}
+    if system_prompt.startswith("Eres el VehicleAgent"):
+        ids = [int(x) for x in re.findall(r'"id":\s*(\d+)', user_prompt)]
+        return {"vehicle_proposals": [
+            {"vehiculo_id": i, "acepta": True, "prioridad": round(1 - n / 10, 2), "eta_min": 5 + n, "motivo": "Unidad cercana"}
+            for n, i in enumerate(ids[:3])
+        ]}
+    if system_prompt.startswith("Eres el CoordinatorAgent"):
+        h = re.findall(r'"hospital_id":\s*(\d+)', user_prompt)
+        v = re.findall(r'"vehiculo_id":\s*(\d+)', user_prompt)
+        decision = {"decision": {"hospital_id": int(h[0]) if h else None, "vehiculo_id": int(v[0]) if v else None,
+                                 "justificacion": "Mejor combinación de capacidad y tiempo de arribo."}}
+        if "activity_descriptions" in system_prompt:
+            # Coordinator with the narrative merged in (LLM_NARRATIVA=fusionada)
+            decision.update(_narrativa())
+        return decision
+    return _narrativa()
+
+
+def _narrativa() -> dict:
+    return {"activity_descriptions": [
+        {"agente": "HospitalAgent", "tipo": "propuesta", "descripcion": "Se evaluaron los hospitales candidatos por capacidad y especialidad."},
+        {"agente": "VehicleAgent", "tipo": "propuesta", "descripcion": "Se priorizó la unidad con menor tiempo de arribo."},
+        {"agente": "CoordinatorAgent", "tipo": "decision", "descripcion": "Asignación confirmada."},
+    ]}
+
+
+def crear_app(latencia_ms: float = 300, jitter_ms: float = 100, tasa_error: float = 0.0, tasa_429: float = 0.0,
+              semilla: int = 0, tokens_por_s: float = 0) -> FastAPI:
+    app = FastAPI()
+    rnd = random.Random(semilla)
+    app.state.stats = {"llamadas": 0, "errores_500": 0, "rechazos_429": 0, "tokens": 0}
+
+    @app.post("/v1/chat/completions")
+    async def chat(request: Request):
+        stats = app.state.stats
+        stats["llamadas"] += 1
+        body = await request.json()
+        await asyncio.sleep(max(0.0, latencia_ms + rnd.uniform(-jitter_ms, jitter_ms)) / 1000)
+
+        sorteo = rnd.random()
+        if sorteo < tasa_429:
+            stats["rechazos_429"] += 1
+            return JSONResponse({"error": {"message": "Rate limit exceeded", "type": "rate_limit"}}, status_code=429,
+                                headers={"Retry-After": "1"})
+        if sorteo < tasa_429 + tasa_error:
+            stats["errores_500"] += 1
+            return JSONResponse({"error": {"message": "Upstream error", "type": "server_error"}}, status_code=500)
+
+        mensajes = body.get("messages", [])
+        system_prompt = mensajes[0]["content"] if mensajes else ""
+        user_prompt = mensajes[-1]["content"] if mensajes else ""
+        contenido = "```json\n" + json.dumps(_respuesta(system_prompt, user_prompt), ensure_ascii=False) + "\n```"
+        prompt_tokens = (len(system_prompt) + len(user_prompt)) // 4
+        completion_tokens = len(contenido) // 4
+        stats["tokens"] += prompt_tokens + completion_tokens
+        if body.get("stream"):
+            return StreamingResponse(_stream(contenido, body.get("model", "mock"), stats["llamadas"]), media_type="text/event-stream")
+        if tokens_por_s:
+            await asyncio.sleep(completion_tokens / tokens_por_s)
+        return {
+            "id": f"bench-{stats['llamadas']}",
+            "object": "chat.completion",
+            "created": 0,
+            "model": body.get("model", "mock"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": contenido}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens},
+        }
+
+    async def _stream(contenido: str, modelo: str, n: int):
+        # ~4 characters per token, two tokens per chunk
+        for i in range(0, len(contenido), 8):
+            chunk = {"id": f"bench-{n}", "object": "chat.completion.chunk", "created": 0, "model": modelo,
+                     "choices": [{"index": 0, "delta": {"content": contenido[i:i + 8]}, "finish_reason": None}]}
+            yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+            if tokens_por_s:
+                await asyncio.sleep(2 / tokens_por_s)
+        yield "data: [DONE]\n\n"
+
+    @app.get("/stats")
+    def get_stats():
+        return app.state.stats
+
+    return app
@@ -0,0 +1,87 @@
+"""Rule-based scorer micro-benchmark.
+
+Times one dispatch decision (scoring.rankear_hospitales + rankear_vehiculos + decidir) over
+synthetic candidate lists of growing size. Dispatch only scores the candidates the spatial index
+returns (up to 2 x DISPATCH_HOSPITALES_K hospitals and DISPATCH_VEHICULOS_K vehicles), so the
+first sizes are the ones on the critical path; the larger ones show how the cost grows.
+
+    cd backend
+    python -m bench.puntuar
+    python -m bench.puntuar --candidatos 20,40,200,2000 --repeticiones 5000
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+from typing import Dict, List
+
+
+def _candidatos(n: int, rnd: random.Random, centro=(-26.83, -65.20)) -> Dict[str, List[Dict]]:
+    from app import scoring, seed
+
+    hospitales, vehiculos = [], []
+    for i in range(n):
+        capacidad = rnd.randint(40, 400)
+        hospitales.append(scoring.hospital_candidato({
+            "id": i + 1, "nombre": f"Hospital {i + 1}", "zona_id": i % 50,
+            "latitud": centro[0] + rnd.uniform(-0.2, 0.2), "longitud": centro[1] + rnd.uniform(-0.2, 0.2),
+            "capacidad_total": capacidad, "libres": rnd.randint(0, capacidad // 4),
+            "capacidades": rnd.getrandbits(5),
+            "especialidades": {e: 1 for e in seed.ESPECIALIDADES if rnd.random() < 0.5},
+        }))
+        tipo = rnd.choices([t for t, _ in seed.TIPOS_VEHICULO], [p for _, p in seed.TIPOS_VEHICULO])[0]
+        vehiculos.append({
+            "id": i + 1, "nombre": f"Movil {i + 1}", "tipo": tipo, "zona_id": i % 50,
+            "latitud": centro[0] + rnd.uniform(-0.2, 0.2), "longitud": centro[1] + rnd.uniform(-0.2, 0.2),
+        })
+    return {"hospitales": hospitales, "vehiculos": vehiculos}
+
+
+def _medir(n: int, repeticiones: int, semilla: int) -> Dict:
+    from app import scoring
+
+    rnd = random.Random(semilla)
+    cand = _candidatos(n, rnd)
+    emergencias = [
+        {"tipo": tipo, "descripcion": desc, "zona_id": 1,
+         "latitud": -26.83 + rnd.uniform(-0.1, 0.1), "longitud": -65.20 + rnd.uniform(-0.1, 0.1),
+         "perfil": scoring.perfil_emergencia(tipo, desc)}
+        for tipo, desc in [("infarto", "paro cardiaco"), ("accidente", "colision en ruta"),
+                           ("picadura", "alacran en niño"), ("incendio", "quemaduras")]
+    ]
+    tiempos = []
+    for i in range(repeticiones):
+        e = emergencias[i % len(emergencias)]
+        t0 = time.perf_counter()
+        scoring.decidir(e, scoring.rankear_hospitales(e, cand["hospitales"]), scoring.rankear_vehiculos(e, cand["vehiculos"]))
+        tiempos.append(time.perf_counter() - t0)
+    tiempos.sort()
+
+    def p(q):
+        return round(tiempos[min(len(tiempos) - 1, int(q * len(tiempos)))] * 1e6, 1)
+    return {"candidatos": n, "repeticiones": repeticiones, "p50_us": p(0.50), "p95_us": p(0.95), "p99_us": p(0.99),
+            "media_us": round(sum(tiempos) / len(tiempos) * 1e6, 1)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--candidatos", default="20,40,200,2000", help="hospitales y vehiculos por decisión (lista)")
+    parser.add_argument("--repeticiones", type=int, default=2000)
+    parser.add_argument("--semilla", type=int, default=42)
+    parser.add_argument("--salida", default=None, help="JSON de resultados")
+    args = parser.parse_args(argv)
+
+    os.environ.update({"DATABASE_URL": "sqlite://", "LLM_MODO": "off"})
+    resultados = [_medir(int(n), args.repeticiones, args.semilla) for n in args.candidatos.split(",")]
+    for r in resultados:
+        print(f"[Puntuar] {r['candidatos']:>5} candidatos: p50 {r['p50_us']} us, p99 {r['p99_us']} us", flush=True)
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            json.dump({"config": vars(args), "resultados": resultados}, f, indent=2)
+        print(f"[Puntuar] Resultados guardados en {args.salida}", file=sys.stderr, flush=True)
+
+
+if __name__ == "__main__":
+    main()
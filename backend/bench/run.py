@@ -0,0 +1,280 @@
+"""Dispatch load test.
+
+Starts a mock OpenAI-compatible server and the FastAPI app (uvicorn, in-process) on a fresh
+database seeded with a synthetic city, then drives concurrent POST /api/emergencias and
+GET /api/estado traffic. Dispatch progress is observed on /api/stream. Prints p50/p95/p99
+latencies, throughput and token usage and saves them as JSON.
+
+    cd backend
+    python -m bench.run --emergencias 300 --concurrencia 30 --hospitales 2000 --vehiculos 5000
+    python -m bench.run --latencia-ms 800 --tasa-429 0.05 --comparar bench/resultados/base.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import threading
+import contextlib
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import httpx
+import uvicorn
+
+TIPOS = [
+    ("Paro Cardíaco", "Hombre de 60 años inconsciente"),
+    ("Accidente de tránsito", "Colisión con heridos"),
+    ("Picadura de alacrán", "Niño de 5 años"),
+    ("Incendio", "Personas con quemaduras"),
+    ("Caída", "Adulto mayor con posible fractura"),
+]
+
+
+def percentiles(valores: List[float]) -> Dict:
+    if not valores:
+        return {"n": 0}
+    orden = sorted(valores)
+
+    def p(q: float) -> float:
+        return round(orden[min(len(orden) - 1, max(0, int(round(q * len(orden))) - 1))] * 1000, 2)
+
+    return {"n": len(orden), "p50_ms": p(0.50), "p95_ms": p(0.95), "p99_ms": p(0.99),
+            "media_ms": round(sum(orden) / len(orden) * 1000, 2), "max_ms": round(orden[-1] * 1000, 2)}
+
+
+def _servidor(app, puerto: int) -> uvicorn.Server:
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=puerto, log_level="warning", lifespan="on"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+class Carga:
+    def __init__(self, base: str, args, limites):
+        self.base = base
+        self.args = args
+        self.limites = limites
+        self.rnd = random.Random(args.semilla)
+        self.enviadas: Dict[int, float] = {}
+        self.lat_crear: List[float] = []
+        self.lat_despacho: List[float] = []
+        self.lat_llm: List[float] = []
+        self.lat_estado: List[float] = []
+        self.estado_codigos: Dict[int, int] = {}
+        self.errores_http = 0
+        self.despachadas: set = set()
+        self.narradas: set = set()
+        # With LLM_NARRATIVA=fusionada the CoordinatorAgent's answer carries the narrative
+        self.narradores = {"AnalystAgent"} | ({"CoordinatorAgent"} if args.llm_modo == "override" and args.narrativa == "fusionada" else set())
+        self.fin = asyncio.Event()
+
+    def _emergencia(self) -> Dict:
+        tipo, desc = self.rnd.choice(TIPOS)
+        lat_min, lat_max, lon_min, lon_max = self.limites
+        return {"tipo": tipo, "descripcion": desc, "zona_id": self.rnd.randint(1, self.args.zonas),
+                "latitud": self.rnd.uniform(lat_min, lat_max), "longitud": self.rnd.uniform(lon_min, lon_max)}
+
+    async def escuchar(self, client: httpx.AsyncClient, listo: asyncio.Event):
+        """Dispatch latency as seen by a dashboard: first 'asignada'/'activa' update and the AnalystAgent finish."""
+        async with client.stream("GET", f"{self.base}/stream", timeout=None) as r:
+            tipo = None
+            listo.set()
+            async for linea in r.aiter_lines():
+                if linea.startswith("event: "):
+                    tipo = linea[7:]
+                elif linea.startswith("data: ") and tipo:
+                    datos = json.loads(linea[6:])
+                    ahora = time.perf_counter()
+                    eid = datos.get("id") if tipo == "emergencia_actualizada" else datos.get("emergencia_id")
+                    if eid not in self.enviadas:
+                        continue
+                    if tipo == "emergencia_actualizada" and datos.get("estado") in ("asignada", "activa") and eid not in self.despachadas:
+                        self.despachadas.add(eid)
+                        self.lat_despacho.append(ahora - self.enviadas[eid])
+                    elif tipo == "agente_finalizado" and datos.get("agente") in self.narradores and eid not in self.narradas:
+                        self.narradas.add(eid)
+                        self.lat_llm.append(ahora - self.enviadas[eid])
+
+    async def productor(self, client: httpx.AsyncClient, cola: asyncio.Queue):
+        while True:
+            try:
+                cola.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            t0 = time.perf_counter()
+            try:
+                r = await client.post(f"{self.base}/emergencias", json=self._emergencia())
+                r.raise_for_status()
+                self.enviadas[r.json()["id"]] = t0
+                self.lat_crear.append(time.perf_counter() - t0)
+            except httpx.HTTPError:
+                self.errores_http += 1
+
+    async def lector(self, client: httpx.AsyncClient):
+        etag = None
+        while not self.fin.is_set():
+            t0 = time.perf_counter()
+            try:
+                r = await client.get(f"{self.base}/estado", headers={"If-None-Match": etag} if etag else {})
+                self.lat_estado.append(time.perf_counter() - t0)
+                self.estado_codigos[r.status_code] = self.estado_codigos.get(r.status_code, 0) + 1
+                etag = r.headers.get("etag", etag)
+            except httpx.HTTPError:
+                self.errores_http += 1
+            await asyncio.sleep(self.args.intervalo_lectura_ms / 1000)
+
+
+async def _ejecutar(args, base: str, limites) -> Dict:
+    carga = Carga(base, args, limites)
+    limites_http = httpx.Limits(max_connections=args.concurrencia + args.lectores + 5)
+    async with httpx.AsyncClient(timeout=30, limits=limites_http) as client:
+        listo = asyncio.Event()
+        escucha = asyncio.create_task(carga.escuchar(client, listo))
+        await listo.wait()
+
+        cola: asyncio.Queue = asyncio.Queue()
+        for n in range(args.emergencias):
+            cola.put_nowait(n)
+        lectores = [asyncio.create_task(carga.lector(client)) for _ in range(args.lectores)]
+        t0 = time.perf_counter()
+        await asyncio.gather(*[carga.productor(client, cola) for _ in range(args.concurrencia)])
+        t_envio = time.perf_counter() - t0
+
+        # Wait for every accepted emergency to be dispatched (and narrated, if the LLM layer is on;
+        # deferred narratives may be dropped under load, so they are not waited for)
+        esperar_narrativas = args.llm_modo != "off" and args.narrativa != "diferida"
+        limite = time.perf_counter() + args.timeout
+        while time.perf_counter() < limite:
+            despachadas = len(carga.despachadas & set(carga.enviadas))
+            narradas = len(carga.narradas & set(carga.enviadas))
+            if despachadas >= len(carga.enviadas) and (not esperar_narrativas or narradas >= len(carga.enviadas)):
+                break
+            await asyncio.sleep(0.1)
+        duracion = time.perf_counter() - t0
+        carga.fin.set()
+        await asyncio.gather(*lectores)
+        escucha.cancel()
+        await asyncio.gather(escucha, return_exceptions=True)
+
+        llm_stats = (await client.get(f"{base}/llm/stats")).json()
+
+    return {
+        "duracion_s": round(duracion, 2),
+        "envio_s": round(t_envio, 2),
+        "aceptadas": len(carga.enviadas),
+        "despachadas": len(carga.despachadas),
+        "narradas": len(carga.narradas),
+        "throughput_eps": round(len(carga.despachadas) / duracion, 2) if duracion else 0.0,
+        "errores_http": carga.errores_http,
+        "crear": percentiles(carga.lat_crear),
+        "despacho": percentiles(carga.lat_despacho),
+        "capa_llm": percentiles(carga.lat_llm),
+        "estado": {**percentiles(carga.lat_estado), "codigos": carga.estado_codigos},
+        "tokens": llm_stats.get("tokens"),
+        "cache": llm_stats.get("cache"),
+        "limites": llm_stats.get("limites"),
+    }
+
+
+def _comparar(actual: Dict, base: Dict):
+    print(f"\nComparación con {base.get('fecha')}:")
+    for metrica in ("crear", "despacho", "capa_llm", "estado"):
+        for p in ("p50_ms", "p95_ms", "p99_ms"):
+            antes = base["resultados"].get(metrica, {}).get(p)
+            ahora = actual["resultados"].get(metrica, {}).get(p)
+            if antes and ahora is not None:
+                print(f"  {metrica:>9} {p}: {antes:>10.2f} -> {ahora:>10.2f} ({(ahora - antes) / antes * 100:+.1f}%)")
+    antes, ahora = base["resultados"]["throughput_eps"], actual["resultados"]["throughput_eps"]
+    if antes:
+        print(f"  throughput: {antes} -> {ahora} emergencias/s ({(ahora - antes) / antes * 100:+.1f}%)")
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Benchmark del pipeline de despacho")
+    parser.add_argument("--emergencias", type=int, default=200)
+    parser.add_argument("--concurrencia", type=int, default=20, help="POST /api/emergencias simultáneos")
+    parser.add_argument("--lectores", type=int, default=5, help="dashboards consultando /api/estado")
+    parser.add_argument("--intervalo-lectura-ms", type=float, default=250)
+    parser.add_argument("--hospitales", type=int, default=2000)
+    parser.add_argument("--vehiculos", type=int, default=5000)
+    parser.add_argument("--zonas", type=int, default=200)
+    parser.add_argument("--llm-modo", choices=["off", "explicar", "override"], default="explicar")
+    parser.add_argument("--narrativa", choices=["separada", "fusionada", "diferida"], default="separada", help="LLM_NARRATIVA")
+    parser.add_argument("--llm-rpm", type=float, default=0, help="límite del cliente (0 = sin límite)")
+    parser.add_argument("--latencia-ms", type=float, default=300, help="latencia del mock LLM")
+    parser.add_argument("--jitter-ms", type=float, default=100)
+    parser.add_argument("--tokens-por-s", type=float, default=0, help="velocidad de generación del mock (0 = instantánea)")
+    parser.add_argument("--sin-streaming", action="store_true", help="LLM_STREAMING=0")
+    parser.add_argument("--tasa-error", type=float, default=0.0, help="fracción de respuestas 500")
+    parser.add_argument("--tasa-429", type=float, default=0.0, help="fracción de respuestas 429")
+    parser.add_argument("--workers", type=int, default=8, help="DISPATCH_WORKERS")
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--semilla", type=int, default=42)
+    parser.add_argument("--puerto", type=int, default=8800, help="app en este puerto, mock LLM en el siguiente")
+    parser.add_argument("--salida", default=None, help="JSON de resultados (por defecto bench/resultados/<fecha>.json)")
+    parser.add_argument("--comparar", default=None, help="JSON de una corrida anterior")
+    parser.add_argument("--verbose", action="store_true", help="muestra los logs de la app")
+    args = parser.parse_args(argv)
+
+    # The app reads its configuration at import time
+    tmp = tempfile.mkdtemp(prefix="sar-bench-")
+    os.environ.update({
+        "DATABASE_URL": f"sqlite:///{os.path.join(tmp, 'bench.db')}",
+        "OPENROUTER_API_KEY": "bench",
+        "OPENROUTER_BASE_URL": f"http://127.0.0.1:{args.puerto + 1}/v1",
+        "LLM_MODO": args.llm_modo,
+        "LLM_NARRATIVA": args.narrativa,
+        "LLM_STREAMING": "0" if args.sin_streaming else "1",
+        "LLM_RPM": str(args.llm_rpm),
+        "DISPATCH_WORKERS": str(args.workers),
+    })
+
+    from app import models, database, seed
+    from bench import mock_llm
+
+    models.Base.metadata.create_all(bind=database.engine)
+    db = database.SessionLocal()
+    t0 = time.perf_counter()
+    info_ciudad = seed.generar_ciudad(db, args.zonas, args.hospitales, args.vehiculos, semilla=args.semilla)
+    db.close()
+    print(f"[Bench] Ciudad sintética: {args.hospitales} hospitales, {args.vehiculos} vehiculos ({time.perf_counter() - t0:.1f}s).", flush=True)
+
+    salida_app = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(open(os.devnull, "w"))
+    with salida_app:
+        mock = _servidor(mock_llm.crear_app(args.latencia_ms, args.jitter_ms, args.tasa_error, args.tasa_429, args.semilla,
+                                              args.tokens_por_s), args.puerto + 1)
+        from app.main import app
+        servidor = _servidor(app, args.puerto)
+        try:
+            resultados = asyncio.run(_ejecutar(args, f"http://127.0.0.1:{args.puerto}/api", info_ciudad["limites"]))
+            resultados["mock"] = dict(mock.config.app.state.stats)
+        finally:
+            servidor.should_exit = True
+            mock.should_exit = True
+
+    informe = {
+        "fecha": datetime.utcnow().isoformat(timespec="seconds"),
+        "config": {k: v for k, v in vars(args).items() if k not in ("salida", "comparar", "verbose")},
+        "resultados": resultados,
+    }
+    print(json.dumps(informe["resultados"], indent=2, ensure_ascii=False))
+
+    salida = args.salida or os.path.join(os.path.dirname(__file__), "resultados", f"{informe['fecha'].replace(':', '')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(salida)), exist_ok=True)
+    with open(salida, "w", encoding="utf-8") as f:
+        json.dump(informe, f, indent=2, ensure_ascii=False)
+    print(f"[Bench] Resultados guardados en {salida}", flush=True)
+
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f:
+            _comparar(informe, json.load(f))
+    time.sleep(0.5)  # let the servers shut down
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,240 @@
+"""Discrete-event dispatch simulation.
+
+Replays Poisson streams of synthetic emergencies over a synthetic city on a virtual clock,
+in-process and against an in-memory database, with no LLM: each arrival goes through the
+rule-based dispatch (dispatch.despachar_lote) and the lifecycle engine (ciclo.py) moves units and
+beds along as virtual time passes. The clock jumps from event to event (next arrival, next phase
+end or discharge); events less than --resolucion-s apart are handled in one step. Prints response
+times, fleet and bed utilization and the unassigned rate, and saves them as JSON. Several fleet
+sizes run in parallel processes (one in-memory database each).
+
+    cd backend
+    python -m bench.simular --incidentes 100000 --tasa-hora 120 --vehiculos 150 --hospitales 40
+    python -m bench.simular --incidentes 20000 --tasa-hora 300 --vehiculos 100,150,200,300
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import contextlib
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# (tipo, descripcion, weight in the arrival mix)
+TIPOS = [
+    ("Paro Cardíaco", "Hombre de 60 años inconsciente", 0.15),
+    ("Accidente de tránsito", "Colisión con heridos", 0.30),
+    ("Picadura de alacrán", "Niño de 5 años", 0.10),
+    ("Incendio", "Personas con quemaduras", 0.10),
+    ("Caída", "Adulto mayor con posible fractura", 0.35),
+]
+INICIO = datetime(2025, 1, 1)
+
+
+class Llegadas:
+    """Superposition of one Poisson stream per (tipo, zona): exponential inter-arrival times at the
+    total rate, then the tipo and zona drawn by weight. Zones get a random weight (some are busier)
+    and incidents are scattered around the zone centroid."""
+
+    def __init__(self, tasa_hora: float, zonas: List[Tuple[int, float, float]], dispersion: float, semilla: int):
+        self.rnd = random.Random(semilla)
+        self.tasa_s = tasa_hora / 3600
+        self.zonas = zonas
+        self.pesos_zona = [self.rnd.uniform(0.5, 2.0) for _ in zonas]
+        self.dispersion = dispersion
+
+    def __iter__(self) -> Iterator[Dict]:
+        t = 0.0
+        while True:
+            t += self.rnd.expovariate(self.tasa_s)
+            tipo, descripcion, _ = self.rnd.choices(TIPOS, [p for *_, p in TIPOS])[0]
+            zona_id, lat, lon = self.rnd.choices(self.zonas, self.pesos_zona)[0]
+            yield {
+                "t": INICIO + timedelta(seconds=t), "tipo": tipo, "descripcion": descripcion, "zona_id": zona_id,
+                "latitud": lat + self.rnd.uniform(-self.dispersion, self.dispersion),
+                "longitud": lon + self.rnd.uniform(-self.dispersion, self.dispersion),
+            }
+
+
+def _percentiles(valores: List[float]) -> Dict:
+    if not valores:
+        return {"n": 0}
+    orden = sorted(valores)
+
+    def p(q: float) -> float:
+        return round(orden[min(len(orden) - 1, max(0, int(round(q * len(orden))) - 1))], 2)
+
+    return {"n": len(orden), "p50_min": p(0.50), "p90_min": p(0.90), "p95_min": p(0.95), "p99_min": p(0.99),
+            "media_min": round(sum(orden) / len(orden), 2), "max_min": round(orden[-1], 2)}
+
+
+def _utilizacion(muestras: List, total_vehiculos: int) -> Dict:
+    """Time-weighted means over the occupancy samples (they are taken at event times, unevenly)."""
+    if len(muestras) < 2 or not total_vehiculos:
+        return {}
+    pesos = [(b.timestamp - a.timestamp).total_seconds() for a, b in zip(muestras, muestras[1:])]
+    total = sum(pesos) or 1.0
+
+    def media(f) -> float:
+        return sum(f(m) * w for m, w in zip(muestras, pesos)) / total
+
+    return {
+        "vehiculos_media": round(media(lambda m: m.vehiculos_en_servicio) / total_vehiculos, 4),
+        "vehiculos_pico": round(max(m.vehiculos_en_servicio for m in muestras) / total_vehiculos, 4),
+        "camas_media": round(media(lambda m: m.camas_ocupadas / (m.camas_totales or 1)), 4),
+        "camas_pico": round(max(m.camas_ocupadas / (m.camas_totales or 1) for m in muestras), 4),
+        "emergencias_abiertas_media": round(media(lambda m: m.emergencias_abiertas), 1),
+    }
+
+
+def simular(args, vehiculos: int) -> Dict:
+    from app import models, database, dispatch, ciclo, geo, seed, capacidad
+
+    # Fresh city for each fleet size
+    models.Base.metadata.drop_all(bind=database.engine)
+    models.Base.metadata.create_all(bind=database.engine)
+    db = database.SessionLocal()
+    info = seed.generar_ciudad(db, args.zonas, args.hospitales, vehiculos, semilla=args.semilla)
+    geo.indice.cargar(db)
+    capacidad.vista.cargar(db)
+    zonas = [(z.id, z.latitud, z.longitud) for z in db.query(models.Zona)]
+    llegadas = iter(Llegadas(args.tasa_hora, zonas, info["separacion_km"] / 2 / geo.KM_POR_GRADO, args.semilla))
+
+    reloj = {"ahora": INICIO}
+    motor = ciclo.MotorCiclo(reloj=lambda: reloj["ahora"])
+    resolucion = timedelta(seconds=args.resolucion_s)
+    respuestas: List[float] = []
+    espera: List[float] = []
+    stats = {"incidentes": 0, "sin_vehiculo": 0, "sin_hospital": 0, "pasos": 0}
+
+    t0 = time.perf_counter()
+    siguiente = next(llegadas)
+    while stats["incidentes"] < args.incidentes:
+        evento = siguiente["t"]
+        if evento > reloj["ahora"] + resolucion:
+            # Nothing arrives in the next window: jump to the next phase end instead, if sooner
+            proximo = ciclo.proximo_vencimiento(db)
+            db.rollback()  # end the read transaction; the step writes through its own sessions
+            evento = evento if proximo is None else min(evento, proximo)
+        reloj["ahora"] = max(reloj["ahora"], evento) + resolucion
+
+        lote = []
+        while siguiente["t"] <= reloj["ahora"] and stats["incidentes"] + len(lote) < args.incidentes:
+            lote.append(siguiente)
+            siguiente = next(llegadas)
+        if lote:
+            with database.unidad_de_trabajo() as s:
+                emergencias = [models.Emergencia(
+                    tipo=l["tipo"], descripcion=l["descripcion"], zona_id=l["zona_id"], latitud=l["latitud"],
+                    longitud=l["longitud"], estado="analizando", created_at=l["t"], updated_at=l["t"],
+                ) for l in lote]
+                s.add_all(emergencias)
+                s.flush()
+                dispatch.despachar_lote(s, emergencias)
+                for e in emergencias:
+                    if not e.vehiculo_asignado_id:
+                        # Nobody to send: counted as unassigned and closed (its bed, if any, goes back)
+                        stats["sin_vehiculo"] += 1
+                        ciclo.transicionar(s, e, "resuelta", reloj["ahora"])
+                    elif not e.hospital_asignado_id:
+                        stats["sin_hospital"] += 1
+            stats["incidentes"] += len(lote)
+
+        motor.paso()
+        stats["pasos"] += 1
+        if lote:
+            # The unit arrives at fase_hasta: the travel timer starts in the same step as the dispatch
+            ids = [e.id for e in emergencias if e.vehiculo_asignado_id]
+            for e_id, fase_hasta, creada in db.query(models.Emergencia.id, models.Emergencia.fase_hasta, models.Emergencia.created_at) \
+                    .filter(models.Emergencia.id.in_(ids)):
+                if fase_hasta:
+                    respuestas.append((fase_hasta - creada).total_seconds() / 60)
+                    espera.append((reloj["ahora"] - creada).total_seconds() / 60)
+            db.rollback()
+        if args.progreso and stats["incidentes"] and stats["incidentes"] % args.progreso < len(lote):
+            print(f"[Sim] Flota {vehiculos}: {stats['incidentes']} incidentes, t={reloj['ahora'] - INICIO}, "
+                  f"{stats['incidentes'] / (time.perf_counter() - t0):.0f}/s", file=sys.stderr, flush=True)
+    segundos = time.perf_counter() - t0
+
+    muestras = db.query(models.OcupacionMuestra).order_by(models.OcupacionMuestra.timestamp).all()
+    db.close()
+    n = stats["incidentes"] or 1
+    return {
+        "vehiculos": vehiculos,
+        "incidentes": stats["incidentes"],
+        "tiempo_simulado_h": round((reloj["ahora"] - INICIO).total_seconds() / 3600, 2),
+        "respuesta": _percentiles(respuestas),
+        "espera_despacho": _percentiles(espera),
+        "tasa_sin_vehiculo": round(stats["sin_vehiculo"] / n, 4),
+        "tasa_sin_hospital": round(stats["sin_hospital"] / n, 4),
+        "utilizacion": _utilizacion(muestras, vehiculos),
+        "pasos": stats["pasos"],
+        "segundos": round(segundos, 1),
+        "incidentes_por_s": round(stats["incidentes"] / segundos, 1) if segundos else None,
+    }
+
+
+def _simular_flota(args, vehiculos: int) -> Dict:
+    print(f"[Sim] {args.incidentes} incidentes a {args.tasa_hora}/h, flota de {vehiculos}...", file=sys.stderr, flush=True)
+    salida_app = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(open(os.devnull, "w"))
+    with salida_app:
+        return simular(args, vehiculos)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Simulación de eventos discretos del despacho")
+    parser.add_argument("--incidentes", type=int, default=10000)
+    parser.add_argument("--tasa-hora", type=float, default=60, help="llegadas por hora (todas las zonas)")
+    parser.add_argument("--vehiculos", default="150", help="tamaño de flota; varios separados por coma para comparar")
+    parser.add_argument("--hospitales", type=int, default=40)
+    parser.add_argument("--zonas", type=int, default=100)
+    parser.add_argument("--escena-min", type=float, default=15, help="CICLO_ESCENA_MIN")
+    parser.add_argument("--internacion-min", type=float, default=240, help="CICLO_INTERNACION_MIN")
+    parser.add_argument("--resolucion-s", type=float, default=60, help="eventos más cercanos se procesan juntos")
+    parser.add_argument("--semilla", type=int, default=42)
+    parser.add_argument("--procesos", type=int, default=os.cpu_count() or 1, help="flotas simuladas en paralelo")
+    parser.add_argument("--progreso", type=int, default=10000, help="informe cada N incidentes (0 = nunca)")
+    parser.add_argument("--salida", default=None, help="JSON de resultados (por defecto bench/resultados/sim-<fecha>.json)")
+    parser.add_argument("--verbose", action="store_true", help="muestra los logs de la app")
+    args = parser.parse_args(argv)
+
+    # The app reads its configuration at import time
+    os.environ.update({
+        "DATABASE_URL": "sqlite://",
+        "LLM_MODO": "off",
+        "CICLO_ACELERACION": "1",
+        "CICLO_ESCENA_MIN": str(args.escena_min),
+        "CICLO_INTERNACION_MIN": str(args.internacion_min),
+        # Archive as soon as possible: the hot tables stay the size of the work in progress
+        "CICLO_ARCHIVO_S": "0",
+        "CICLO_MUESTREO_S": "300",
+        "CICLO_SERIE_HORAS": str(10 ** 6),
+    })
+
+    flotas = [int(v) for v in args.vehiculos.split(",")]
+    if args.procesos > 1 and len(flotas) > 1:
+        # Each fleet size in its own process, with its own in-memory database
+        with ProcessPoolExecutor(min(args.procesos, len(flotas))) as pool:
+            resultados = list(pool.map(_simular_flota, [args] * len(flotas), flotas))
+    else:
+        resultados = [_simular_flota(args, v) for v in flotas]
+    for resultado in resultados:
+        print(json.dumps(resultado, indent=2, ensure_ascii=False), flush=True)
+
+    informe = {
+        "fecha": datetime.utcnow().isoformat(timespec="seconds"),
+        "config": {k: v for k, v in vars(args).items() if k not in ("salida", "verbose", "progreso", "procesos")},
+        "resultados": resultados,
+    }
+    salida = args.salida or os.path.join(os.path.dirname(__file__), "resultados", f"sim-{informe['fecha'].replace(':', '')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(salida)), exist_ok=True)
+    with open(salida, "w", encoding="utf-8") as f:
+        json.dump(informe, f, indent=2, ensure_ascii=False)
+    print(f"[Sim] Resultados guardados en {salida}", file=sys.stderr, flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,25 @@
+import os
+import sys
+
+# The app reads its configuration at import time: in-memory database, no LLM layer
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+os.environ.setdefault("LLM_MODO", "off")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+from app import models, database, seed, geo, capacidad
+
+
+@pytest.fixture
+def db():
+    """Fresh demo city, with the in-memory indexes loaded from it."""
+    models.Base.metadata.drop_all(bind=database.engine)
+    models.Base.metadata.create_all(bind=database.engine)
+    sesion = database.SessionLocal()
+    seed.init_db(sesion)
+    geo.indice.vehiculos, geo.indice.hospitales = geo.SpatialIndex(), geo.SpatialIndex()
+    geo.indice.cargar(sesion)
+    capacidad.vista.cargar(sesion)
+    yield sesion
+    sesion.close()
@@ -0,0 +1,101 @@
+import json
+
+from app import models, changes, geo, capacidad, estado, pubsub
+
+VEHICULOS = models.VehiculoRescate.__tablename__
+HOSPITALES = models.Hospital.__tablename__
+
+
+def _vehiculo(version, estado_vehiculo):
+    return {"tabla": VEHICULOS, "accion": "update", "datos": {
+        "id": 1, "nombre": "Movil-1", "tipo": "ambulancia", "zona_id": 1, "estado": estado_vehiculo,
+        "latitud": -26.83, "longitud": -65.20, "version": version}}
+
+
+def _hospital(version, ocupacion):
+    return {"tabla": HOSPITALES, "accion": "update", "datos": {
+        "id": 1, "nombre": "Hospital-1", "zona_id": 1, "latitud": -26.83, "longitud": -65.20, "capacidad_total": 10,
+        "ocupacion_actual": ocupacion, "tiene_suero_antiescorpionico": False, "tiene_unidad_trauma": True,
+        "tiene_cardiologia": False, "tiene_pediatria": False, "tiene_unidad_quemados": False, "version": version}}
+
+
+def test_versiones_descarta_solo_lo_anterior():
+    versiones = changes.Versiones()
+    assert versiones.vigente(VEHICULOS, {"id": 1, "version": 3})
+    assert not versiones.vigente(VEHICULOS, {"id": 1, "version": 2})
+    # Same version again (e.g. loaded and then notified), other rows and unversioned rows pass
+    assert versiones.vigente(VEHICULOS, {"id": 1, "version": 3})
+    assert versiones.vigente(VEHICULOS, {"id": 2, "version": 1})
+    assert versiones.vigente("emergencias", {"id": 1, "estado": "activa"})
+
+
+def test_indice_ignora_snapshots_atrasados():
+    indice = geo.IndiceRecursos()
+    # Taken (version 2) is notified before the commit that had made it available (version 1)
+    indice.on_cambios([_vehiculo(2, "en_camino")])
+    indice.on_cambios([_vehiculo(1, "disponible")])
+    assert len(indice.vehiculos) == 0
+
+    indice.on_cambios([_hospital(5, 9)])
+    indice.on_cambios([_hospital(4, 8)])
+    assert indice.hospitales.items[1]["libres"] == 1
+
+
+def test_vista_capacidad_ignora_snapshots_atrasados(monkeypatch):
+    vista = capacidad.VistaCapacidad()
+    monkeypatch.setattr(capacidad, "vista", vista)
+    vista.on_cambios([_hospital(5, 9)])
+    vista.on_cambios([_hospital(4, 8)])
+    assert vista.fila(1)["ocupacion_actual"] == 9
+    assert vista.fila(1)["version"] == 5
+
+
+def test_estado_y_stream_ignoran_snapshots_atrasados(monkeypatch):
+    monkeypatch.setattr(capacidad, "vista", capacidad.VistaCapacidad())
+    cache = estado.EstadoCache()
+    desde = cache.version
+    publicados = []
+    broker = pubsub.Broker()
+    monkeypatch.setattr(broker, "publicar", lambda tipo, datos: publicados.append((tipo, datos)))
+
+    for cambio in (_vehiculo(2, "en_camino"), _vehiculo(1, "disponible")):
+        cache.on_cambios([cambio])
+        broker.on_cambios([cambio])
+
+    assert [v["estado"] for v in json.loads(cache.delta(desde))["vehiculos"]] == ["en_camino"]
+    assert [datos["estado"] for _, datos in publicados] == ["en_camino"]
+
+
+def test_doctor_que_cambia_de_hospital_actualiza_ambas_filas(db, monkeypatch):
+    # Rows of both hospitals go out again, on the stream and in /api/estado
+    publicados = []
+    monkeypatch.setattr(pubsub.broker, "versiones", changes.Versiones())
+    monkeypatch.setattr(pubsub.broker, "publicar", lambda tipo, datos: publicados.append(datos))
+    monkeypatch.setattr(estado.cache, "versiones", changes.Versiones())
+    desde = estado.cache.version
+
+    doctor = db.query(models.Doctor).filter(models.Doctor.disponible.is_(True)).first()
+    origen, especialidad = doctor.hospital_id, doctor.especialidad
+    destino = next(h.id for h in db.query(models.Hospital) if h.id != origen)
+    antes = {i: capacidad.vista.fila(i)["especialidades"].get(especialidad, 0) for i in (origen, destino)}
+    doctor.hospital_id = destino
+    db.commit()
+
+    en_estado = {h["id"]: h for h in json.loads(estado.cache.delta(desde))["hospitales"]}
+    for filas in ({h["id"]: h for h in publicados}, en_estado):
+        assert set(filas) == {origen, destino}
+        assert filas[origen]["especialidades"].get(especialidad, 0) == antes[origen] - 1
+        assert filas[destino]["especialidades"][especialidad] == antes[destino] + 1
+
+
+def test_update_lleva_los_valores_anteriores(db, monkeypatch):
+    recibidos = []
+    monkeypatch.setattr(changes, "_suscriptores", [recibidos.extend])
+    vehiculo = db.query(models.VehiculoRescate).first()
+    nombre = vehiculo.nombre
+    vehiculo.nombre = "Movil-X"
+    db.commit()
+
+    (cambio,) = recibidos
+    assert cambio["anteriores"] == {"nombre": nombre}
+    assert cambio["datos"]["nombre"] == "Movil-X"
@@ -0,0 +1,67 @@
+from datetime import datetime, timedelta
+
+from app import models, database, dispatch, ciclo
+
+
+def _ocupacion(db):
+    db.expire_all()
+    return sum(h.ocupacion_actual for h in db.query(models.Hospital))
+
+
+def test_cama_sin_vehiculo_se_libera(db):
+    disponibles = db.query(models.VehiculoRescate).filter(models.VehiculoRescate.estado == "disponible").count()
+    antes = _ocupacion(db)
+    with database.unidad_de_trabajo() as uow:
+        emergencias = [models.Emergencia(tipo="accidente", descripcion="colision", zona_id=1 + i % 4, estado="analizando")
+                       for i in range(disponibles + 2)]
+        uow.add_all(emergencias)
+        uow.flush()
+        dispatch.despachar_lote(uow, emergencias)
+    ids = [e.id for e in emergencias]
+
+    db.expire_all()
+    sin_vehiculo = [e for e in db.query(models.Emergencia).filter(models.Emergencia.id.in_(ids)) if not e.vehiculo_asignado_id]
+    assert len(sin_vehiculo) == 2
+    # Not "en camino": they wait in activa, each holding its bed
+    assert all(e.estado == "activa" and e.hospital_asignado_id for e in sin_vehiculo)
+    assert _ocupacion(db) == antes + len(ids)
+
+    ahora = datetime.utcnow()
+    with database.unidad_de_trabajo() as uow:
+        ciclo.avanzar(uow, ahora)
+    db.expire_all()
+    vence = ahora + timedelta(minutes=ciclo.CICLO_ESPERA_MIN / ciclo.CICLO_ACELERACION)
+    assert all(db.get(models.Emergencia, e.id).fase_hasta == vence for e in sin_vehiculo)
+    with database.unidad_de_trabajo() as uow:
+        assert ciclo.proximo_vencimiento(uow) <= vence
+
+    with database.unidad_de_trabajo() as uow:
+        ciclo.avanzar(uow, vence)
+
+    db.expire_all()
+    for e in sin_vehiculo:
+        e = db.get(models.Emergencia, e.id)
+        # Still open for an operator, without the bed
+        assert (e.estado, e.hospital_asignado_id, e.fase_hasta) == ("activa", None, None)
+    assert db.query(models.Reserva).filter(models.Reserva.emergencia_id.in_([e.id for e in sin_vehiculo]),
+                                           models.Reserva.estado.in_(("retenida", "confirmada"))).count() == 0
+    assert _ocupacion(db) == antes + len(ids) - 2
+
+
+def test_override_con_vehiculo_reemplaza_la_espera_de_cama(db):
+    with database.unidad_de_trabajo() as uow:
+        e = models.Emergencia(tipo="accidente", descripcion="colision", zona_id=1, estado="analizando")
+        uow.add(e)
+        uow.flush()
+        hospital_id = uow.query(models.Hospital.id).first()[0]
+    assert dispatch._aplicar_decision(e.id, {"hospital_id": hospital_id, "vehiculo_id": None}) == []
+    with database.unidad_de_trabajo() as uow:
+        ciclo.avanzar(uow, datetime.utcnow())
+
+    vehiculo_id = db.query(models.VehiculoRescate.id).filter(models.VehiculoRescate.estado == "disponible").first()[0]
+    assert dispatch._aplicar_override(e.id, {"hospital_id": hospital_id, "vehiculo_id": None},
+                                      {"hospital_id": hospital_id, "vehiculo_id": vehiculo_id})
+
+    db.expire_all()
+    e = db.get(models.Emergencia, e.id)
+    assert (e.estado, e.vehiculo_asignado_id, e.hospital_asignado_id, e.fase_hasta) == ("asignada", vehiculo_id, hospital_id, None)
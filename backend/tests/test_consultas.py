@@ -0,0 +1,111 @@
+import json
+import base64
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import models, consultas
+
+
+def _actividades(db, n_por_instante, instantes):
+    base = datetime(2026, 3, 1, 12, 0, 0, 123456)
+    filas = [models.Actividad(agente="Prueba", tipo="info", descripcion=f"{i}-{j}", timestamp=base + timedelta(seconds=i))
+             for i in range(instantes) for j in range(n_por_instante)]
+    db.add_all(filas)
+    db.commit()
+    return filas
+
+
+def _recorrer(db, modelo, filtros, limite, **kwargs):
+    paginas, cursor = [], None
+    while True:
+        pagina = consultas.paginar(db, modelo, filtros, limite=limite, cursor=cursor, **kwargs)
+        paginas.append(pagina["items"])
+        cursor = pagina["siguiente"]
+        if cursor is None:
+            return paginas
+
+
+@pytest.mark.parametrize("limite", [1, 2, 5, 7, 8, 100])
+def test_paginas_con_marcas_de_tiempo_repetidas(db, limite):
+    filas = _actividades(db, n_por_instante=7, instantes=3)
+    esperado = [f.id for f in sorted(filas, key=lambda f: (f.timestamp, f.id), reverse=True)]
+
+    paginas = _recorrer(db, models.Actividad, [models.Actividad.agente == "Prueba"], limite, fecha="timestamp")
+
+    ids = [item["id"] for pagina in paginas for item in pagina]
+    # Ties on the timestamp are broken by id: no row skipped or repeated across page boundaries
+    assert ids == esperado
+    assert all(len(pagina) == limite for pagina in paginas[:-1])
+    assert len(paginas) == max(1, -(-len(filas) // limite))
+
+
+def test_filas_nuevas_no_corren_las_paginas(db):
+    filas = _actividades(db, n_por_instante=4, instantes=2)
+    primera = consultas.paginar(db, models.Actividad, [models.Actividad.agente == "Prueba"], limite=3, fecha="timestamp")
+    # Newer rows, and one tied with the last row of the page, arrive before the next page is read
+    ultima = db.get(models.Actividad, primera["items"][-1]["id"])
+    db.add_all([models.Actividad(agente="Prueba", tipo="info", descripcion="nueva", timestamp=ultima.timestamp),
+                models.Actividad(agente="Prueba", tipo="info", descripcion="nueva", timestamp=datetime(2027, 1, 1))])
+    db.commit()
+
+    cursor, ids = primera["siguiente"], [item["id"] for item in primera["items"]]
+    while cursor:
+        pagina = consultas.paginar(db, models.Actividad, [models.Actividad.agente == "Prueba"], limite=3,
+                                   cursor=cursor, fecha="timestamp")
+        ids += [item["id"] for item in pagina["items"]]
+        cursor = pagina["siguiente"]
+
+    # Every original row exactly once; the new ones sort before the cursor and are not on later pages
+    assert sorted(ids) == sorted(f.id for f in filas)
+
+
+def test_paginas_por_id(db):
+    ids = [item["id"] for pagina in _recorrer(db, models.Hospital, [], 3) for item in pagina]
+    assert ids == sorted(h.id for h in db.query(models.Hospital))
+
+
+def test_campos_sin_la_clave(db):
+    _actividades(db, n_por_instante=3, instantes=2)
+    paginas = _recorrer(db, models.Actividad, [models.Actividad.agente == "Prueba"], 2, fecha="timestamp",
+                        campos="descripcion")
+    # The key is read for the cursor but not returned
+    assert all(list(item) == ["descripcion"] for pagina in paginas for item in pagina)
+    assert sum(len(pagina) for pagina in paginas) == 6
+
+
+def test_cursor_ida_y_vuelta():
+    ts = datetime(2026, 3, 1, 12, 0, 0, 123456)
+    cursor = consultas._codificar([ts, 42])
+    assert "=" not in cursor and "/" not in cursor and "+" not in cursor
+    assert consultas._decodificar(cursor, con_fecha=True) == [ts, 42]
+    assert consultas._decodificar(consultas._codificar([7]), con_fecha=False) == [7]
+
+
+def _b64(valor):
+    return base64.urlsafe_b64encode(json.dumps(valor).encode()).decode().rstrip("=")
+
+
+@pytest.mark.parametrize("cursor, con_fecha", [
+    ("no es base64!", True),
+    (base64.urlsafe_b64encode(b"\xff\xfe").decode(), True),
+    (_b64([]), True),
+    (_b64(["ayer", 3]), True),
+    (_b64(["2026-03-01T12:00:00", None]), True),
+    (_b64(["x"]), False),
+    (_b64(5), False),
+    (_b64({"id": 5}), False),
+    (_b64({"ts": "2026-03-01T12:00:00", "id": 5}), True),
+])
+def test_cursor_invalido(db, cursor, con_fecha):
+    with pytest.raises(consultas.ConsultaInvalida):
+        consultas._decodificar(cursor, con_fecha)
+    with pytest.raises(consultas.ConsultaInvalida):
+        consultas.paginar(db, models.Actividad, [], cursor=cursor, fecha="timestamp" if con_fecha else None)
+
+
+def test_campos_desconocidos_y_limites(db):
+    with pytest.raises(consultas.ConsultaInvalida):
+        consultas.paginar(db, models.Hospital, [], campos="id,clave_secreta")
+    assert len(consultas.paginar(db, models.Hospital, [], limite=-3)["items"]) == 1
+    assert len(consultas.paginar(db, models.Hospital, [], limite=10 ** 6)["items"]) == db.query(models.Hospital).count()
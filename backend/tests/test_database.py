@@ -0,0 +1,92 @@
+import runpy
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.pool import QueuePool, StaticPool
+
+from app import database
+
+
+def _modulo(monkeypatch, **env):
+    """Runs database.py with the given environment in a fresh namespace (the imported module and
+    its Base stay untouched)."""
+    for nombre in ("DATABASE_URL", "DB_POOL_SIZE", "DB_MAX_OVERFLOW", "DB_POOL_TIMEOUT", "DB_POOL_RECYCLE"):
+        monkeypatch.delenv(nombre, raising=False)
+    for nombre, valor in env.items():
+        monkeypatch.setenv(nombre, valor)
+    return runpy.run_path(database.__file__)
+
+
+def test_url_por_defecto_es_sqlite_en_archivo(monkeypatch):
+    modulo = _modulo(monkeypatch)
+
+    assert modulo["SQLALCHEMY_DATABASE_URL"] == "sqlite:///./sar_system.db"
+    assert modulo["engine"].dialect.name == "sqlite"
+    assert modulo["engine"].url.database == "./sar_system.db"
+
+
+def test_database_url_y_pool_desde_el_entorno(monkeypatch, tmp_path):
+    url = f"sqlite:///{tmp_path / 'sar.db'}"
+    modulo = _modulo(monkeypatch, DATABASE_URL=url, DB_POOL_SIZE="3", DB_MAX_OVERFLOW="4", DB_POOL_TIMEOUT="7")
+
+    motor = modulo["engine"]
+    assert str(motor.url) == url
+    assert isinstance(motor.pool, QueuePool)
+    assert (motor.pool.size(), motor.pool._max_overflow, motor.pool._timeout) == (3, 4, 7.0)
+    assert modulo["configuracion"]()["dialecto"] == "sqlite"
+
+
+def test_sqlite_en_archivo_usa_wal(tmp_path):
+    motor = database._crear_engine(f"sqlite:///{tmp_path / 'sar.db'}")
+
+    with motor.connect() as conn:
+        pragma = lambda nombre: conn.execute(text(f"PRAGMA {nombre}")).scalar()
+        assert pragma("journal_mode") == "wal"
+        assert pragma("synchronous") == 1  # NORMAL
+        assert pragma("busy_timeout") == database.SQLITE_BUSY_TIMEOUT_MS
+        assert pragma("temp_store") == 2  # MEMORY
+    assert isinstance(motor.pool, QueuePool)
+    assert motor.pool.size() == database.DB_POOL_SIZE
+    motor.dispose()
+
+
+def test_sqlite_en_memoria_comparte_la_conexion():
+    motor = database._crear_engine("sqlite://")
+
+    assert isinstance(motor.pool, StaticPool)
+    with motor.begin() as conn:
+        conn.execute(text("CREATE TABLE t (x INTEGER)"))
+        assert conn.execute(text("PRAGMA journal_mode")).scalar() == "memory"
+        assert conn.execute(text("PRAGMA busy_timeout")).scalar() == database.SQLITE_BUSY_TIMEOUT_MS
+    # A second checkout sees the same database
+    with motor.connect() as conn:
+        assert conn.execute(text("SELECT count(*) FROM t")).scalar() == 0
+
+
+def test_postgres_usa_pool_con_pre_ping(monkeypatch):
+    llamadas = []
+    monkeypatch.setattr(database, "create_engine", lambda url, **kwargs: llamadas.append((url, kwargs)))
+
+    database._crear_engine("postgresql+psycopg2://sar:secreto@db/sar")
+
+    assert llamadas == [("postgresql+psycopg2://sar:secreto@db/sar", {
+        "pool_size": database.DB_POOL_SIZE,
+        "max_overflow": database.DB_MAX_OVERFLOW,
+        "pool_timeout": database.DB_POOL_TIMEOUT,
+        "pool_recycle": database.DB_POOL_RECYCLE,
+        "pool_pre_ping": True,
+    })]
+
+
+def test_postgres_engine_real():
+    pytest.importorskip("psycopg2")
+    # Building the engine does not connect, so no server is needed
+    motor = database._crear_engine("postgresql+psycopg2://sar:secreto@db/sar")
+
+    assert motor.dialect.name == "postgresql"
+    assert isinstance(motor.pool, QueuePool)
+    assert motor.pool.size() == database.DB_POOL_SIZE
+    assert motor.pool._max_overflow == database.DB_MAX_OVERFLOW
+    assert motor.pool._recycle == database.DB_POOL_RECYCLE
+    assert motor.pool._pre_ping
+    assert "secreto" not in motor.url.render_as_string(hide_password=True)
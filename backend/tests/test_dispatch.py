@@ -0,0 +1,192 @@
+import json
+import time
+import asyncio
+
+import pytest
+
+from app import models, database, dispatch, agents, ratelimit, capa_llm, metrics, ciclo
+
+
+def _jobs(db, n):
+    jobs = [models.DispatchJob(emergencia=models.Emergencia(tipo="accidente", descripcion="colision", zona_id=1 + i % 4,
+                                                            estado="en_cola"))
+            for i in range(n)]
+    db.add_all(jobs)
+    db.commit()
+    return [j.id for j in jobs]
+
+
+def test_despacho_no_espera_al_llm(db, monkeypatch):
+    # LLM layer on, behind a rate limit that has nothing left for the next hour
+    monkeypatch.setattr(dispatch, "LLM_MODO", "explicar")
+    monkeypatch.setattr(agents, "llm_habilitado", lambda: True)
+    agotado = ratelimit.AsyncRateLimiter(rate=1, per=3600, burst=1)
+    agotado.tokens = 0
+    llamadas = []
+
+    async def capa_llm_limitada(agent_sys, ctx, *args):
+        llamadas.append(ctx["emergencia_id"])
+        await agotado.acquire()
+
+    monkeypatch.setattr(dispatch, "_capa_llm", capa_llm_limitada)
+    ids = _jobs(db, 8)
+
+    async def correr():
+        capa_llm.cola.iniciar()
+        try:
+            t0 = time.perf_counter()
+            # One worker, one job after the other: each must finish without waiting for the model
+            for job_id in ids:
+                await asyncio.wait_for(dispatch.procesar_job(job_id, None), 10)
+            duracion = time.perf_counter() - t0
+            await asyncio.sleep(0.05)
+            return duracion
+        finally:
+            await capa_llm.cola.detener()
+
+    duracion = asyncio.run(correr())
+
+    assert duracion < 5
+    assert llamadas  # the LLM layer was handed off, not skipped
+    db.expire_all()
+    jobs = db.query(models.DispatchJob).filter(models.DispatchJob.id.in_(ids)).all()
+    assert all(j.estado == "completado" for j in jobs)
+    # More jobs than vehicles: the rest hold a bed and wait in activa
+    assert all(j.emergencia.estado == ("asignada" if j.emergencia.vehiculo_asignado_id else "activa") for j in jobs)
+    assert all(j.emergencia.hospital_asignado_id for j in jobs)
+
+
+def test_lote_con_cama_perdida_devuelve_el_vehiculo(db):
+    from sqlalchemy import update
+    from app import database, capacidad
+
+    # Beds filled behind the capacity view's back (no change notification): the batch still
+    # picks a hospital it believes has room and loses it at reservation time
+    h = models.Hospital.__table__
+    db.execute(update(h).values(ocupacion_actual=h.c.capacidad_total))
+    db.commit()
+    assert all(f["libres"] > 0 for f in capacidad.vista.filas())
+    disponibles = {v.id for v in db.query(models.VehiculoRescate).filter(models.VehiculoRescate.estado == "disponible")}
+
+    with database.unidad_de_trabajo() as uow:
+        emergencia = models.Emergencia(tipo="infarto", descripcion="paro cardiaco", zona_id=1, estado="analizando")
+        uow.add(emergencia)
+        uow.flush()
+        decision = dispatch.despachar_lote(uow, [emergencia])[0]
+
+    db.expire_all()
+    emergencia = db.get(models.Emergencia, emergencia.id)
+    assert emergencia.estado == "en_cola"
+    assert decision["vehiculo_id"] is None and emergencia.vehiculo_asignado_id is None
+    # The vehicle it had taken before losing the bed is available again
+    assert {v.id for v in db.query(models.VehiculoRescate).filter(models.VehiculoRescate.estado == "disponible")} == disponibles
+    assert db.query(models.Reserva).count() == 0
+
+
+def test_apagado_cierra_las_deliberaciones_pendientes(db, monkeypatch):
+    # Agents that may still override, and never answer: one job running, the rest queued
+    monkeypatch.setattr(dispatch, "LLM_MODO", "override")
+    monkeypatch.setattr(agents, "llm_habilitado", lambda: True)
+    monkeypatch.setattr(capa_llm, "cola", capa_llm.ColaCapaLLM(concurrencia=1))
+
+    async def capa_llm_colgada(agent_sys, ctx, *args):
+        await asyncio.Event().wait()
+
+    monkeypatch.setattr(dispatch, "_capa_llm", capa_llm_colgada)
+    ids = _jobs(db, 3)
+
+    async def correr():
+        capa_llm.cola.iniciar()
+        for job_id in ids:
+            await dispatch.procesar_job(job_id, None)
+        await asyncio.sleep(0.05)
+        assert capa_llm.cola.pendientes() == 2
+        await capa_llm.cola.detener()
+
+    asyncio.run(correr())
+
+    db.expire_all()
+    jobs = db.query(models.DispatchJob).filter(models.DispatchJob.id.in_(ids)).all()
+    # Every deliberation fell back to the rule-based assignment: nothing left in progress or on hold
+    assert all(j.estado == "completado" for j in jobs)
+    assert all(j.emergencia.estado == "asignada" for j in jobs)
+    assert db.query(models.Reserva).filter(models.Reserva.estado == "retenida").count() == 0
+
+
+def test_traza_incluye_la_escritura_final_y_la_capa_llm(db, monkeypatch):
+    monkeypatch.setattr(dispatch, "LLM_MODO", "explicar")
+    monkeypatch.setattr(agents, "llm_habilitado", lambda: True)
+
+    async def capa_llm_falsa(agent_sys, ctx, *args):
+        async with metrics.span("agente", agente="AnalystAgent"):
+            await asyncio.sleep(0)
+
+    monkeypatch.setattr(dispatch, "_capa_llm", capa_llm_falsa)
+    job_id = _jobs(db, 1)[0]
+
+    def spans():
+        db.expire_all()
+        return [s["span"] for s in json.loads(db.get(models.DispatchJob, job_id).emergencia.traza)]
+
+    async def correr():
+        capa_llm.cola.iniciar()
+        try:
+            await dispatch.procesar_job(job_id, None)
+            # Stored once the span of the transaction that applied the decision had closed
+            assert "db.aplicar_decision" in spans()
+            await asyncio.sleep(0.05)
+        finally:
+            await capa_llm.cola.detener()
+
+    asyncio.run(correr())
+
+    # And again after the queued LLM layer
+    assert {"db.aplicar_decision", "agente"} <= set(spans())
+
+
+def _cerrar(emergencia_id):
+    with database.unidad_de_trabajo() as uow:
+        ciclo.transicionar(uow, uow.get(models.Emergencia, emergencia_id), "resuelta")
+
+
+def _sin_despacho(db, job_id):
+    db.expire_all()
+    job = db.get(models.DispatchJob, job_id)
+    assert job.estado == "completado"
+    assert job.emergencia.estado == "resuelta"
+    assert job.emergencia.vehiculo_asignado_id is None and job.emergencia.hospital_asignado_id is None
+    assert db.query(models.Reserva).count() == 0
+
+
+def test_cancelar_en_cola(db):
+    job_id = _jobs(db, 1)[0]
+    emergencia_id = db.get(models.DispatchJob, job_id).emergencia_id
+    _cerrar(emergencia_id)
+
+    asyncio.run(dispatch.procesar_job(job_id, None))
+
+    _sin_despacho(db, job_id)
+
+
+@pytest.mark.parametrize("modo", ["off", "override"])
+def test_cancelar_mientras_se_analiza(db, monkeypatch, modo):
+    monkeypatch.setattr(dispatch, "LLM_MODO", modo)
+    monkeypatch.setattr(agents, "llm_habilitado", lambda: True)
+    tomar_job = dispatch._tomar_job
+
+    def tomar_y_cerrar(job_id):
+        ctx = tomar_job(job_id)
+        # The operator closes it once the worker has it (analizando), before the decision is written
+        _cerrar(ctx["emergencia_id"])
+        return ctx
+
+    monkeypatch.setattr(dispatch, "_tomar_job", tomar_y_cerrar)
+    encoladas = []
+    monkeypatch.setattr(capa_llm.cola, "encolar", lambda *args: encoladas.append(args))
+    job_id = _jobs(db, 1)[0]
+
+    asyncio.run(dispatch.procesar_job(job_id, None))
+
+    _sin_despacho(db, job_id)
+    # Nothing to explain or override
+    assert not encoladas
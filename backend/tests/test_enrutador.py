@@ -0,0 +1,180 @@
+import time
+import asyncio
+from collections import deque
+from types import SimpleNamespace
+
+from app import agents, enrutador, ratelimit
+
+
+class _Span:
+    def __init__(self):
+        self.labels = {}
+
+    def set(self, **labels):
+        self.labels.update(labels)
+
+
+class _Stream:
+    def __init__(self, trozos, demora):
+        self.trozos, self.demora = trozos, demora
+        self.cerrado = False
+
+    def __aiter__(self):
+        return self._chunks()
+
+    async def _chunks(self):
+        for trozo in self.trozos:
+            await asyncio.sleep(self.demora)
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=trozo))], usage=None)
+
+    async def close(self):
+        self.cerrado = True
+
+
+class _Cliente:
+    """Fake client: each model answers `contenido` after `demora` seconds (streamed in two halves)."""
+
+    def __init__(self, modelos):
+        self.modelos = modelos
+        self.llamados, self.cancelados, self.streams = [], [], {}
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    async def create(self, model, stream=False, **kwargs):
+        self.llamados.append(model)
+        contenido, demora = self.modelos[model]
+        if stream:
+            mitad = len(contenido) // 2
+            self.streams[model] = _Stream([contenido[:mitad], contenido[mitad:]], demora / 2)
+            return self.streams[model]
+        try:
+            await asyncio.sleep(demora)
+        except asyncio.CancelledError:
+            self.cancelados.append(model)
+            raise
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=contenido))], usage=None)
+
+
+def _enrutador(monkeypatch, modelos, deadline_s=5.0, hedge_s=0.05, streaming=False):
+    monkeypatch.setattr(ratelimit.llm_gate, "rpm", ratelimit.AsyncRateLimiter(1000, per=1, burst=1000))
+    monkeypatch.setattr(ratelimit.llm_gate, "tpm", ratelimit.AsyncRateLimiter(10 ** 9, per=1, burst=10 ** 9))
+    monkeypatch.setattr(ratelimit.llm_gate, "breaker", ratelimit.CircuitBreaker())
+    monkeypatch.setattr(agents, "STREAMING", streaming)
+    router = enrutador.EnrutadorModelos(modelos, deadline_s=deadline_s, hedge_s=hedge_s)
+    monkeypatch.setattr(agents, "enrutador", router)
+    return router
+
+
+def _llamar(cliente, al_campo=None):
+    sp = _Span()
+    resultado = asyncio.run(agents.AgentSystem(cliente)._call_llm_enrutado(
+        "sistema", "usuario", "TestAgent", sp, None, al_campo))
+    return resultado, sp
+
+
+def test_sin_hedge_si_el_primario_responde_a_tiempo(monkeypatch):
+    router = _enrutador(monkeypatch, ["lento", "rapido"])
+    cliente = _Cliente({"lento": ('{"de": "lento"}', 0.01), "rapido": ('{"de": "rapido"}', 0)})
+
+    resultado, sp = _llamar(cliente)
+
+    assert resultado == '{"de": "lento"}'
+    assert cliente.llamados == ["lento"]
+    assert router.hedges == {"lanzados": 0, "ganados": 0}
+
+
+def test_hedge_gana_y_cancela_al_primario(monkeypatch):
+    router = _enrutador(monkeypatch, ["lento", "rapido"])
+    cliente = _Cliente({"lento": ('{"de": "lento"}', 10), "rapido": ('{"de": "rapido"}', 0)})
+
+    t0 = time.perf_counter()
+    resultado, sp = _llamar(cliente)
+
+    assert time.perf_counter() - t0 < 1
+    assert resultado == '{"de": "rapido"}' and sp.labels["modelo"] == "rapido"
+    assert cliente.llamados == ["lento", "rapido"]
+    # The loser is cancelled, and what it took so far still feeds the routing stats
+    assert cliente.cancelados == ["lento"]
+    assert [ok for _, _, ok in router.muestras["lento"]] == [True]
+    assert router.hedges == {"lanzados": 1, "ganados": 1}
+
+
+def test_hedge_perdido_tambien_se_cancela(monkeypatch):
+    router = _enrutador(monkeypatch, ["primario", "cobertura"])
+    cliente = _Cliente({"primario": ('{"de": "primario"}', 0.1), "cobertura": ('{"de": "cobertura"}', 10)})
+
+    resultado, _ = _llamar(cliente)
+
+    assert resultado == '{"de": "primario"}'
+    assert cliente.cancelados == ["cobertura"]
+    assert router.hedges == {"lanzados": 1, "ganados": 0}
+
+
+def test_respuesta_invalida_pasa_al_siguiente_modelo(monkeypatch):
+    _enrutador(monkeypatch, ["roto", "sano"], hedge_s=0)
+    cliente = _Cliente({"roto": ("no es json", 0), "sano": ('{"ok": true}', 0)})
+
+    resultado, sp = _llamar(cliente)
+
+    assert resultado == '{"ok": true}' and sp.labels["modelo"] == "sano"
+    assert cliente.llamados == ["roto", "sano"]
+
+
+def test_deadline_cancela_todo_y_devuelve_el_fallback(monkeypatch):
+    _enrutador(monkeypatch, ["a", "b"], deadline_s=0.2)
+    cliente = _Cliente({"a": ('{"de": "a"}', 10), "b": ('{"de": "b"}', 10)})
+
+    t0 = time.perf_counter()
+    resultado, sp = _llamar(cliente)
+
+    assert time.perf_counter() - t0 < 1
+    assert resultado == "{}" and sp.labels["fallback"] == "deadline"
+    assert sorted(cliente.cancelados) == ["a", "b"]
+
+
+def test_stream_del_perdedor_se_cierra_y_no_emite_campos(monkeypatch):
+    _enrutador(monkeypatch, ["lento", "rapido"], streaming=True)
+    cliente = _Cliente({"lento": ('{"decision": {"hospital_id": 1, "vehiculo_id": 1}}', 10),
+                        "rapido": ('{"decision": {"hospital_id": 2, "vehiculo_id": 3}}', 0.01)})
+    campos = []
+
+    resultado, _ = _llamar(cliente, al_campo=lambda ruta, valor: campos.append((ruta, valor)))
+
+    assert resultado == '{"decision": {"hospital_id": 2, "vehiculo_id": 3}}'
+    assert campos == [(("decision", "hospital_id"), 2), (("decision", "vehiculo_id"), 3)]
+    assert cliente.streams["lento"].cerrado and cliente.streams["rapido"].cerrado
+
+
+def _muestras(router, modelo, latencias, errores=0):
+    for segundos in latencias:
+        router.registrar(modelo, segundos, ok=True)
+    for _ in range(errores):
+        router.registrar(modelo, 0.01, ok=False)
+
+
+def test_orden_pondera_p95_por_tasa_de_error():
+    router = enrutador.EnrutadorModelos(["fiable", "erratico", "nuevo", "caido"])
+    # p95 1.0s without errors vs p95 0.5s with 40% errors: 0.5 * (1 + 4 * 0.4) = 1.3
+    _muestras(router, "fiable", [0.2] * 9 + [1.0])
+    _muestras(router, "erratico", [0.1, 0.1, 0.5], errores=2)
+    _muestras(router, "caido", [], errores=6)
+
+    # Unmeasured models go right after the best one; only errors rank last
+    assert router.orden() == ["fiable", "nuevo", "erratico", "caido"]
+
+    # Once its errors are diluted, the faster model takes over
+    _muestras(router, "erratico", [0.1] * 15)
+    assert router.orden()[0] == "erratico"
+
+
+def test_orden_olvida_muestras_viejas():
+    router = enrutador.EnrutadorModelos(["a", "b"])
+    _muestras(router, "a", [5.0] * 10)
+    _muestras(router, "b", [1.0] * 10)
+    assert router.orden() == ["b", "a"]
+
+    # "a" recovered: its slow samples age out of the window and only the fast ones count
+    router.muestras["a"] = deque(
+        ((t - enrutador.VENTANA_S - 1, s, ok) for t, s, ok in router.muestras["a"]), maxlen=200)
+    _muestras(router, "a", [0.5] * enrutador.MIN_MUESTRAS)
+    assert router.orden() == ["a", "b"]
+    assert router.resumen()["modelos"]["a"]["llamadas"] == enrutador.MIN_MUESTRAS
@@ -0,0 +1,98 @@
+import random
+
+import pytest
+
+from app import geo
+
+
+def _fuerza_bruta(puntos, lat, lon, k, filtro=None):
+    distancias = sorted(geo.haversine_km(lat, lon, p_lat, p_lon)
+                        for item_id, (p_lat, p_lon) in puntos.items() if not filtro or filtro({"id": item_id}))
+    return distancias[:k]
+
+
+def _comparar(indice, puntos, consultas, filtro=None):
+    for lat, lon in consultas:
+        for k in (1, 3, 10, 50, len(puntos) + 5):
+            obtenidos = indice.vecinos(lat, lon, k, filtro=filtro)
+            assert [d for d, _ in obtenidos] == pytest.approx(_fuerza_bruta(puntos, lat, lon, k, filtro), abs=1e-9)
+            assert all(geo.haversine_km(lat, lon, it["latitud"], it["longitud"]) == pytest.approx(d) for d, it in obtenidos)
+
+
+def _ciudad(centro, rnd, celda):
+    """Dense clusters with empty cells between them, plus points exactly on cell edges and corners."""
+    puntos = {}
+    for c in range(6):
+        c_lat, c_lon = centro[0] + rnd.uniform(-0.4, 0.4), centro[1] + rnd.uniform(-0.4, 0.4)
+        for _ in range(300):
+            puntos[len(puntos) + 1] = (c_lat + rnd.gauss(0, 0.01), c_lon + rnd.gauss(0, 0.01))
+    base_i, base_j = round(centro[0] / celda), round(centro[1] / celda)
+    for _ in range(200):
+        puntos[len(puntos) + 1] = ((base_i + rnd.randint(-15, 15)) * celda, (base_j + rnd.randint(-15, 15)) * celda)
+    return puntos
+
+
+@pytest.mark.parametrize("centro", [(-26.83, -65.20), (60.17, 24.94)])
+def test_vecinos_coinciden_con_fuerza_bruta(centro):
+    rnd = random.Random(7)
+    indice = geo.SpatialIndex(celda=0.02)
+    puntos = _ciudad(centro, rnd, indice.celda)
+    for item_id, (lat, lon) in puntos.items():
+        indice.upsert(item_id, lat, lon)
+
+    consultas = [(centro[0] + rnd.uniform(-0.5, 0.5), centro[1] + rnd.uniform(-0.5, 0.5)) for _ in range(40)]
+    # On cell edges, on an occupied point, and far outside the occupied cells
+    consultas += [(round(centro[0] / indice.celda) * indice.celda, round(centro[1] / indice.celda) * indice.celda),
+                  puntos[1], (centro[0] + 2, centro[1] - 2)]
+    _comparar(indice, puntos, consultas)
+    _comparar(indice, puntos, consultas[:10], filtro=lambda it: it["id"] % 7 == 0)
+
+
+def test_vecinos_recorre_solo_los_anillos_necesarios(monkeypatch):
+    rnd = random.Random(7)
+    indice = geo.SpatialIndex(celda=0.02)
+    puntos = _ciudad((-26.83, -65.20), rnd, indice.celda)
+    for item_id, (lat, lon) in puntos.items():
+        indice.upsert(item_id, lat, lon)
+    lat, lon = puntos[1]
+    calculadas = []
+    haversine = geo.haversine_km
+    monkeypatch.setattr(geo, "haversine_km", lambda *a: calculadas.append(a) or haversine(*a))
+
+    obtenidos = indice.vecinos(lat, lon, 5)
+
+    # Inside a dense cluster the ring walk stops early instead of measuring every point
+    assert len(calculadas) < len(puntos) // 4
+    assert [d for d, _ in obtenidos] == pytest.approx(_fuerza_bruta(puntos, lat, lon, 5))
+
+
+def test_vecinos_tras_mover_y_quitar_puntos():
+    rnd = random.Random(11)
+    indice = geo.SpatialIndex(celda=0.02)
+    puntos = _ciudad((-26.83, -65.20), rnd, indice.celda)
+    for item_id, (lat, lon) in puntos.items():
+        indice.upsert(item_id, lat, lon)
+    for item_id in rnd.sample(sorted(puntos), 600):
+        if rnd.random() < 0.5:
+            del puntos[item_id]
+            indice.remove(item_id)
+        else:
+            puntos[item_id] = (-26.83 + rnd.uniform(-0.5, 0.5), -65.20 + rnd.uniform(-0.5, 0.5))
+            indice.upsert(item_id, *puntos[item_id])
+
+    # Emptied cells are dropped, not kept as empty buckets
+    assert all(indice.celdas.values())
+    assert sum(len(ids) for ids in indice.celdas.values()) == len(puntos)
+    _comparar(indice, puntos, [(-26.83 + rnd.uniform(-0.5, 0.5), -65.20 + rnd.uniform(-0.5, 0.5)) for _ in range(30)])
+
+
+def test_pocos_puntos_dispersos_y_vacio():
+    indice = geo.SpatialIndex(celda=0.02)
+    assert indice.vecinos(-26.83, -65.20, 5) == []
+
+    # Few points over many cells: answered by the linear scan
+    puntos = {1: (-26.0, -65.0), 2: (-27.5, -66.1), 3: (-26.83, -65.20)}
+    for item_id, (lat, lon) in puntos.items():
+        indice.upsert(item_id, lat, lon)
+    _comparar(indice, puntos, [(-26.9, -65.3), (-28.0, -64.0)])
+    assert indice.vecinos(-26.83, -65.20, 5, filtro=lambda it: False) == []
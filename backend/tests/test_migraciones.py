@@ -0,0 +1,105 @@
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.orm import Session
+
+from app import migraciones, models
+
+# Tables as the first release created them: no version columns, no secondary indexes and
+# emergencias without AUTOINCREMENT
+ESQUEMA_INICIAL = """
+CREATE TABLE zonas (id INTEGER NOT NULL, nombre VARCHAR, latitud FLOAT, longitud FLOAT, PRIMARY KEY (id));
+CREATE TABLE hospitales (
+    id INTEGER NOT NULL, nombre VARCHAR, zona_id INTEGER, capacidad_total INTEGER, ocupacion_actual INTEGER,
+    tiene_suero_antiescorpionico BOOLEAN, tiene_unidad_trauma BOOLEAN, tiene_cardiologia BOOLEAN,
+    tiene_pediatria BOOLEAN, tiene_unidad_quemados BOOLEAN, latitud FLOAT, longitud FLOAT,
+    PRIMARY KEY (id), FOREIGN KEY(zona_id) REFERENCES zonas (id));
+CREATE TABLE vehiculos (
+    id INTEGER NOT NULL, nombre VARCHAR, tipo VARCHAR, zona_id INTEGER, estado VARCHAR, latitud FLOAT, longitud FLOAT,
+    PRIMARY KEY (id), FOREIGN KEY(zona_id) REFERENCES zonas (id));
+CREATE TABLE emergencias (
+    id INTEGER NOT NULL, tipo VARCHAR, descripcion VARCHAR, zona_id INTEGER, latitud FLOAT, longitud FLOAT,
+    estado VARCHAR, vehiculo_asignado_id INTEGER, hospital_asignado_id INTEGER, created_at DATETIME, updated_at DATETIME,
+    PRIMARY KEY (id), FOREIGN KEY(zona_id) REFERENCES zonas (id),
+    FOREIGN KEY(vehiculo_asignado_id) REFERENCES vehiculos (id), FOREIGN KEY(hospital_asignado_id) REFERENCES hospitales (id));
+INSERT INTO zonas VALUES (1, 'Centro', -26.83, -65.2);
+INSERT INTO hospitales VALUES (1, 'Hospital Padilla', 1, 10, 2, 0, 1, 1, 0, 0, -26.83, -65.2);
+INSERT INTO vehiculos VALUES (1, 'Movil 1', 'ambulancia', 1, 'disponible', -26.83, -65.2);
+INSERT INTO emergencias VALUES (7, 'infarto', 'paro', 1, -26.83, -65.2, 'resuelta', 1, 1, '2024-01-01', '2024-01-01');
+"""
+
+
+def _engine_inicial(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'sar_system.db'}")
+    with engine.begin() as conn:
+        for sentencia in ESQUEMA_INICIAL.split(";"):
+            if sentencia.strip():
+                conn.exec_driver_sql(sentencia)
+    # Same order as startup: create the tables that did not exist yet, then upgrade the rest
+    models.Base.metadata.create_all(engine)
+    return engine
+
+
+def test_actualiza_tablas_existentes(tmp_path):
+    engine = _engine_inicial(tmp_path)
+
+    pasos = migraciones.actualizar(engine)
+
+    assert "hospitales.version" in pasos
+    assert "emergencias AUTOINCREMENT" in pasos
+    insp = inspect(engine)
+    for tabla in models.Base.metadata.sorted_tables:
+        assert {c.name for c in tabla.columns} <= {c["name"] for c in insp.get_columns(tabla.name)}, tabla.name
+        assert {i.name for i in tabla.indexes} <= {i["name"] for i in insp.get_indexes(tabla.name)}, tabla.name
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT id, estado FROM emergencias")).all() == [(7, "resuelta")]
+        assert conn.execute(text("SELECT version FROM hospitales")).scalar() == 0
+        # ids already handed out (including archived ones) are never reused
+        assert conn.execute(text("SELECT seq FROM sqlite_sequence WHERE name = 'emergencias'")).scalar() == 7
+
+    assert migraciones.actualizar(engine) == []
+
+
+def test_actualizacion_fallida_no_deja_cambios(tmp_path, monkeypatch):
+    engine = _engine_inicial(tmp_path)
+
+    def corte(conn, tabla):
+        raise RuntimeError("corte")
+    monkeypatch.setattr(migraciones, "_indices", corte)
+    try:
+        migraciones.actualizar(engine)
+    except RuntimeError:
+        pass
+
+    insp = inspect(engine)
+    assert "version" not in {c["name"] for c in insp.get_columns("hospitales")}
+    assert "emergencias_nueva" not in insp.get_table_names()
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT id FROM emergencias")).scalars().all() == [7]
+
+
+def test_version_de_filas_existentes(tmp_path):
+    """Hospitals and vehicles from before optimistic locking get version 0 and stay updatable."""
+    engine = _engine_inicial(tmp_path)
+    migraciones.actualizar(engine)
+
+    with Session(engine) as db:
+        hospital, vehiculo = db.get(models.Hospital, 1), db.get(models.VehiculoRescate, 1)
+        assert (hospital.version, vehiculo.version) == (0, 0)
+        hospital.ocupacion_actual += 1
+        vehiculo.estado = "en_camino"
+        db.commit()
+        assert (hospital.version, vehiculo.version) == (1, 1)
+    with engine.connect() as conn:
+        # Rows written without the ORM get the server-side default too
+        conn.execute(text("INSERT INTO vehiculos (id, nombre, estado) VALUES (2, 'Movil 2', 'disponible')"))
+        assert conn.execute(text("SELECT version FROM vehiculos WHERE id = 2")).scalar() == 0
+
+
+def test_version_tiene_default_en_el_servidor(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'nueva.db'}")
+    models.Base.metadata.create_all(engine)
+
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO hospitales (id, nombre) VALUES (1, 'Hospital Padilla')"))
+        conn.execute(text("INSERT INTO vehiculos (id, nombre) VALUES (1, 'Movil 1')"))
+        assert conn.execute(text("SELECT version FROM hospitales")).scalar() == 0
+        assert conn.execute(text("SELECT version FROM vehiculos")).scalar() == 0
@@ -0,0 +1,148 @@
+import time
+import asyncio
+from types import SimpleNamespace
+
+import httpx
+import openai
+
+from app import agents, ratelimit
+
+
+class _Span:
+    def set(self, **labels):
+        pass
+
+
+def _cliente(create):
+    return SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+
+
+def _breaker_listo_para_probar(monkeypatch):
+    breaker = ratelimit.CircuitBreaker(umbral=1, enfriamiento=30)
+    breaker.estado = "abierto"
+    breaker.abierto_desde = time.monotonic() - 31
+    monkeypatch.setattr(ratelimit.llm_gate, "breaker", breaker)
+    return breaker
+
+
+def _llamar(sistema):
+    return sistema._call_llm_remoto("sistema", "usuario", "TestAgent", _Span(), modelo="modelo-test")
+
+
+def test_prueba_rechazada_con_400_no_bloquea_el_circuito(monkeypatch):
+    breaker = _breaker_listo_para_probar(monkeypatch)
+
+    async def create(**kwargs):
+        respuesta = httpx.Response(400, request=httpx.Request("POST", "http://llm.test/chat/completions"))
+        raise openai.BadRequestError("bad request", response=respuesta, body=None)
+
+    resultado = asyncio.run(_llamar(agents.AgentSystem(_cliente(create))))
+
+    assert resultado == "{}"
+    assert breaker.estado == "abierto"
+    # The cooldown was already served: the next call is the new probe
+    assert breaker.permitir()
+    assert breaker.estado == "semi_abierto"
+
+
+def test_prueba_cancelada_no_bloquea_el_circuito(monkeypatch):
+    breaker = _breaker_listo_para_probar(monkeypatch)
+
+    async def create(**kwargs):
+        await asyncio.sleep(10)
+
+    async def correr():
+        tarea = asyncio.create_task(_llamar(agents.AgentSystem(_cliente(create))))
+        await asyncio.sleep(0.05)
+        assert breaker.estado == "semi_abierto"
+        # A lost hedge race or the routing deadline cancels the probe
+        tarea.cancel()
+        await asyncio.gather(tarea, return_exceptions=True)
+
+    asyncio.run(correr())
+
+    assert breaker.estado == "abierto"
+    assert breaker.permitir()
+
+
+def test_prueba_sin_resultado_vence_tras_el_enfriamiento():
+    breaker = ratelimit.CircuitBreaker(umbral=1, enfriamiento=30)
+    breaker.fallo()
+    breaker.abierto_desde -= 31
+    assert breaker.permitir()
+    assert not breaker.permitir()  # only one probe at a time
+
+    breaker.prueba_desde -= 31
+    assert breaker.permitir()
+    assert breaker.estado == "semi_abierto"
+
+
+def _sin_limites(monkeypatch):
+    monkeypatch.setattr(ratelimit.llm_gate, "rpm", ratelimit.AsyncRateLimiter(1000, per=1, burst=1000))
+    monkeypatch.setattr(ratelimit.llm_gate, "tpm", ratelimit.AsyncRateLimiter(10 ** 9, per=1, burst=10 ** 9))
+
+
+def _error_429():
+    respuesta = httpx.Response(429, headers={"retry-after": "0.01"},
+                               request=httpx.Request("POST", "http://llm.test/chat/completions"))
+    return openai.RateLimitError("rate limited", response=respuesta, body=None)
+
+
+def _respuesta(contenido):
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=contenido))], usage=None)
+
+
+def test_429_no_abre_el_circuito(monkeypatch):
+    _sin_limites(monkeypatch)
+    monkeypatch.setattr(agents, "STREAMING", False)
+    breaker = ratelimit.CircuitBreaker(umbral=1, enfriamiento=30)
+    monkeypatch.setattr(ratelimit.llm_gate, "breaker", breaker)
+    llamadas = []
+
+    async def create(**kwargs):
+        llamadas.append(kwargs)
+        raise _error_429()
+
+    resultado = asyncio.run(_llamar(agents.AgentSystem(_cliente(create))))
+
+    assert resultado == "{}"
+    assert len(llamadas) == 3
+    assert (breaker.estado, breaker.fallos) == ("cerrado", 0)
+
+
+def test_reintento_no_pasa_con_el_circuito_abierto(monkeypatch):
+    _sin_limites(monkeypatch)
+    monkeypatch.setattr(agents, "STREAMING", False)
+    breaker = ratelimit.CircuitBreaker(umbral=1, enfriamiento=30)
+    monkeypatch.setattr(ratelimit.llm_gate, "breaker", breaker)
+    llamadas = []
+
+    async def create(**kwargs):
+        llamadas.append(kwargs)
+        # Meanwhile other calls found the provider down
+        breaker.fallo()
+        raise _error_429()
+
+    resultado = asyncio.run(_llamar(agents.AgentSystem(_cliente(create))))
+
+    assert resultado == "{}"
+    assert len(llamadas) == 1
+    assert breaker.estado == "abierto"
+
+
+def test_prueba_con_429_reintenta_y_cierra_el_circuito(monkeypatch):
+    _sin_limites(monkeypatch)
+    monkeypatch.setattr(agents, "STREAMING", False)
+    breaker = _breaker_listo_para_probar(monkeypatch)
+    respuestas = [_error_429(), _respuesta('{"ok": true}')]
+
+    async def create(**kwargs):
+        respuesta = respuestas.pop(0)
+        if isinstance(respuesta, Exception):
+            raise respuesta
+        return respuesta
+
+    resultado = asyncio.run(_llamar(agents.AgentSystem(_cliente(create))))
+
+    assert resultado == '{"ok": true}'
+    assert breaker.estado == "cerrado"
@@ -0,0 +1,145 @@
+import json
+
+import pytest
+
+from app import respuestas
+
+
+@pytest.mark.parametrize("texto", [
+    '{"decision": {"hospital_id": 2, "vehiculo_id": 3}}',
+    '```json\n{"decision": {"hospital_id": 2, "vehiculo_id": 3}}\n```',
+    'Claro, aquí va:\n```\n{"decision": {"hospital_id": 2, "vehiculo_id": 3}}\n```\nSaludos',
+    'Decisión: {"decision": {"hospital_id": 2, "vehiculo_id": 3}} fin',
+])
+def test_fences_y_texto_alrededor(texto):
+    data, _ = respuestas.extraer_json(texto)
+    assert data == {"decision": {"hospital_id": 2, "vehiculo_id": 3}}
+
+
+def test_json_valido_no_cuenta_como_reparado():
+    assert respuestas.extraer_json('```json\n{"a": 1}\n```') == ({"a": 1}, False)
+
+
+@pytest.mark.parametrize("texto, esperado", [
+    ('{"decision": {"hospital_id": 2, "vehiculo_id": 3,}}', {"decision": {"hospital_id": 2, "vehiculo_id": 3}}),
+    ('{"a": [1, 2, ], "b": {"c": true ,} ,}', {"a": [1, 2], "b": {"c": True}}),
+    ('```\n{"a": [1, 2,]}\n```', {"a": [1, 2]}),
+    # Python literals
+    ('{"acepta": True, "eta_min": None, "b": False}', {"acepta": True, "eta_min": None, "b": False}),
+])
+def test_comas_finales_y_literales(texto, esperado):
+    assert respuestas.extraer_json(texto) == (esperado, True)
+
+
+@pytest.mark.parametrize("texto, esperado", [
+    # Cut inside a key, a string value and a literal: the incomplete element is dropped
+    ('{"hospital_proposals": [{"hospital_id": 1, "acepta": true}, {"hospital_id": 2, "acep',
+     {"hospital_proposals": [{"hospital_id": 1, "acepta": True}, {"hospital_id": 2}]}),
+    ('{"decision": {"hospital_id": 2, "justificacion": "por cercan',
+     {"decision": {"hospital_id": 2}}),
+    ('{"hospital_proposals": [{"hospital_id": 1, "acepta": true}, {"hospital_id": 2, "acepta": fal',
+     {"hospital_proposals": [{"hospital_id": 1, "acepta": True}, {"hospital_id": 2}]}),
+    # A number cut at the end may be missing digits: not trusted
+    ('{"decision": {"hospital_id": 12', {"decision": {}}),
+    ('```json\n{"a": [1, [2, 3], ', {"a": [1, [2, 3]]}),
+])
+def test_objetos_truncados(texto, esperado):
+    assert respuestas.extraer_json(texto) == (esperado, True)
+
+
+def test_escapes_dentro_de_cadenas():
+    texto = '{"justificacion": "dijo \\"ya voy\\", {no es json}", "hospital_id": 3,'
+    assert respuestas.extraer_json(texto) == ({"justificacion": 'dijo "ya voy", {no es json}', "hospital_id": 3}, True)
+
+
+@pytest.mark.parametrize("texto", ["", "sin json", "```\nnada\n```", "[" + "1," * respuestas.REPARAR_MAX_CHARS])
+def test_sin_json_recuperable(texto):
+    with pytest.raises(ValueError):
+        respuestas.extraer_json(texto)
+
+
+def test_truncado_y_validado_descarta_solo_el_item_incompleto():
+    texto = ('```json\n{"hospital_proposals": [{"hospital_id": 1, "acepta": true, "prioridad": 1.7}, '
+             '{"hospital_id": 2, "acepta": false, "motivo": "lleno"}, {"hospital_id": 3, "acep')
+    data, reparado = respuestas.extraer_json(texto)
+    validado, descartados = respuestas.validar(respuestas.RespuestaHospital, data)
+
+    assert reparado and descartados == 1
+    assert [(p["hospital_id"], p["acepta"], p["prioridad"]) for p in validado["hospital_proposals"]] == \
+        [(1, True, 1.0), (2, False, 0.0)]
+
+
+def test_validar_acepta_respuestas_sin_envoltorio():
+    # The decision object without {"decision": ...} and a single proposal without its list
+    assert respuestas.validar(respuestas.RespuestaCoordinador, {"hospital_id": 2, "vehiculo_id": None}) == \
+        ({"decision": {"hospital_id": 2, "vehiculo_id": None, "justificacion": ""}}, 0)
+    validado, descartados = respuestas.validar(respuestas.RespuestaVehiculo,
+                                               {"vehicle_proposals": {"vehiculo_id": 4, "acepta": True}})
+    assert descartados == 0 and [p["vehiculo_id"] for p in validado["vehicle_proposals"]] == [4]
+    assert respuestas.validar(respuestas.RespuestaCoordinador, "texto") == ({"decision": {}}, 1)
+
+
+def test_response_format():
+    assert respuestas.response_format(respuestas.RespuestaCoordinador, "off") is None
+    assert respuestas.response_format(respuestas.RespuestaCoordinador, "json_object") == {"type": "json_object"}
+    formato = respuestas.response_format(respuestas.RespuestaCoordinador, "json_schema")
+    assert formato["json_schema"]["name"] == "decision"
+    json.dumps(formato)
+
+
+RESPUESTA_NARRADA = ('```json\n{"decision": {"hospital_id": 12, "vehiculo_id": null, '
+                     '"justificacion": "dijo \\"ya\\", {no es json} [x]"}, '
+                     '"activity_descriptions": [{"agente": "HospitalAgent", "descripcion": "d1"}, '
+                     '{"agente": "VehicleAgent", "tipo": "propuesta", "descripcion": "d2"}]}\n```\n{"otro": 1}')
+
+EVENTOS_NARRADA = [
+    (("decision", "hospital_id"), 12),
+    (("decision", "vehiculo_id"), None),
+    (("decision", "justificacion"), 'dijo "ya", {no es json} [x]'),
+    (("activity_descriptions", 0, "agente"), "HospitalAgent"),
+    (("activity_descriptions", 0, "descripcion"), "d1"),
+    (("activity_descriptions", 1, "agente"), "VehicleAgent"),
+    (("activity_descriptions", 1, "tipo"), "propuesta"),
+    (("activity_descriptions", 1, "descripcion"), "d2"),
+]
+
+
+def _alimentar(trozos):
+    parser = respuestas.ParserIncremental()
+    return [evento for trozo in trozos for evento in parser.alimentar(trozo)]
+
+
+@pytest.mark.parametrize("largo", [1, 2, 3, 7, 64, len(RESPUESTA_NARRADA)])
+def test_parser_incremental_no_depende_de_los_cortes(largo):
+    trozos = [RESPUESTA_NARRADA[i:i + largo] for i in range(0, len(RESPUESTA_NARRADA), largo)]
+    # Fences before the object and whatever follows it are ignored
+    assert _alimentar(trozos) == EVENTOS_NARRADA
+
+
+def test_parser_incremental_coincide_con_extraer_json():
+    data, _ = respuestas.extraer_json(RESPUESTA_NARRADA)
+    for ruta, valor in _alimentar([RESPUESTA_NARRADA]):
+        nodo = data
+        for paso in ruta:
+            nodo = nodo[paso]
+        assert nodo == valor
+
+
+def test_decision_temprana_antes_de_la_justificacion():
+    parser = respuestas.ParserIncremental()
+    # A literal is complete only once its delimiter arrives: "1" may still become "12"
+    assert parser.alimentar('```json\n{"decision": {"hospital_id": 1') == []
+    assert parser.alimentar('2, "vehiculo_id": ') == [(("decision", "hospital_id"), 12)]
+    assert parser.alimentar('4, "justificacion": "el más cer') == [(("decision", "vehiculo_id"), 4)]
+    # The ids are already out while the justification keeps streaming
+    assert parser.alimentar('cano"}') == [(("decision", "justificacion"), "el más cercano")]
+    assert parser.alimentar('}\n```') == []
+    assert parser.terminado
+
+
+def test_parser_incremental_truncado_no_emite_valores_parciales():
+    texto = '{"decision": {"hospital_id": 3, "vehiculo_id": 4'
+    assert _alimentar([texto]) == [(("decision", "hospital_id"), 3)]
+    assert _alimentar(['{"decision": {"justificacion": "cortad']) == []
+    # Python literals as a sloppy model writes them
+    assert _alimentar(['{"a": True, "b": None}']) == [(("a",), True), (("b",), None)]
@@ -0,0 +1,33 @@
+from sqlalchemy import event, func
+
+from app import models, seed
+
+
+def test_ciudad_sintetica_deja_los_ids_a_la_base(db):
+    antes = db.query(func.max(models.Hospital.id)).scalar()
+
+    inserts = []
+    def capturar(conn, cursor, sentencia, parametros, contexto, executemany):
+        if sentencia.startswith("INSERT"):
+            inserts.append(sentencia)
+    event.listen(db.get_bind(), "before_cursor_execute", capturar)
+    try:
+        info = seed.generar_ciudad(db, zonas=5, hospitales=20, vehiculos=30)
+    finally:
+        event.remove(db.get_bind(), "before_cursor_execute", capturar)
+
+    # Explicit ids would leave PostgreSQL SERIAL/IDENTITY sequences behind the data
+    assert inserts and not any(" (id, " in s for s in inserts)
+
+    hospitales = db.query(models.Hospital).filter(models.Hospital.id > antes).all()
+    assert len(hospitales) == 20
+    # Doctors follow their hospital's new id, and zones exist for every hospital
+    assert sum(len(h.doctores) for h in hospitales) == info["doctores"]
+    assert all(h.zona is not None for h in hospitales)
+    # Rows added afterwards without an id get the next one from the database
+    zona = models.Zona(nombre="Zona-extra", latitud=-26.8, longitud=-65.2)
+    hospital = models.Hospital(nombre="Hospital-extra", zona=zona, capacidad_total=10, ocupacion_actual=0)
+    vehiculo = models.VehiculoRescate(nombre="Movil-extra", tipo="ambulancia", zona=zona, estado="disponible")
+    db.add_all([zona, hospital, vehiculo, models.Doctor(nombre="Dr. Extra", especialidad="pediatra", hospital=hospital)])
+    db.commit()
+    assert hospital.id == max(h.id for h in hospitales) + 1
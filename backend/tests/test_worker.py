@@ -0,0 +1,23 @@
+from app import models, worker
+
+
+def _job(db, estado, intentos):
+    emergencia = models.Emergencia(tipo="infarto", descripcion="paro", zona_id=1, estado="analizando")
+    job = models.DispatchJob(emergencia=emergencia, estado=estado, intentos=intentos)
+    db.add(job)
+    db.commit()
+    return job
+
+
+def test_jobs_sin_reintentos_pasan_a_error(db):
+    agotado = _job(db, "en_proceso", worker.MAX_INTENTOS)
+    pendiente = _job(db, "en_proceso", worker.MAX_INTENTOS - 1)
+
+    assert worker.DispatchWorker()._jobs_pendientes() == [pendiente.id]
+
+    db.expire_all()
+    assert agotado.estado == "error"
+    assert agotado.error
+    # Same fallback as a failed job: the emergency is no longer stuck in "analizando"
+    assert agotado.emergencia.estado == "activa"
+    assert pendiente.estado == "en_proceso"
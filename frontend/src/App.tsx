@@ -1,11 +1,22 @@
-import React, { useEffect, useState } from 'react';
+import React, { useEffect, useRef, useState } from 'react';
 import { DashboardHeader } from './components/DashboardHeader';
 import { EmergencyList } from './components/EmergencyList';
 import { EmergencyDetail } from './components/EmergencyDetail';
 import { ActivityPanel } from './components/ActivityPanel';
 import { SimulationPanel } from './components/SimulationPanel';
-import { getSystemState } from './api';
-import { SystemState, Emergencia } from './types';
+import { getSystemState, getStateDelta, subscribeToStream } from './api';
+import { SystemState, StateDelta, StreamEventType } from './types';
+
+const MAX_ACTIVIDADES = 30;
+
+// Insert or replace a row by id, keeping fields the event does not carry (e.g. hospital.especialidades)
+const upsert = <T extends { id: number }>(rows: T[], row: T): T[] => {
+  const index = rows.findIndex(r => r.id === row.id);
+  if (index === -1) return [...rows, row];
+  const copy = [...rows];
+  copy[index] = { ...copy[index], ...row };
+  return copy;
+};
 
 function App() {
   const [state, setState] = useState<SystemState>({
@@ -14,30 +25,88 @@ function App() {
     vehiculos: [],
     actividades: []
   });
-  const [selectedEmergency, setSelectedEmergency] = useState<Emergencia | null>(null);
+  const [selectedId, setSelectedId] = useState<number | null>(null);
   const [lastUpdated, setLastUpdated] = useState(new Date());
+  // Agents currently running, e.g. "HospitalAgent #12"
+  const [enCurso, setEnCurso] = useState<string[]>([]);
+
+  // Version of the last snapshot/delta applied, for /api/estado?since=
+  const version = useRef(0);
+
+  const selectedEmergency = state.emergencias.find(e => e.id === selectedId) || null;
 
   const fetchData = async () => {
     try {
       const data = await getSystemState();
+      version.current = data.version || 0;
       setState(data);
       setLastUpdated(new Date());
-      
-      // If selected emergency exists, update its data from the new list
-      if (selectedEmergency) {
-        const updated = data.emergencias.find(e => e.id === selectedEmergency.id);
-        if (updated) {
-          setSelectedEmergency(updated);
-        }
-      }
     } catch (error) {
       console.error("Error fetching state", error);
     }
   };
 
+  const applyDelta = (s: SystemState, d: StateDelta): SystemState => {
+    const sin = <T extends { id: number }>(rows: T[], ids: number[]) => rows.filter(r => !ids.includes(r.id));
+    return {
+      version: d.version,
+      emergencias: d.emergencias.reduce((rows, e) => upsert(rows, e), sin(s.emergencias, d.eliminados.emergencias)),
+      hospitales: d.hospitales.reduce((rows, h) => upsert(rows, h), sin(s.hospitales, d.eliminados.hospitales)),
+      vehiculos: d.vehiculos.reduce((rows, v) => upsert(rows, v), sin(s.vehiculos, d.eliminados.vehiculos)),
+      actividades: [...d.actividades, ...s.actividades].slice(0, MAX_ACTIVIDADES)
+    };
+  };
+
+  // After a dropped stream: fetch only what changed since the last version we applied
+  const catchUp = async () => {
+    try {
+      const data = await getStateDelta(version.current);
+      version.current = data.version || 0;
+      if ('eliminados' in data) {
+        setState(s => applyDelta(s, data));
+      } else {
+        setState(data);
+      }
+      setLastUpdated(new Date());
+    } catch (error) {
+      console.error("Error fetching state delta", error);
+    }
+  };
+
+  const handleEvent = (type: StreamEventType, data: any) => {
+    setLastUpdated(new Date());
+    switch (type) {
+      case 'emergencia_creada':
+      case 'emergencia_actualizada':
+        setState(s => ({
+          ...s,
+          emergencias: data.estado === 'resuelta'
+            ? s.emergencias.filter(e => e.id !== data.id)
+            : upsert(s.emergencias, data)
+        }));
+        break;
+      case 'vehiculo_actualizado':
+        setState(s => ({ ...s, vehiculos: upsert(s.vehiculos, data) }));
+        break;
+      case 'hospital_actualizado':
+        setState(s => ({ ...s, hospitales: upsert(s.hospitales, data) }));
+        break;
+      case 'actividad':
+        setState(s => ({ ...s, actividades: [data, ...s.actividades].slice(0, MAX_ACTIVIDADES) }));
+        break;
+      case 'agente_iniciado':
+        setEnCurso(list => [...list, `${data.agente} #${data.emergencia_id}`]);
+        break;
+      case 'agente_finalizado':
+        setEnCurso(list => list.filter(a => a !== `${data.agente} #${data.emergencia_id}`));
+        break;
+    }
+  };
+
   useEffect(() => {
-    fetchData();
-  }, []); // No polling, just initial fetch
+    fetchData(); // Initial snapshot, then live updates over /api/stream
+    return subscribeToStream(handleEvent, catchUp);
+  }, []);
 
   return (
     <div className="min-h-screen bg-gray-100 flex flex-col">
@@ -53,10 +122,10 @@ function App() {
             <div className="grid grid-cols-1 md:grid-cols-2 gap-4">
               <EmergencyList 
                 emergencias={state.emergencias} 
-                onSelect={setSelectedEmergency} 
+                onSelect={e => setSelectedId(e.id)} 
                 selectedId={selectedEmergency?.id} 
               />
-              <ActivityPanel actividades={state.actividades} />
+              <ActivityPanel actividades={state.actividades} enCurso={enCurso} />
             </div>
             
             <EmergencyDetail 
@@ -1,5 +1,5 @@
 import axios from 'axios';
-import { SystemState, Emergencia } from './types';
+import { SystemState, StateDelta, Emergencia, StreamEventType } from './types';
 
 const API_URL = import.meta.env.VITE_API_URL || 'http://localhost:8000/api';
 
@@ -8,6 +8,12 @@ export const getSystemState = async (): Promise<SystemState> => {
   return response.data;
 };
 
+// Falls back to the full snapshot when the server no longer has changes that old
+export const getStateDelta = async (since: number): Promise<SystemState | StateDelta> => {
+  const response = await axios.get(`${API_URL}/estado`, { params: { since } });
+  return response.data;
+};
+
 export const createEmergencia = async (tipo: string, descripcion: string, zona_id: number): Promise<Emergencia> => {
   const response = await axios.post(`${API_URL}/emergencias`, {
     tipo,
@@ -17,3 +23,25 @@ export const createEmergencia = async (tipo: string, descripcion: string, zona_i
   return response.data;
 };
 
+
+// Server-Sent Events from /api/stream. Returns a function that closes the connection.
+// onReconnect runs when the browser re-opens a dropped stream, to catch up on missed changes.
+export const subscribeToStream = (
+  onEvent: (type: StreamEventType, data: any) => void,
+  onReconnect?: () => void
+): (() => void) => {
+  const source = new EventSource(`${API_URL}/stream`);
+  let opened = false;
+  source.onopen = () => {
+    if (opened && onReconnect) onReconnect();
+    opened = true;
+  };
+  const types: StreamEventType[] = [
+    'emergencia_creada', 'emergencia_actualizada', 'vehiculo_actualizado', 'hospital_actualizado',
+    'actividad', 'agente_iniciado', 'agente_finalizado', 'decision_aplicada'
+  ];
+  types.forEach(type => {
+    source.addEventListener(type, (event) => onEvent(type, JSON.parse((event as MessageEvent).data)));
+  });
+  return () => source.close();
+};
@@ -11,10 +11,13 @@ const getAgentColor = (agent: string) => {
   }
 };
 
-export const ActivityPanel = ({ actividades }: { actividades: Actividad[] }) => {
+export const ActivityPanel = ({ actividades, enCurso = [] }: { actividades: Actividad[]; enCurso?: string[] }) => {
   return (
     <div className="bg-white p-4 rounded shadow h-96 overflow-y-auto">
       <h2 className="text-lg font-semibold mb-4 border-b pb-2">Bitácora de Inteligencia Artificial</h2>
+      {enCurso.length > 0 && (
+        <p className="text-xs text-blue-600 mb-3 animate-pulse">En curso: {enCurso.join(', ')}</p>
+      )}
       <div className="space-y-4">
         {actividades.length === 0 && <p className="text-gray-400 text-sm italic">Esperando eventos...</p>}
         {actividades.map((act) => {
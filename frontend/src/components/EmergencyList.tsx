@@ -22,7 +22,10 @@ export const EmergencyList = ({ emergencias, onSelect, selectedId }: Props) => {
             <div className="flex justify-between items-center">
               <span className="font-medium text-gray-800">{e.tipo}</span>
               <span className={`text-xs px-2 py-1 rounded ${
-                e.estado === 'asignada' ? 'bg-green-100 text-green-800' : 'bg-red-100 text-red-800'
+                e.estado === 'asignada' ? 'bg-green-100 text-green-800'
+                  : e.estado === 'en_escena' || e.estado === 'trasladando' ? 'bg-blue-100 text-blue-800'
+                  : e.estado === 'en_cola' || e.estado === 'analizando' ? 'bg-yellow-100 text-yellow-800'
+                  : 'bg-red-100 text-red-800'
               }`}>
                 {e.estado}
               </span>
@@ -5,13 +5,6 @@ export interface Zona {
   longitud: number;
 }
 
-export interface Doctor {
-  id: number;
-  nombre: string;
-  especialidad: string;
-  disponible: boolean;
-}
-
 export interface Hospital {
   id: number;
   nombre: string;
@@ -25,7 +18,10 @@ export interface Hospital {
   tiene_unidad_quemados: boolean;
   latitud: number;
   longitud: number;
-  doctores: Doctor[];
+  // Capacity view (backend capacidad.py)
+  libres: number;
+  capacidades: number;
+  especialidades: Record<string, number>;  // available doctors per specialty
 }
 
 export interface Vehiculo {
@@ -48,6 +44,7 @@ export interface Emergencia {
   estado: string;
   vehiculo_asignado_id?: number;
   hospital_asignado_id?: number;
+  fase_hasta?: string;
   created_at: string;
 }
 
@@ -60,9 +57,31 @@ export interface Actividad {
 }
 
 export interface SystemState {
+  version?: number;
   emergencias: Emergencia[];
   hospitales: Hospital[];
   vehiculos: Vehiculo[];
   actividades: Actividad[];
 }
 
+// /api/estado?since=<version>: only the rows changed after that version
+export interface StateDelta {
+  version: number;
+  completo: false;
+  emergencias: Emergencia[];
+  hospitales: Hospital[];
+  vehiculos: Vehiculo[];
+  actividades: Actividad[];
+  eliminados: Record<'emergencias' | 'hospitales' | 'vehiculos' | 'actividades', number[]>;
+}
+
+
+export type StreamEventType =
+  | 'emergencia_creada'
+  | 'emergencia_actualizada'
+  | 'vehiculo_actualizado'
+  | 'hospital_actualizado'
+  | 'actividad'
+  | 'agente_iniciado'
+  | 'agente_finalizado'
+  | 'decision_aplicada';